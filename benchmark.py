@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+# -------------------- Configuration --------------------
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["listing", "listing_cached", "listing_async", "upload", "download", "bulk_delete", "sync_unchanged",
+             "folder_zip", "storage"]
+# A scenario regresses when ops/s drops, or p99 latency or peak RSS grows, by more than this fraction
+REGRESSION_TOLERANCE = 0.2
+
+# -------------------- Helpers --------------------
+def load_app(file_name: str, module_name: str):
+    """Import one of the app scripts by path (their file names are not valid module names)"""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(HERE, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def start_mock_server(args) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.join(HERE, "mock_graph_server.py"), "--port", "0",
+        "--latency", str(args.latency), "--throttle-rate", str(args.throttle_rate),
+        "--retry-after", str(args.retry_after), "--seed", str(args.seed),
+        "--seed-files", str(args.items), "--seed-folder", "seed"
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # First line: "Mock Graph API at <url> (...)"
+    line = server.stdout.readline()
+    server.graph_url = line.split(" at ", 1)[1].split()[0]
+    return server
+
+# -------------------- Scenarios --------------------
+def run_scenario(name: str, graph_url: str, options: Dict) -> Dict:
+    """Run one scenario in a fresh process so its peak RSS is its own"""
+    os.environ.update({
+        "GRAPH_URL": graph_url, "TOKEN_CACHE_PATH": "", "METADATA_DB_PATH": ":memory:", "HASH_CACHE_PATH": ":memory:",
+        "GRAPH_RATE_LIMIT": str(options["rate_limit"])
+    })
+    app = load_app("onedrive_gradio_r1-v2.py", "onedrive_app")
+    manager = app.OneDriveManager("benchmark-token", "", expires_in=10 ** 9)
+    rounds = options["rounds"]
+    latencies: List[float] = []
+    moved_bytes = 0
+    ops = 0
+
+    def folder(name: str) -> str:
+        item = manager.make_request("GET", f"me/drive/root:/{name}")
+        if "id" not in item:
+            item = manager.make_request("POST", "me/drive/items/root/children", json={"name": name, "folder": {}})
+        return item["id"]
+
+    started = time.perf_counter()
+    if name in ("listing", "listing_cached"):
+        manager.current_folder_id = folder("seed")
+        if name == "listing":
+            # Every round goes to the network
+            manager.listing_cache = app.ListingCache(max_entries=0)
+        else:
+            manager.list_items()
+            started = time.perf_counter()
+        for _ in range(rounds):
+            t = time.perf_counter()
+            manager.list_items()
+            latencies.append(time.perf_counter() - t)
+            ops += 1
+
+    elif name == "listing_async":
+        # Every round is a concurrent uncached listing on the async backend, as from many sessions
+        async_manager = app.AsyncOneDriveManager(manager)
+        manager.current_folder_id = folder("seed")
+        manager.listing_cache = app.ListingCache(max_entries=0)
+        
+        async def timed_listing() -> None:
+            t = time.perf_counter()
+            await async_manager.list_items()
+            latencies.append(time.perf_counter() - t)
+        
+        async def run_rounds() -> None:
+            await asyncio.gather(*(timed_listing() for _ in range(rounds)))
+        
+        started = time.perf_counter()
+        asyncio.run(run_rounds())
+        ops = rounds
+
+    elif name == "upload":
+        manager.current_folder_id = folder("upload-bench")
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            sizes = [options["small_size"]] * options["small_files"] + [options["large_size"]] * options["large_files"]
+            for i, size in enumerate(sizes):
+                path = os.path.join(tmp, f"bench-{i:04d}.bin")
+                with open(path, "wb") as f:
+                    f.write(os.urandom(size))
+                paths.append(path)
+            tracker = app.UploadTracker(paths)
+            started = time.perf_counter()
+            results = manager.upload_files(paths, tracker)
+            ops = sum("id" in item for item in results)
+            moved_bytes = sum(sizes)
+            latencies = [state["end"] - state["start"] for state in tracker.files.values() if state["end"]]
+
+    elif name == "download":
+        o3 = load_app("onedrive_gradio_o3-mini_perplexity.py", "onedrive_o3")
+        session_id = o3.sessions.create({"access_token": "benchmark-token", "expires_at": time.time() + 10 ** 9})
+        manager.current_folder_id = folder("download-bench")
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "source.bin")
+            with open(source, "wb") as f:
+                f.write(os.urandom(options["large_size"]))
+            item_id = manager.upload_file(source)["id"]
+            os.chdir(tmp)
+            started = time.perf_counter()
+            for _ in range(rounds):
+                t = time.perf_counter()
+                path = o3.download_file(session_id, item_id)
+                latencies.append(time.perf_counter() - t)
+                if os.path.exists(path):
+                    ops += 1
+                    moved_bytes += os.path.getsize(path)
+                    os.remove(path)
+            os.chdir(HERE)
+
+    elif name == "bulk_delete":
+        manager.current_folder_id = folder("delete-bench")
+        for round_number in range(rounds):
+            names = {f"r{round_number}-{i:04d}" for i in range(options["delete_items"])}
+            manager.create_folders(sorted(names))
+            ids = [item["id"] for item in manager.list_items() if item["name"] in names]
+            t = time.perf_counter()
+            results = manager.delete_items(ids)
+            latencies.append(time.perf_counter() - t)
+            ops += sum(row["ok"] for row in results)
+        # Only the deletes count towards throughput
+        started = time.perf_counter() - sum(latencies)
+
+    elif name == "sync_unchanged":
+        # Repeat syncs of a tree that is already in step: cost of comparing, not transferring
+        manager.current_folder_id = folder("sync-bench")
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(options["small_files"]):
+                with open(os.path.join(tmp, f"bench-{i:04d}.bin"), "wb") as f:
+                    f.write(os.urandom(options["small_size"]))
+            manager.sync_folder(tmp, direction="upload")
+            started = time.perf_counter()
+            for _ in range(rounds):
+                t = time.perf_counter()
+                result = manager.sync_folder(tmp)
+                latencies.append(time.perf_counter() - t)
+                ops += len(result["unchanged"])
+
+    elif name == "folder_zip":
+        # Stream a nested folder as a ZIP without keeping it: memory must not grow with the archive
+        manager.current_folder_id = folder("zip-bench")
+        with tempfile.TemporaryDirectory() as tmp:
+            sizes = [options["small_size"]] * options["small_files"] + [options["large_size"]] * options["large_files"]
+            for i, size in enumerate(sizes):
+                subdir = os.path.join(tmp, f"dir-{i % 4}")
+                os.makedirs(subdir, exist_ok=True)
+                with open(os.path.join(subdir, f"bench-{i:04d}.bin"), "wb") as f:
+                    f.write(os.urandom(size))
+            manager.sync_folder(tmp, direction="upload")
+        started = time.perf_counter()
+        for _ in range(rounds):
+            t = time.perf_counter()
+            for chunk in manager.iter_folder_zip():
+                moved_bytes += len(chunk)
+            latencies.append(time.perf_counter() - t)
+            ops += 1
+
+    elif name == "storage":
+        # First round scans the whole tree; later rounds only confirm it is unchanged
+        manager.current_folder_id = folder("storage-bench")
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(options["small_files"]):
+                subdir = os.path.join(tmp, f"dir-{i % 8}", f"sub-{i % 3}")
+                os.makedirs(subdir, exist_ok=True)
+                with open(os.path.join(subdir, f"bench-{i:04d}.bin"), "wb") as f:
+                    f.write(os.urandom(options["small_size"]))
+            manager.sync_folder(tmp, direction="upload")
+        started = time.perf_counter()
+        for _ in range(rounds):
+            t = time.perf_counter()
+            report = manager.analyze_storage(prune_bytes=0)
+            latencies.append(time.perf_counter() - t)
+            ops += "error" not in report
+
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "ops": ops,
+        "ops_per_s": ops / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mb_per_s": moved_bytes / elapsed / (1024 * 1024) if elapsed and moved_bytes else 0.0,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+# -------------------- Reporting --------------------
+def format_table(results: List[Dict]) -> str:
+    header = f"{'scenario':<16}{'ops':>7}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'MB/s':>9}{'RSS MB':>9}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['scenario']:<16}{r['ops']:>7}{r['ops_per_s']:>10.1f}{r['p50_ms']:>10.1f}"
+            f"{r['p99_ms']:>10.1f}{r['mb_per_s']:>9.1f}{r['peak_rss_mb']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+def find_regressions(results: List[Dict], baseline: List[Dict],
+                     tolerance: float = REGRESSION_TOLERANCE) -> List[str]:
+    previous = {r["scenario"]: r for r in baseline}
+    problems = []
+    for r in results:
+        old = previous.get(r["scenario"])
+        if old is None:
+            continue
+        if r["ops_per_s"] < old["ops_per_s"] * (1 - tolerance):
+            problems.append(f"{r['scenario']}: ops/s {old['ops_per_s']:.1f} -> {r['ops_per_s']:.1f}")
+        if r["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            problems.append(f"{r['scenario']}: p99 {old['p99_ms']:.1f} ms -> {r['p99_ms']:.1f} ms")
+        if r["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance):
+            problems.append(f"{r['scenario']}: peak RSS {old['peak_rss_mb']:.1f} MB -> {r['peak_rss_mb']:.1f} MB")
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark listing (sync, cached and async), upload, download, bulk delete, "
+                    "folder sync, folder ZIP and storage analysis against mock_graph_server.py"
+    )
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--rounds", type=int, default=20, help="repetitions for listing, download and delete")
+    parser.add_argument("--items", type=int, default=2000, help="files in the listed folder")
+    parser.add_argument("--small-files", type=int, default=40)
+    parser.add_argument("--small-size", type=int, default=256 * 1024)
+    parser.add_argument("--large-files", type=int, default=2)
+    parser.add_argument("--large-size", type=int, default=48 * 1024 * 1024)
+    parser.add_argument("--delete-items", type=int, default=100, help="items removed per bulk delete round")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the mock adds to each request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1, help="seed for the mock's fault injection")
+    parser.add_argument("--rate-limit", type=float, default=1000.0,
+                        help="client-side GRAPH_RATE_LIMIT; the app default would measure the limiter, not the code")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run; exit 1 on regressions")
+    args = parser.parse_args()
+
+    options = {
+        "rounds": args.rounds, "small_files": args.small_files, "small_size": args.small_size,
+        "large_files": args.large_files, "large_size": args.large_size, "delete_items": args.delete_items,
+        "rate_limit": args.rate_limit
+    }
+    server = start_mock_server(args)
+    results = []
+    try:
+        for scenario in args.scenario:
+            # One process per scenario so peak RSS is not carried over
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results.append(pool.submit(run_scenario, scenario, server.graph_url, options).result())
+            print(format_table(results[-1:]).splitlines()[-1], flush=True)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print()
+    print(format_table(results))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f))
+        for problem in regressions:
+            print("REGRESSION", problem)
+        sys.exit(1 if regressions else 0)
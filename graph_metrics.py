@@ -0,0 +1,254 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# -------------------- Configuration --------------------
+# Prometheus text endpoint served next to the app at http://METRICS_HOST:METRICS_PORT/metrics
+# (set METRICS_PORT= to turn it off; unset, each app uses its own default port)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Endpoint templates tracked separately; any beyond this are counted as "other"
+MAX_ENDPOINTS = 500
+
+# A span hook is called as hook(name, attributes=...) and returns a context manager
+# wrapped around the call, e.g. an OpenTelemetry tracer's start_as_current_span;
+# status and bytes are set on what it yields when that has set_attribute
+SpanHook = Callable[..., ContextManager]
+
+# -------------------- Endpoint Templates --------------------
+GRAPH_VERSIONS = ("/v1.0/", "/beta/")
+# root:/a/b.txt:/content addresses an item by path
+PATH_ADDRESS = re.compile(r":/[^:]*(:|$)")
+KEYED_SEGMENT = re.compile(r"/(items|drives|users|shares|permissions|thumbnails)/[^/:]+")
+# Opaque ids elsewhere, e.g. upload session and download URLs: long and containing a digit, or with a "!"
+ID_SEGMENT = re.compile(r"/(?:(?=[^/]*\d)[^/]{16,}|[^/]*![^/]*)")
+
+def endpoint_template(url: str) -> str:
+    """Reduce a URL to a low-cardinality label: ids and paths become {id} and {path}.
+
+    Graph URLs keep the part after the API version (``/me/drive/items/{id}/children``);
+    other hosts (sign-in, upload sessions, download URLs) are prefixed with the host name.
+    """
+    parts = urlsplit(url)
+    path = parts.path
+    for version in GRAPH_VERSIONS:
+        if version in path:
+            path = "/" + path.split(version, 1)[1]
+            break
+    else:
+        path = (parts.hostname or "") + path
+    path = PATH_ADDRESS.sub(r":/{path}\1", path)
+    path = KEYED_SEGMENT.sub(r"/\1/{id}", path)
+    return ID_SEGMENT.sub("/{id}", path)
+
+def content_length(headers, body=None) -> int:
+    """Bytes in a request or response: its Content-Length, else the length of ``body`` if known"""
+    length = headers.get("Content-Length")
+    if length is not None and length.isdigit():
+        return int(length)
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+# -------------------- Metrics Registry --------------------
+class GraphMetrics:
+    """Counters and latency histograms for the app's HTTP traffic.
+
+    Every request is recorded under its method and endpoint template with
+    its status, latency (to the response headers for streamed bodies) and
+    bytes sent and received (from Content-Length, so streamed bodies count
+    as declared). Retries, time spent waiting on throttling and token
+    refreshes are reported by the code that performs them. ``render``
+    produces the Prometheus text format.
+    """
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, max_endpoints: int = MAX_ENDPOINTS):
+        self.buckets = buckets
+        self.max_endpoints = max_endpoints
+        self.lock = threading.Lock()
+        self.endpoints: set = set()
+        # (method, endpoint, status) -> count
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        # (method, endpoint) -> per-bucket counts (the last is +Inf) and sum of seconds
+        self.latency: Dict[Tuple[str, str], List[int]] = {}
+        self.latency_sum: Dict[Tuple[str, str], float] = {}
+        self.bytes_sent: Dict[Tuple[str, str], int] = {}
+        self.bytes_received: Dict[Tuple[str, str], int] = {}
+        self.retries: Dict[str, int] = {}
+        self.token_refreshes: Dict[str, int] = {}
+        self.throttle_waits = 0
+        self.throttle_wait_seconds = 0.0
+        # name -> (help, read)
+        self.gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self.span_hooks: List[SpanHook] = []
+
+    def add_span_hook(self, hook: SpanHook) -> None:
+        """Wrap every request in ``hook("graph.request", attributes=...)``.
+
+        The attributes are the method, endpoint template and URL as strings.
+        If the entered span has ``set_attribute`` (OpenTelemetry spans do),
+        the status code and bytes sent and received are set on it before it
+        ends.
+        """
+        self.span_hooks.append(hook)
+
+    def add_gauge(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        """Report ``read()`` as a gauge each time the metrics are rendered"""
+        self.gauges[name] = (help_text, read)
+
+    @contextmanager
+    def track(self, method: str, url: str) -> Iterator[Dict]:
+        """Time one HTTP call inside the span hooks and record it.
+
+        The caller sets ``status``, ``bytes_out`` and ``bytes_in`` on the
+        yielded dict; a call that raises is recorded with status "error".
+        """
+        call = {"method": method.upper(), "endpoint": endpoint_template(url), "url": url,
+                "status": "error", "bytes_out": 0, "bytes_in": 0}
+        started = time.perf_counter()
+        attributes = {"http.request.method": call["method"], "graph.endpoint": call["endpoint"],
+                      "url.full": url}
+        try:
+            with ExitStack() as stack:
+                spans = [stack.enter_context(hook("graph.request", attributes=dict(attributes)))
+                         for hook in list(self.span_hooks)]
+                try:
+                    yield call
+                finally:
+                    self.finish_spans(spans, call)
+        finally:
+            self.record_request(call, time.perf_counter() - started)
+
+    @staticmethod
+    def finish_spans(spans: List, call: Dict) -> None:
+        for span in spans:
+            if not callable(getattr(span, "set_attribute", None)):
+                continue
+            if isinstance(call["status"], int):
+                span.set_attribute("http.response.status_code", call["status"])
+            span.set_attribute("graph.bytes_sent", int(call["bytes_out"]))
+            span.set_attribute("graph.bytes_received", int(call["bytes_in"]))
+
+    def record_request(self, call: Dict, seconds: float) -> None:
+        with self.lock:
+            endpoint = call["endpoint"]
+            if endpoint not in self.endpoints:
+                if len(self.endpoints) >= self.max_endpoints:
+                    endpoint = "other"
+                self.endpoints.add(endpoint)
+            key = (call["method"], endpoint)
+            status_key = key + (str(call["status"]),)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            counts = self.latency.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[bisect_left(self.buckets, seconds)] += 1
+            self.latency_sum[key] = self.latency_sum.get(key, 0.0) + seconds
+            self.bytes_sent[key] = self.bytes_sent.get(key, 0) + call["bytes_out"]
+            self.bytes_received[key] = self.bytes_received.get(key, 0) + call["bytes_in"]
+
+    def record_retry(self, reason: str, count: int = 1) -> None:
+        with self.lock:
+            self.retries[reason] = self.retries.get(reason, 0) + count
+
+    def record_throttle_wait(self, seconds: float) -> None:
+        with self.lock:
+            self.throttle_waits += 1
+            self.throttle_wait_seconds += seconds
+
+    def record_token_refresh(self, outcome: str) -> None:
+        with self.lock:
+            self.token_refreshes[outcome] = self.token_refreshes.get(outcome, 0) + 1
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str, samples) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{format_labels(labels)} {format_value(value)}")
+
+        with self.lock:
+            family("graph_requests_total", "counter", "HTTP requests by method, endpoint template and status",
+                   [("", {"method": m, "endpoint": e, "status": s}, n) for (m, e, s), n in sorted(self.requests.items())])
+            histogram = []
+            for (method, endpoint), counts in sorted(self.latency.items()):
+                labels = {"method": method, "endpoint": endpoint}
+                total = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    total += count
+                    histogram.append(("_bucket", {**labels, "le": format_value(bound)}, total))
+                histogram.append(("_sum", labels, self.latency_sum[(method, endpoint)]))
+                histogram.append(("_count", labels, total))
+            family("graph_request_duration_seconds", "histogram", "HTTP request latency", histogram)
+            family("graph_request_bytes_sent_total", "counter", "Request body bytes",
+                   [("", {"method": m, "endpoint": e}, n) for (m, e), n in sorted(self.bytes_sent.items())])
+            family("graph_response_bytes_received_total", "counter", "Response body bytes",
+                   [("", {"method": m, "endpoint": e}, n) for (m, e), n in sorted(self.bytes_received.items())])
+            family("graph_retries_total", "counter", "Requests repeated, by reason",
+                   [("", {"reason": r}, n) for r, n in sorted(self.retries.items())])
+            family("graph_throttle_waits_total", "counter", "Requests held back by the rate controller",
+                   [("", {}, self.throttle_waits)])
+            family("graph_throttle_wait_seconds_total", "counter", "Time requests spent held back by the rate controller",
+                   [("", {}, self.throttle_wait_seconds)])
+            family("graph_token_refreshes_total", "counter", "Access token refreshes, by outcome",
+                   [("", {"outcome": o}, n) for o, n in sorted(self.token_refreshes.items())])
+            gauges = list(self.gauges.items())
+        for name, (help_text, read) in gauges:
+            family(name, "gauge", help_text, [("", {}, read())])
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# One registry per process, shared by every transport and manager
+metrics = GraphMetrics()
+
+# -------------------- Metrics Endpoint --------------------
+def start_metrics_server(registry: GraphMetrics = metrics, host: str = METRICS_HOST,
+                         port: Optional[int] = None,
+                         default_port: int = 9464) -> Optional[ThreadingHTTPServer]:
+    """Serve ``registry.render()`` at /metrics on a daemon thread.
+
+    ``port`` defaults to METRICS_PORT, or ``default_port`` when that is
+    unset; returns None when METRICS_PORT is empty.
+    """
+    if port is None:
+        if METRICS_PORT == "":
+            return None
+        port = int(METRICS_PORT) if METRICS_PORT else default_port
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,636 @@
+import argparse
+import json
+import struct
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict, List, Tuple
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from quickxorhash import QuickXorHash
+
+# -------------------- Configuration --------------------
+API_PREFIX = "/v1.0"
+ROOT_ID = "root-id"
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 999
+DELTA_PAGE_SIZE = 200
+MOCK_USER = {"user": {"displayName": "Mock User", "id": "mock-user-id", "email": "mock.user@example.com"},
+             "application": {"displayName": "Mock Graph", "id": "mock-app-id"}}
+
+# Thumbnail sets offered for images, videos and documents: size -> (width, height)
+THUMBNAIL_SIZES = {"small": (96, 96), "medium": (176, 176), "large": (800, 800)}
+THUMBNAIL_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".heic", ".mp4", ".mov", ".pdf", ".docx", ".xlsx", ".pptx")
+
+ITEM_PATH = re.compile(r"^/me/drive/(?:items/(?P<id>[^/:]+)|root):/(?P<name>[^:]+?)(?::(?P<action>/content|/createUploadSession))?:?$")
+
+# -------------------- In-Memory Drive --------------------
+class MockDrive:
+    """A single drive held in memory: items, file content, upload sessions and a change log"""
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.items: Dict[str, Dict] = {}
+        self.children: Dict[str, List[str]] = {}
+        # (parent id, name) -> item id
+        self.names: Dict[Tuple[str, str], str] = {}
+        self.content: Dict[str, bytes] = {}
+        self.sessions: Dict[str, Dict] = {}
+        # item id -> sequence number of its last change; deleted ids keep theirs
+        self.changes: Dict[str, int] = {}
+        self.deleted: set = set()
+        self.sequence = 0
+        self._add({"id": ROOT_ID, "name": "root", "folder": True, "parent": None}, root=True)
+
+    def _touch(self, item_id: str) -> None:
+        self.sequence += 1
+        self.changes[item_id] = self.sequence
+        item = self.items.get(item_id)
+        if item is not None:
+            item["eTag"] = f'"{item_id},{self.sequence}"'
+            item["cTag"] = f'"c:{item_id},{self.sequence}"'
+            item["lastModifiedDateTime"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def _add(self, record: Dict, root: bool = False) -> Dict:
+        record.setdefault("size", 0)
+        record["root"] = root
+        self.items[record["id"]] = record
+        if record["folder"]:
+            self.children.setdefault(record["id"], [])
+        if record["parent"] is not None:
+            self.children[record["parent"]].append(record["id"])
+            self.names[(record["parent"], record["name"])] = record["id"]
+        self._touch(record["id"])
+        # A folder's cTag changes with its children, as on OneDrive
+        parent = record["parent"]
+        while parent is not None:
+            self._touch(parent)
+            parent = self.items[parent]["parent"]
+        return record
+
+    def resolve(self, item_id: str) -> str:
+        return ROOT_ID if item_id == "root" else item_id
+
+    def child_named(self, parent_id: str, name: str) -> Optional[Dict]:
+        item_id = self.names.get((parent_id, name))
+        return self.items[item_id] if item_id is not None else None
+
+    def create_folder(self, parent_id: str, name: str, conflict: str = "fail") -> Tuple[int, Dict]:
+        with self.lock:
+            parent_id = self.resolve(parent_id)
+            if parent_id not in self.children:
+                return 404, error_body("itemNotFound", "Parent not found")
+            name = self.free_name(parent_id, name, conflict)
+            if name is None:
+                return 409, error_body("nameAlreadyExists", "An item with that name already exists")
+            record = self._add({"id": uuid.uuid4().hex, "name": name, "folder": True, "parent": parent_id})
+            return 201, self.to_json(record)
+
+    def free_name(self, parent_id: str, name: str, conflict: str) -> Optional[str]:
+        """``name`` if unused in the folder, a numbered variant with conflict "rename", else None"""
+        if self.child_named(parent_id, name) is None:
+            return name
+        if conflict != "rename":
+            return None
+        base, n = name, 1
+        while self.child_named(parent_id, name) is not None:
+            n += 1
+            name = f"{base} {n}"
+        return name
+
+    def is_within(self, item_id: str, folder_id: str) -> bool:
+        while item_id is not None:
+            if item_id == folder_id:
+                return True
+            item_id = self.items[item_id]["parent"]
+        return False
+
+    def move(self, item_id: str, parent_id: Optional[str], name: Optional[str]) -> Tuple[int, Dict]:
+        """PATCH an item: rename it and/or move it under another folder"""
+        with self.lock:
+            item_id = self.resolve(item_id)
+            record = self.items.get(item_id)
+            if record is None or record["root"]:
+                return 404, error_body("itemNotFound", "Item not found")
+            parent_id = self.resolve(parent_id) if parent_id else record["parent"]
+            if parent_id not in self.children:
+                return 404, error_body("itemNotFound", "Destination not found")
+            if self.is_within(parent_id, item_id):
+                return 400, error_body("invalidRequest", "A folder cannot be moved into itself")
+            name = name or record["name"]
+            if (parent_id, name) != (record["parent"], record["name"]) and self.child_named(parent_id, name):
+                return 409, error_body("nameAlreadyExists", f"{name} already exists")
+            old_parent = record["parent"]
+            del self.names[(old_parent, record["name"])]
+            self.children[old_parent].remove(item_id)
+            record["parent"], record["name"] = parent_id, name
+            self.children[parent_id].append(item_id)
+            self.names[(parent_id, name)] = item_id
+            self._touch(item_id)
+            # Both the old and the new ancestors change their cTag
+            for folder in (old_parent, parent_id):
+                while folder is not None:
+                    self._touch(folder)
+                    folder = self.items[folder]["parent"]
+            return 200, self.to_json(record)
+
+    def copy(self, item_id: str, parent_id: str, name: Optional[str], conflict: str = "fail") -> Tuple[int, Dict]:
+        """Copy an item and everything below it; returns the new top item"""
+        with self.lock:
+            item_id, parent_id = self.resolve(item_id), self.resolve(parent_id)
+            record = self.items.get(item_id)
+            if record is None or record["root"]:
+                return 404, error_body("itemNotFound", "Item not found")
+            if parent_id not in self.children:
+                return 404, error_body("itemNotFound", "Destination not found")
+            if record["folder"] and self.is_within(parent_id, item_id):
+                return 400, error_body("invalidRequest", "A folder cannot be copied into itself")
+            name = self.free_name(parent_id, name or record["name"], conflict)
+            if name is None:
+                return 409, error_body("nameAlreadyExists", "An item with that name already exists")
+            top = None
+            pending = [(item_id, parent_id, name)]
+            while pending:
+                source_id, target_parent, target_name = pending.pop()
+                source = self.items[source_id]
+                copied = self._add({"id": uuid.uuid4().hex, "name": target_name, "folder": source["folder"],
+                                    "parent": target_parent, "size": source["size"],
+                                    "quickXorHash": source.get("quickXorHash")})
+                if source_id in self.content:
+                    self.content[copied["id"]] = self.content[source_id]
+                top = top or copied
+                pending.extend((child_id, copied["id"], self.items[child_id]["name"])
+                               for child_id in self.children.get(source_id, []))
+            return 201, self.to_json(top)
+
+    def put_file(self, parent_id: str, name: str, data: bytes) -> Tuple[int, Dict]:
+        hasher = QuickXorHash()
+        hasher.update(data)
+        with self.lock:
+            parent_id = self.resolve(parent_id)
+            if parent_id not in self.children:
+                return 404, error_body("itemNotFound", "Parent not found")
+            existing = self.child_named(parent_id, name)
+            if existing is not None:
+                existing["size"] = len(data)
+                existing["quickXorHash"] = hasher.b64digest()
+                self.content[existing["id"]] = data
+                self._touch(existing["id"])
+                self._touch(parent_id)
+                return 200, self.to_json(existing)
+            record = self._add({"id": uuid.uuid4().hex, "name": name, "folder": False,
+                                "parent": parent_id, "size": len(data),
+                                "quickXorHash": hasher.b64digest()})
+            self.content[record["id"]] = data
+            return 201, self.to_json(record)
+
+    def delete(self, item_id: str) -> Tuple[int, Optional[Dict]]:
+        with self.lock:
+            item_id = self.resolve(item_id)
+            record = self.items.get(item_id)
+            if record is None or record["root"]:
+                return 404, error_body("itemNotFound", "Item not found")
+            stack = [item_id]
+            while stack:
+                current = stack.pop()
+                stack.extend(self.children.pop(current, []))
+                removed = self.items.pop(current, None)
+                if removed is not None:
+                    self.names.pop((removed["parent"], removed["name"]), None)
+                self.content.pop(current, None)
+                self.deleted.add(current)
+                self._touch(current)
+            self.children[record["parent"]].remove(item_id)
+            self._touch(record["parent"])
+            return 204, None
+
+    def tree_size(self, record: Dict) -> int:
+        """Bytes in a file, or in every file below a folder as Graph reports it"""
+        if not record["folder"]:
+            return record["size"]
+        total, pending = 0, [record["id"]]
+        while pending:
+            for child_id in self.children[pending.pop()]:
+                child = self.items[child_id]
+                if child["folder"]:
+                    pending.append(child_id)
+                else:
+                    total += child["size"]
+        return total
+
+    def to_json(self, record: Dict, base_url: str = "") -> Dict:
+        modified = record["lastModifiedDateTime"]
+        item = {
+            "id": record["id"], "name": record["name"], "size": self.tree_size(record),
+            "eTag": record["eTag"], "cTag": record["cTag"],
+            "createdDateTime": modified, "lastModifiedDateTime": modified,
+            "webUrl": f"https://onedrive.example/mock-drive/{record['id']}",
+            # The user blocks and fileSystemInfo make payloads the size Graph sends
+            "createdBy": MOCK_USER, "lastModifiedBy": MOCK_USER,
+            "fileSystemInfo": {"createdDateTime": modified, "lastModifiedDateTime": modified}
+        }
+        if record["parent"] is not None:
+            item["parentReference"] = {"id": record["parent"], "driveId": "mock-drive", "driveType": "personal"}
+        if record["root"]:
+            item["root"] = {}
+        if record["folder"]:
+            item["folder"] = {"childCount": len(self.children.get(record["id"], []))}
+        else:
+            item["file"] = {"mimeType": "application/octet-stream",
+                            "hashes": {"quickXorHash": record["quickXorHash"]}}
+            if base_url:
+                item["@microsoft.graph.downloadUrl"] = f"{base_url}/download/{record['id']}"
+        return item
+
+    def seed(self, parent_id: str, files: int, folders: int = 0, file_size: int = 0) -> List[str]:
+        """Create many items at once; returns their ids"""
+        ids = []
+        data = b"\0" * file_size
+        for i in range(folders):
+            ids.append(self.create_folder(parent_id, f"folder-{i:06d}")[1]["id"])
+        for i in range(files):
+            ids.append(self.put_file(parent_id, f"file-{i:06d}.bin", data)[1]["id"])
+        return ids
+
+def select_fields(item: Dict, query: Dict) -> Dict:
+    """Apply $select: only the listed properties (and the id) are returned"""
+    fields = query.get("$select")
+    if not fields:
+        return item
+    keep = set(fields.split(",")) | {"id"}
+    return {key: value for key, value in item.items() if key in keep}
+
+def thumbnail_sets(record: Dict, base_url: str) -> List[Dict]:
+    """The thumbnails collection of an item; empty for folders and files Graph cannot render"""
+    if record["folder"] or not record["name"].lower().endswith(THUMBNAIL_EXTENSIONS):
+        return []
+    return [{"id": "0", **{
+        size: {"url": f"{base_url}/thumbnail/{record['id']}/{size}", "width": width, "height": height}
+        for size, (width, height) in THUMBNAIL_SIZES.items()
+    }}]
+
+def thumbnail_png(item_id: str, size: str) -> bytes:
+    """A solid-colour PNG of the thumbnail's dimensions, its colour derived from the item id"""
+    width, height = THUMBNAIL_SIZES[size]
+    color = zlib.crc32(item_id.encode()).to_bytes(4, "big")[:3]
+    raw = (b"\0" + color * width) * height
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+def error_body(code: str, message: str) -> Dict:
+    return {"error": {"code": code, "message": message}}
+
+# -------------------- Request Handling --------------------
+class MockGraphServer:
+    """Local stand-in for the Graph endpoints the apps use, with injectable faults.
+
+    Covers children listing with @odata.nextLink paging, $select, $expand=thumbnails
+    with thumbnail content, items by id and path,
+    simple content PUT, content GET with Range, upload sessions, JSON $batch,
+    delta, PATCH moves and renames, and copies with a monitor URL.
+    ``latency`` seconds are added to every request; ``throttle_rate``
+    and ``unauthorized_rate`` are the fractions of API requests answered with
+    429 (carrying ``retry_after``) and 401, drawn from a generator seeded
+    with ``seed`` so runs can be repeated. A copy is made at once but its
+    monitor reports it in progress for ``copy_seconds``.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 throttle_rate: float = 0.0, unauthorized_rate: float = 0.0, retry_after: float = 1.0,
+                 copy_seconds: float = 0.5, seed: Optional[int] = None):
+        self.drive = MockDrive()
+        # copy job id -> {"started", "status", "resourceId" or "error"}
+        self.copy_jobs: Dict[str, Dict] = {}
+        self.copy_seconds = copy_seconds
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.unauthorized_rate = unauthorized_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "throttled": 0, "unauthorized": 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def graph_url(self) -> str:
+        return self.base_url + API_PREFIX
+
+    def start(self) -> "MockGraphServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, headers, payload = server.handle(self.command, self.path, self.headers, body)
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload).encode()
+                    headers.setdefault("Content-Type", "application/json")
+                payload = payload or b""
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _serve
+
+        return Handler
+
+    def handle(self, method: str, raw_path: str, headers, body: bytes,
+               nested: bool = False) -> Tuple[int, Dict, object]:
+        """Route one request; also used for $batch sub-requests (``nested``)"""
+        self.stats["requests"] += 1
+        # A batch pays the injected latency once, not once per sub-request
+        if self.latency and not nested:
+            time.sleep(self.latency)
+        url = urlsplit(raw_path)
+        path = unquote(url.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        # Pre-authenticated URLs (downloads, upload sessions, copy monitors, thumbnails) skip auth and fault injection
+        if path.startswith("/download/"):
+            return self._download(path[len("/download/"):], headers)
+        if path.startswith("/upload/"):
+            return self._upload_session(method, path[len("/upload/"):], headers, body)
+        if path.startswith("/monitor/"):
+            return self._monitor(path[len("/monitor/"):])
+        if path.startswith("/thumbnail/"):
+            return self._thumbnail(*path[len("/thumbnail/"):].split("/", 1))
+
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+        if self.random.random() < self.throttle_rate:
+            self.stats["throttled"] += 1
+            return 429, {"Retry-After": str(self.retry_after)}, error_body("TooManyRequests", "Throttled")
+        if not headers.get("Authorization", "").startswith("Bearer ") or self.random.random() < self.unauthorized_rate:
+            self.stats["unauthorized"] += 1
+            return 401, {}, error_body("InvalidAuthenticationToken", "Access token has expired")
+
+        drive = self.drive
+        if path == "/$batch" and method == "POST":
+            return self._batch(json.loads(body or b"{}"), headers)
+        if path == "/me/drive" and method == "GET":
+            return 200, {}, {"id": "mock-drive", "driveType": "personal"}
+        if path == "/me/drive/root/delta" and method == "GET":
+            return self._delta(query)
+
+        match = ITEM_PATH.match(path)
+        if match:
+            parent_id = drive.resolve(match["id"] or "root")
+            name, action = match["name"], match["action"]
+            if action == "/content" and method == "PUT":
+                status, item = drive.put_file(parent_id, name, body)
+                return status, {}, item
+            if action == "/createUploadSession" and method == "POST":
+                return self._create_session(parent_id, name)
+            with drive.lock:
+                record = drive.child_named(parent_id, name)
+                if record is None:
+                    return 404, {}, error_body("itemNotFound", "Item not found")
+                return 200, {}, self._item_json(record, query)
+
+        parts = path.strip("/").split("/")
+        # me/drive/root/children, me/drive/items/{id}[/children|/content]
+        if parts[:3] == ["me", "drive", "root"]:
+            parts = ["me", "drive", "items", "root"] + parts[3:]
+        if parts[:3] != ["me", "drive", "items"] or len(parts) < 4:
+            return 400, {}, error_body("invalidRequest", f"Unsupported path {path}")
+        item_id = drive.resolve(parts[3])
+        tail = parts[4] if len(parts) > 4 else ""
+
+        if tail == "children" and method == "GET":
+            return self._children(item_id, query)
+        if tail == "children" and method == "POST":
+            data = json.loads(body or b"{}")
+            status, item = drive.create_folder(
+                item_id, data.get("name", ""), data.get("@microsoft.graph.conflictBehavior", "fail")
+            )
+            return status, {}, item
+        if tail == "content" and method == "GET":
+            if item_id not in drive.content:
+                return 404, {}, error_body("itemNotFound", "Item not found")
+            return 302, {"Location": f"{self.base_url}/download/{item_id}"}, b""
+        if tail == "" and method == "GET":
+            with drive.lock:
+                record = drive.items.get(item_id)
+                if record is None:
+                    return 404, {}, error_body("itemNotFound", "Item not found")
+                return 200, {}, self._item_json(record, query)
+        if tail == "" and method == "DELETE":
+            status, item = drive.delete(item_id)
+            return status, {}, item
+        if tail == "" and method == "PATCH":
+            data = json.loads(body or b"{}")
+            status, item = drive.move(item_id, data.get("parentReference", {}).get("id"), data.get("name"))
+            return status, {}, item
+        if tail == "copy" and method == "POST":
+            return self._copy(item_id, json.loads(body or b"{}"), query)
+        return 405, {}, error_body("invalidRequest", f"{method} not supported on {path}")
+
+    def _children(self, folder_id: str, query: Dict) -> Tuple[int, Dict, Dict]:
+        top = min(int(query.get("$top", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        skip = int(query.get("$skiptoken", 0))
+        with self.drive.lock:
+            if folder_id not in self.drive.children:
+                return 404, {}, error_body("itemNotFound", "Folder not found")
+            ids = self.drive.children[folder_id][skip:skip + top]
+            page = {"value": [self._item_json(self.drive.items[i], query) for i in ids]}
+            if skip + top < len(self.drive.children[folder_id]):
+                select = "".join(f"&{key}={query[key]}" for key in ("$select", "$expand") if key in query)
+                page["@odata.nextLink"] = (
+                    f"{self.graph_url}/me/drive/items/{folder_id}/children?$top={top}{select}&$skiptoken={skip + top}"
+                )
+        return 200, {}, page
+
+    def _item_json(self, record: Dict, query: Dict) -> Dict:
+        """A driveItem as sent to clients: $select applied, then $expand=thumbnails"""
+        item = select_fields(self.drive.to_json(record, self.base_url), query)
+        if query.get("$expand", "").startswith("thumbnails"):
+            item["thumbnails"] = thumbnail_sets(record, self.base_url)
+        return item
+
+    def _delta(self, query: Dict) -> Tuple[int, Dict, Dict]:
+        since = int(query.get("token", 0))
+        skip = int(query.get("skip", 0))
+        with self.drive.lock:
+            changed = sorted(
+                (sequence, item_id) for item_id, sequence in self.drive.changes.items() if sequence > since
+            )
+            page_ids = [item_id for _, item_id in changed[skip:skip + DELTA_PAGE_SIZE]]
+            value = [
+                {"id": item_id, "deleted": {"state": "deleted"}} if item_id in self.drive.deleted
+                else self.drive.to_json(self.drive.items[item_id])
+                for item_id in page_ids
+            ]
+            data = {"value": value}
+            if skip + DELTA_PAGE_SIZE < len(changed):
+                data["@odata.nextLink"] = f"{self.graph_url}/me/drive/root/delta?token={since}&skip={skip + DELTA_PAGE_SIZE}"
+            else:
+                data["@odata.deltaLink"] = f"{self.graph_url}/me/drive/root/delta?token={self.drive.sequence}"
+        return 200, {}, data
+
+    def _batch(self, payload: Dict, headers) -> Tuple[int, Dict, Dict]:
+        sub_requests = payload.get("requests", [])
+        if len(sub_requests) > 20:
+            return 400, {}, error_body("invalidRequest", "A batch may contain at most 20 requests")
+        responses = []
+        for request in sub_requests:
+            sub_headers = {"Authorization": headers.get("Authorization", "")}
+            body = json.dumps(request["body"]).encode() if "body" in request else b""
+            status, response_headers, response_body = self.handle(
+                request["method"], API_PREFIX + request["url"], sub_headers, body, nested=True
+            )
+            response = {"id": request["id"], "status": status, "headers": response_headers}
+            if isinstance(response_body, (dict, list)):
+                response["body"] = response_body
+            responses.append(response)
+        return 200, {}, {"responses": responses}
+
+    def _copy(self, item_id: str, data: Dict, query: Dict) -> Tuple[int, Dict, object]:
+        parent_id = data.get("parentReference", {}).get("id")
+        if not parent_id:
+            return 400, {}, error_body("invalidRequest", "parentReference.id is required")
+        status, item = self.drive.copy(item_id, parent_id, data.get("name"),
+                                       query.get("@microsoft.graph.conflictBehavior", "fail"))
+        if status == 404:
+            return status, {}, item
+        # Like Graph, other failures only show up on the monitor
+        job_id = uuid.uuid4().hex
+        with self.drive.lock:
+            self.copy_jobs[job_id] = {"started": time.monotonic(), "status": "completed" if status == 201 else "failed",
+                                      "resourceId": item.get("id"), "error": item.get("error")}
+        return 202, {"Location": f"{self.base_url}/monitor/{job_id}"}, b""
+
+    def _monitor(self, job_id: str) -> Tuple[int, Dict, Dict]:
+        with self.drive.lock:
+            job = self.copy_jobs.get(job_id)
+        if job is None:
+            return 404, {}, error_body("itemNotFound", "Unknown job")
+        elapsed = time.monotonic() - job["started"]
+        if elapsed < self.copy_seconds:
+            percent = round(100 * elapsed / self.copy_seconds, 1)
+            return 202, {}, {"operation": "itemCopy", "status": "inProgress", "percentageComplete": percent}
+        if job["status"] == "failed":
+            return 200, {}, {"operation": "itemCopy", "status": "failed", "error": job["error"]}
+        return 200, {}, {"operation": "itemCopy", "status": "completed", "percentageComplete": 100.0,
+                         "resourceId": job["resourceId"]}
+
+    def _thumbnail(self, item_id: str, size: str = "") -> Tuple[int, Dict, bytes]:
+        with self.drive.lock:
+            record = self.drive.items.get(item_id)
+        if record is None or size not in THUMBNAIL_SIZES or not thumbnail_sets(record, ""):
+            return 404, {}, b""
+        return 200, {"Content-Type": "image/png"}, thumbnail_png(item_id, size)
+
+    def _download(self, item_id: str, headers) -> Tuple[int, Dict, bytes]:
+        with self.drive.lock:
+            data = self.drive.content.get(item_id)
+        if data is None:
+            return 404, {}, b""
+        range_header = headers.get("Range")
+        if not range_header:
+            return 200, {"Accept-Ranges": "bytes"}, data
+        start, _, end = range_header.split("=", 1)[1].partition("-")
+        start, end = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+        return 206, {"Content-Range": f"bytes {start}-{end}/{len(data)}"}, data[start:end + 1]
+
+    def _create_session(self, parent_id: str, name: str) -> Tuple[int, Dict, Dict]:
+        session_id = uuid.uuid4().hex
+        with self.drive.lock:
+            self.drive.sessions[session_id] = {"parent": parent_id, "name": name, "size": None,
+                                               "buffer": None, "ranges": []}
+        return 200, {}, {"uploadUrl": f"{self.base_url}/upload/{session_id}",
+                         "expirationDateTime": "2099-01-01T00:00:00Z"}
+
+    def _upload_session(self, method: str, session_id: str, headers, body: bytes) -> Tuple[int, Dict, object]:
+        with self.drive.lock:
+            session = self.drive.sessions.get(session_id)
+            if session is None:
+                return 404, {}, error_body("itemNotFound", "Upload session not found")
+            if method == "DELETE":
+                del self.drive.sessions[session_id]
+                return 204, {}, b""
+            if method == "GET":
+                return 200, {}, {"nextExpectedRanges": self._missing(session)}
+
+            span, _, total = headers["Content-Range"].split(" ", 1)[1].partition("/")
+            start, end = (int(x) for x in span.split("-"))
+            if session["buffer"] is None:
+                session["size"] = int(total)
+                session["buffer"] = bytearray(int(total))
+            session["buffer"][start:end + 1] = body
+            session["ranges"].append((start, end))
+            missing = self._missing(session)
+            if missing:
+                return 202, {}, {"nextExpectedRanges": missing}
+            del self.drive.sessions[session_id]
+            status, item = self.drive.put_file(session["parent"], session["name"], bytes(session["buffer"]))
+            return status, {}, item
+
+    @staticmethod
+    def _missing(session: Dict) -> List[str]:
+        if session["size"] is None:
+            return ["0-"]
+        missing, position = [], 0
+        for start, end in sorted(session["ranges"]):
+            if start > position:
+                missing.append(f"{position}-{start - 1}")
+            position = max(position, end + 1)
+        if position < session["size"]:
+            missing.append(f"{position}-")
+        return missing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the Microsoft Graph drive API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429")
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0, help="fraction of requests answered 401")
+    parser.add_argument("--copy-seconds", type=float, default=0.5, help="seconds a copy job reports in progress")
+    parser.add_argument("--seed", type=int, help="seed for the throttle and 401 injection (random if unset)")
+    parser.add_argument("--seed-folder", default="seed", help="folder under the root that receives seeded files")
+    parser.add_argument("--seed-files", type=int, default=0, help="number of files to create at startup")
+    parser.add_argument("--seed-file-size", type=int, default=0, help="size in bytes of each seeded file")
+    args = parser.parse_args()
+
+    server = MockGraphServer(args.host, args.port, args.latency, args.throttle_rate,
+                             args.unauthorized_rate, args.retry_after, args.copy_seconds, args.seed)
+    if args.seed_files:
+        folder = server.drive.create_folder("root", args.seed_folder)[1]
+        server.drive.seed(folder["id"], args.seed_files, file_size=args.seed_file_size)
+    print(f"Mock Graph API at {server.graph_url} (set GRAPH_URL to use it)", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
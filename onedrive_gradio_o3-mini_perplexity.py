@@ -1,8 +1,16 @@
 import gradio as gr
 import requests
 import msal
+from requests.adapters import HTTPAdapter
+import hashlib
 import json
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from graph_metrics import metrics, content_length, start_metrics_server
+from session_store import SessionStore
 
 # -------------------- Configuration --------------------
 # Replace these values with your Azure app registration details
@@ -10,52 +18,118 @@ CLIENT_ID = "YOUR_CLIENT_ID"         # Azure App client ID
 CLIENT_SECRET = "YOUR_CLIENT_SECRET" # Azure App client secret
 REDIRECT_URI = "http://localhost:8501/gettoken"  # This must match your app settings
 AUTHORITY = "https://login.microsoftonline.com/common"
+# Point this at mock_graph_server.py to run without a tenant
+GRAPH_URL = os.getenv("GRAPH_URL", "https://graph.microsoft.com/v1.0")
+# Prometheus /metrics port when METRICS_PORT is unset (the r1-v2 app uses 9464)
+METRICS_DEFAULT_PORT = 9465
 
 # Scopes required for OneDrive and basic user info.
 SCOPE = ["Files.ReadWrite.All", "User.Read"]
 
-# Global variable to store the access token once obtained.
-access_token = None
+# Downloads are streamed into a per-session directory here, one subdirectory per item id,
+# under their OneDrive file name.
+DOWNLOAD_DIR = "downloads"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024           # bytes written per read from the socket
+DOWNLOAD_SEGMENT_SIZE = 16 * 1024 * 1024    # bytes per HTTP Range segment
+PARALLEL_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+DOWNLOAD_WORKERS = 4
+
+# Connection pool size per host and (connect, read) timeouts in seconds
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_TIMEOUT = (float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")), float(os.getenv("HTTP_READ_TIMEOUT", "60")))
+
+# Each browser holds a session id; its access token lives in the session store.
+# Set SESSION_DB_PATH to share signed-in sessions between worker processes.
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")
 
 # If you wish to integrate with the Claude Model Context Protocol (MCP) plug‑in,
 # refer to https://github.com/modelcontextprotocol for integration details.
 # For now, this code directly uses Microsoft Graph API.
 
+# -------------------- HTTP Transport --------------------
+class GraphSession(requests.Session):
+    """Shared HTTP transport: per-host connection pools, keep-alive, gzip and default timeouts"""
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        # Every Graph, download and sign-in call is timed and counted in graph_metrics
+        with metrics.track(method, url) as call:
+            response = super().request(method, url, **kwargs)
+            call["status"] = response.status_code
+            call["bytes_out"] = content_length(response.request.headers, response.request.body)
+            call["bytes_in"] = content_length(response.headers, None if kwargs.get("stream") else response.content)
+        return response
+
+# One pooled session per process, reused by every Graph and token request
+graph_session = GraphSession()
+
+# File content is requested without compression so byte offsets match the file
+IDENTITY_ENCODING = {"Accept-Encoding": "identity"}
+
+# -------------------- Sessions --------------------
+# A session is just {"access_token", "expires_at"}, so it is stored as-is.
+sessions = SessionStore(dict, dict, path=SESSION_DB_PATH, update=dict.update)
+metrics.add_gauge("app_sessions_live", "Sessions loaded in this process", lambda: len(sessions))
+
+def session_token(session_id):
+    """Return the access token of a signed-in, unexpired session, or None."""
+    record = sessions.get(session_id)
+    if record is None or record["expires_at"] <= time.time():
+        return None
+    return record["access_token"]
+
+def session_download_dir(session_id):
+    """Directory for one session's downloads and partial files, named by a hash of its id."""
+    return os.path.join(DOWNLOAD_DIR, hashlib.sha256(session_id.encode()).hexdigest()[:32])
+
 # -------------------- Authentication Functions --------------------
 def get_auth_url():
     """Generate an authentication URL for Microsoft OAuth2."""
     app = msal.ConfidentialClientApplication(
-        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
+        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET,
+        http_client=graph_session
     )
     auth_url = app.get_authorization_request_url(SCOPE, redirect_uri=REDIRECT_URI)
     return auth_url
 
 def exchange_code(auth_code):
-    """Exchange the authorization code for an access token."""
-    global access_token
+    """Exchange the authorization code for an access token and start a session."""
     app = msal.ConfidentialClientApplication(
-        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
+        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET,
+        http_client=graph_session
     )
     result = app.acquire_token_by_authorization_code(
         auth_code, scopes=SCOPE, redirect_uri=REDIRECT_URI
     )
     if "access_token" in result:
-        access_token = result["access_token"]
-        return "Authentication successful!"
+        session_id = sessions.create({
+            "access_token": result["access_token"],
+            "expires_at": time.time() + int(result.get("expires_in", 3600))
+        })
+        return session_id, "Authentication successful!"
     else:
-        return "Authentication failed: " + str(result.get("error_description"))
+        # Keep any session the browser already has
+        return gr.update(), "Authentication failed: " + str(result.get("error_description"))
 
 # -------------------- OneDrive Operations --------------------
-def list_files(folder_id="root"):
+def list_files(session_id, folder_id="root"):
     """List the files and folders of the given OneDrive folder."""
+    access_token = session_token(session_id)
     if not access_token:
         return "Error: Please authenticate first."
     headers = {"Authorization": f"Bearer {access_token}"}
     if folder_id == "root":
-        url = "https://graph.microsoft.com/v1.0/me/drive/root/children"
+        url = f"{GRAPH_URL}/me/drive/root/children"
     else:
-        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{folder_id}/children"
-    response = requests.get(url, headers=headers)
+        url = f"{GRAPH_URL}/me/drive/items/{folder_id}/children"
+    response = graph_session.get(url, headers=headers)
     if response.status_code == 200:
         data = response.json()
         items = data.get("value", [])
@@ -67,8 +141,9 @@ def list_files(folder_id="root"):
     else:
         return "Error: " + response.text
 
-def create_folder(parent_folder_id, folder_name):
+def create_folder(session_id, parent_folder_id, folder_name):
     """Create a new folder in the specified OneDrive directory."""
+    access_token = session_token(session_id)
     if not access_token:
         return "Error: Please authenticate first."
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
@@ -78,66 +153,149 @@ def create_folder(parent_folder_id, folder_name):
         "@microsoft.graph.conflictBehavior": "rename"
     }
     if parent_folder_id == "" or parent_folder_id.lower() == "root":
-        url = "https://graph.microsoft.com/v1.0/me/drive/root/children"
+        url = f"{GRAPH_URL}/me/drive/root/children"
     else:
-        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{parent_folder_id}/children"
-    response = requests.post(url, headers=headers, json=body)
+        url = f"{GRAPH_URL}/me/drive/items/{parent_folder_id}/children"
+    response = graph_session.post(url, headers=headers, json=body)
     if response.status_code in [201, 200]:
         return "Folder created successfully!"
     else:
         return "Error: " + response.text
 
-def delete_item(item_id):
+def delete_item(session_id, item_id):
     """Delete a file or folder by its OneDrive ID."""
+    access_token = session_token(session_id)
     if not access_token:
         return "Error: Please authenticate first."
     headers = {"Authorization": f"Bearer {access_token}"}
-    url = f"https://graph.microsoft.com/v1.0/me/drive/items/{item_id}"
-    response = requests.delete(url, headers=headers)
+    url = f"{GRAPH_URL}/me/drive/items/{item_id}"
+    response = graph_session.delete(url, headers=headers)
     if response.status_code == 204:
         return "Item deleted successfully!"
     else:
         return "Error: " + response.text
 
-def upload_file(folder_id, file_obj):
+def upload_file(session_id, folder_id, file_obj):
     """
     Upload a file to the specified OneDrive folder.
     file_obj is a tuple: (filename, file_bytes, file_mime)
     """
+    access_token = session_token(session_id)
     if not access_token:
         return "Error: Please authenticate first."
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/octet-stream"}
     filename, file_bytes, _ = file_obj
     if folder_id == "" or folder_id.lower() == "root":
-        url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{filename}:/content"
+        url = f"{GRAPH_URL}/me/drive/root:/{filename}:/content"
     else:
-        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{folder_id}:/{filename}:/content"
-    response = requests.put(url, headers=headers, data=file_bytes)
+        url = f"{GRAPH_URL}/me/drive/items/{folder_id}:/{filename}:/content"
+    response = graph_session.put(url, headers=headers, data=file_bytes)
     if response.status_code in [200, 201]:
         return "File uploaded successfully!"
     else:
         return "Error: " + response.text
 
-def download_file(item_id):
-    """Download a file from OneDrive by its ID."""
+def download_file(session_id, item_id):
+    """
+    Download a file from OneDrive by its ID.
+    The body is streamed to disk in bounded chunks; large files are fetched as
+    parallel Range segments and resume from the missing segments if interrupted.
+    """
+    access_token = session_token(session_id)
     if not access_token:
         return "Error: Please authenticate first."
     headers = {"Authorization": f"Bearer {access_token}"}
-    url = f"https://graph.microsoft.com/v1.0/me/drive/items/{item_id}/content"
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        # Save the file locally and return the file path for Gradio file output.
-        filename = f"downloaded_{item_id}.bin"
-        with open(filename, "wb") as f:
-            f.write(response.content)
-        return filename
-    else:
+    url = f"{GRAPH_URL}/me/drive/items/{item_id}"
+    params = {"$select": "name,size,eTag,file,@microsoft.graph.downloadUrl"}
+    response = graph_session.get(url, headers=headers, params=params)
+    if response.status_code != 200:
         return "Error: " + response.text
+    item = response.json()
+    if "file" not in item:
+        return "Error: Item is not a file."
+
+    # The pre-authenticated download URL accepts Range requests without a token.
+    download_url = item.get("@microsoft.graph.downloadUrl")
+    if not download_url:
+        return "Error: OneDrive returned no download URL for this file."
+
+    # Keyed by item id, so files with the same name never share a path or partial file
+    download_dir = os.path.join(session_download_dir(session_id), re.sub(r"[^\w!-]", "_", item_id))
+    os.makedirs(download_dir, exist_ok=True)
+    filename = os.path.join(download_dir, os.path.basename(item["name"]))
+    try:
+        if item["size"] >= PARALLEL_DOWNLOAD_THRESHOLD:
+            _download_segments(download_url, filename, item["size"], item.get("eTag"))
+        else:
+            _download_stream(download_url, filename)
+    except (requests.RequestException, OSError) as e:
+        return f"Error: Download interrupted ({e}); download again to resume."
+    return filename
+
+def _download_stream(download_url, filename):
+    """Stream a whole file to disk without buffering it in memory."""
+    partial = filename + ".part"
+    with graph_session.get(download_url, headers=IDENTITY_ENCODING, stream=True) as response:
+        response.raise_for_status()
+        with open(partial, "wb") as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+    os.replace(partial, filename)
+
+def _download_segments(download_url, filename, size, etag):
+    """
+    Fetch a file as parallel Range segments into a preallocated partial file.
+    Finished segments are recorded in a sidecar file so an interrupted
+    download only fetches what is missing, as long as the item is unchanged.
+    """
+    partial = filename + ".part"
+    progress_file = partial + ".json"
+    segments = [
+        (start, min(start + DOWNLOAD_SEGMENT_SIZE, size) - 1)
+        for start in range(0, size, DOWNLOAD_SEGMENT_SIZE)
+    ]
+
+    done = set()
+    if os.path.exists(partial) and os.path.exists(progress_file):
+        with open(progress_file) as f:
+            progress = json.load(f)
+        if progress.get("eTag") == etag and progress.get("size") == size:
+            done = set(progress["done"])
+    if not done:
+        with open(partial, "wb") as f:
+            f.truncate(size)
+
+    lock = threading.Lock()
+
+    def fetch(index):
+        start, end = segments[index]
+        range_headers = {"Range": f"bytes={start}-{end}", **IDENTITY_ENCODING}
+        with graph_session.get(download_url, headers=range_headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise requests.RequestException("Server ignored the Range header")
+            with open(partial, "r+b") as f:
+                f.seek(start)
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        with lock:
+            done.add(index)
+            with open(progress_file, "w") as f:
+                json.dump({"eTag": etag, "size": size, "done": sorted(done)}, f)
+
+    missing = [i for i in range(len(segments)) if i not in done]
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        # list() re-raises the first segment failure after the others finish
+        list(pool.map(fetch, missing))
+
+    os.replace(partial, filename)
+    os.remove(progress_file)
 
 # -------------------- Gradio Interface --------------------
 with gr.Blocks() as demo:
     gr.Markdown("## Microsoft OneDrive Web App")
     gr.Markdown("Authenticate with Microsoft and perform file operations on OneDrive.")
+    session_state = gr.BrowserState(None, storage_key="onedrive_o3_session")
     
     # --- Tab 1: Authentication ---
     with gr.Tab("Authentication"):
@@ -147,14 +305,14 @@ with gr.Blocks() as demo:
         auth_result = gr.Textbox(label="Authentication Result")
         
         auth_url_btn.click(get_auth_url, outputs=auth_url_text)
-        auth_code_input.submit(exchange_code, inputs=auth_code_input, outputs=auth_result)
+        auth_code_input.submit(exchange_code, inputs=auth_code_input, outputs=[session_state, auth_result])
     
     # --- Tab 2: List Files ---
     with gr.Tab("List Files"):
         folder_id_input = gr.Textbox(label="Folder ID (default 'root')", value="root")
         list_btn = gr.Button("List Files")
         list_result = gr.Textbox(label="Files and Folders", lines=10)
-        list_btn.click(list_files, inputs=folder_id_input, outputs=list_result)
+        list_btn.click(list_files, inputs=[session_state, folder_id_input], outputs=list_result)
     
     # --- Tab 3: Create Folder ---
     with gr.Tab("Create Folder"):
@@ -162,14 +320,14 @@ with gr.Blocks() as demo:
         folder_name_input = gr.Textbox(label="New Folder Name")
         create_btn = gr.Button("Create Folder")
         create_result = gr.Textbox(label="Result")
-        create_btn.click(create_folder, inputs=[parent_folder_input, folder_name_input], outputs=create_result)
+        create_btn.click(create_folder, inputs=[session_state, parent_folder_input, folder_name_input], outputs=create_result)
     
     # --- Tab 4: Delete Item ---
     with gr.Tab("Delete Item"):
         item_id_input = gr.Textbox(label="Item ID to Delete")
         delete_btn = gr.Button("Delete")
         delete_result = gr.Textbox(label="Result")
-        delete_btn.click(delete_item, inputs=item_id_input, outputs=delete_result)
+        delete_btn.click(delete_item, inputs=[session_state, item_id_input], outputs=delete_result)
     
     # --- Tab 5: Upload File ---
     with gr.Tab("Upload File"):
@@ -177,13 +335,16 @@ with gr.Blocks() as demo:
         file_input = gr.File(label="Choose file to upload")
         upload_btn = gr.Button("Upload File")
         upload_result = gr.Textbox(label="Result")
-        upload_btn.click(upload_file, inputs=[folder_id_upload, file_input], outputs=upload_result)
+        upload_btn.click(upload_file, inputs=[session_state, folder_id_upload, file_input], outputs=upload_result)
     
     # --- Tab 6: Download File ---
     with gr.Tab("Download File"):
         item_id_download = gr.Textbox(label="Item ID to Download")
         download_btn = gr.Button("Download")
         download_result = gr.File(label="Downloaded File")
-        download_btn.click(download_file, inputs=item_id_download, outputs=download_result)
+        download_btn.click(download_file, inputs=[session_state, item_id_download], outputs=download_result)
 
-demo.launch()
+if __name__ == "__main__":
+    # Prometheus scrapes http://METRICS_HOST:METRICS_PORT/metrics
+    start_metrics_server(default_port=METRICS_DEFAULT_PORT)
+    demo.launch()
@@ -1,9 +1,42 @@
+import asyncio
+import bisect
+import hashlib
+import heapq
+import inspect
+import itertools
+import io
+import json
 import os
+import queue
+import random
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import weakref
+import zipfile
+from collections import OrderedDict, deque
+from datetime import datetime
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from itertools import accumulate
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import gradio as gr
+import uvicorn
+import httpx
 import requests
 import msal
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from typing import Optional, Dict, List
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from graph_metrics import metrics, content_length, start_metrics_server
+from quickxorhash import QuickXorHash, hash_file
+from session_store import SessionStore
+from typing import (Optional, Dict, List, Tuple, Any, Iterator, AsyncIterator, Awaitable, Callable, Generator,
+                    NamedTuple)
 
 # -------------------- Configuration --------------------
 load_dotenv()
@@ -13,57 +46,1880 @@ CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 AUTHORITY = "https://login.microsoftonline.com/common"
 SCOPE = ["Files.ReadWrite.All", "User.Read"]
 REDIRECT_URI = "http://localhost:8000/callback"
+# Point this at mock_graph_server.py to run without a tenant
+GRAPH_URL = os.getenv("GRAPH_URL", "https://graph.microsoft.com/v1.0")
+# Prometheus /metrics port when METRICS_PORT is unset (the o3-mini app uses 9465)
+METRICS_DEFAULT_PORT = 9464
+
+# Children requested per listing page ($top) and minimum seconds between UI refreshes
+LISTING_PAGE_SIZE = 200
+LISTING_UI_INTERVAL = 0.5
+# driveItem properties listings ask for ($select); DriveItem keeps only these
+LISTING_SELECT = "id,name,size,eTag,folder,file,fileSystemInfo,lastModifiedDateTime,parentReference"
+# Folder listings kept in memory: entries, total children across entries,
+# and seconds an entry is trusted before its cTag is checked again
+LISTING_CACHE_ENTRIES = 256
+LISTING_CACHE_MAX_ITEMS = 100_000
+LISTING_CACHE_TTL = 15
+# Listings of the subfolders on screen fetched ahead of a click: folders fetched
+# at once, children allowed per round (by childCount), and the share of the rate
+# controller's concurrency and tokens that must be free before each fetch starts
+PREFETCH_CONCURRENCY = 2
+PREFETCH_MAX_ITEMS = 5000
+PREFETCH_HEADROOM = 0.5
+
+# Maximum rows returned by a search
+SEARCH_RESULT_LIMIT = 200
+
+# Files above this size go through a Graph upload session instead of a single PUT
+SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+# Upload session fragments must be a multiple of 320 KiB
+UPLOAD_CHUNK_SIZE = 32 * 320 * 1024
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "1"))
+UPLOAD_MAX_RETRIES = 5
+# Multi-file uploads: files in flight at once, cap on bytes buffered across them,
+# and seconds between progress updates in the status log
+UPLOAD_WORKERS = 4
+UPLOAD_MAX_INFLIGHT_BYTES = 64 * 1024 * 1024
+UPLOAD_UI_INTERVAL = 1.0
+
+# Connection pool size per host and (connect, read) timeouts in seconds
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_TIMEOUT = (float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")), float(os.getenv("HTTP_READ_TIMEOUT", "60")))
+
+# MSAL token cache file (set TOKEN_CACHE_PATH= to keep tokens in memory only)
+TOKEN_CACHE_PATH = os.getenv("TOKEN_CACHE_PATH", "token_cache.json")
+# Tokens are refreshed in the background this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_REFRESH_INTERVAL = 30
+
+# SQLite mirror of drive metadata, kept current with the delta API
+METADATA_DB_PATH = os.getenv("METADATA_DB_PATH", "drive_metadata.db")
+INDEX_SYNC_INTERVAL = 60
+
+# Folder sync: local quickXorHash results, reused while a file's size and mtime are unchanged
+HASH_CACHE_PATH = os.getenv("HASH_CACHE_PATH", "hash_cache.db")
+SYNC_WORKERS = 4
+# Without a remote hash, equal sizes and mtimes this close count as unchanged
+SYNC_MTIME_TOLERANCE = 2.0
+# The Sync tab only reaches directories under SYNC_ROOT/<account>/; unset, the tab is hidden
+SYNC_ROOT = os.getenv("SYNC_ROOT", "")
+
+# Folder ZIP downloads: files fetched ahead of the archive writer, each buffered in a small queue
+ZIP_PREFETCH_FILES = 8
+ZIP_QUEUE_CHUNKS = 4
+ZIP_CHUNK_SIZE = 1024 * 1024
+# Seconds a folder ZIP link stays valid; each link can be used once
+ZIP_LINK_TTL = 300
+TREE_WALK_WORKERS = 8
+
+# Storage analysis: folders listed at once, rows reported (largest files and folders),
+# and subtrees below this many bytes totalled from their size facet instead of listed;
+# only files of at least that size are listed as largest, as smaller ones may sit in those subtrees
+STORAGE_WORKERS = 8
+STORAGE_TOP_N = 50
+STORAGE_PRUNE_BYTES = 1024 * 1024
+STORAGE_SELECT = "id,name,size,folder,file,root,cTag,eTag"
+
+# Server-side copies: seconds between polls of the monitor URLs, monitors polled at once,
+# failed polls before a job is given up, seconds without progress before it is timed out,
+# and finished jobs remembered per session
+COPY_POLL_INTERVAL = 1.0
+COPY_POLL_WORKERS = 4
+COPY_MAX_POLL_ERRORS = 5
+COPY_STALL_SECONDS = 600
+COPY_JOBS_KEPT = 500
+
+# Previews: thumbnail files kept on disk (keyed by item id and eTag) up to a size limit,
+# the Graph thumbnail size (small, medium or large), previews loaded per page, and
+# thumbnails downloaded at once
+THUMBNAIL_CACHE_PATH = os.getenv("THUMBNAIL_CACHE_PATH", "thumbnail_cache")
+THUMBNAIL_CACHE_BYTES = int(os.getenv("THUMBNAIL_CACHE_MB", "200")) * 1024 * 1024
+THUMBNAIL_SIZE = "medium"
+THUMBNAIL_PAGE_SIZE = 24
+THUMBNAIL_WORKERS = 8
+# Files Graph renders thumbnails for: images, videos and documents
+THUMBNAIL_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp", ".heic", ".heif",
+    ".mp4", ".mov", ".m4v", ".avi", ".wmv", ".mkv",
+    ".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".odt", ".ods", ".odp", ".rtf"
+}
+
+# Signed-in sessions; set SESSION_DB_PATH to share them between worker processes
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_MB", "512")) * 1024 * 1024
+# Rough memory per cached driveItem (listing cache and search index), for eviction
+SESSION_ITEM_BYTES = 1024
+
+# JSON batching: Graph accepts at most 20 sub-requests per /$batch call
+BATCH_LIMIT = 20
+BATCH_CONCURRENCY = 4
+BATCH_MAX_RETRIES = 5
+
+# Process-wide throttling: request rate (token bucket) and AIMD concurrency bounds
+GRAPH_RATE_LIMIT = float(os.getenv("GRAPH_RATE_LIMIT", "20"))
+GRAPH_RATE_BURST = 40
+GRAPH_CONCURRENCY_INITIAL = 8
+GRAPH_CONCURRENCY_MAX = 32
+GRAPH_MAX_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 60.0
+# How often a coroutine waiting for a concurrency slot checks again
+ASYNC_SLOT_POLL = 0.05
+
+# Async backend (AsyncOneDriveManager); one client per event loop serves all sessions
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", "100"))
+DOWNLOAD_DIR = "downloads"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# -------------------- HTTP Transport --------------------
+class GraphSession(requests.Session):
+    """Shared HTTP transport: per-host connection pools, keep-alive, gzip and default timeouts"""
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, timeout: Tuple[float, float] = HTTP_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+    
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with metrics.track(method, url) as call:
+            response = super().request(method, url, **kwargs)
+            call["status"] = response.status_code
+            call["bytes_out"] = content_length(response.request.headers, response.request.body)
+            # A streamed body has not been read yet, so only its declared length is known
+            call["bytes_in"] = content_length(response.headers, None if kwargs.get("stream") else response.content)
+        return response
+
+# One pooled session per process, reused by every Graph and token request
+graph_session = GraphSession()
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """httpx transport that records every request it sends (redirects included) in ``metrics``"""
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with metrics.track(request.method, str(request.url)) as call:
+            response = await self.transport.handle_async_request(request)
+            call["status"] = response.status_code
+            call["bytes_out"] = content_length(request.headers)
+            call["bytes_in"] = content_length(response.headers)
+        return response
+    
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+# -------------------- Rate Control --------------------
+class RateController:
+    """Throttling shared by every Graph call in the process.
+    
+    A token bucket caps the request rate and an AIMD limit caps requests in
+    flight: each success widens the limit by about one per window, and a
+    429 or 503 halves it and pauses every caller until Retry-After has
+    passed. Throttled responses to requests sent before the last decrease
+    belong to the same congestion event and do not halve it again.
+    Bulk jobs size their worker pools from ``concurrency_limit`` so they
+    slow down together.
+    """
+    def __init__(self, rate: float = GRAPH_RATE_LIMIT, burst: int = GRAPH_RATE_BURST,
+                 initial: int = GRAPH_CONCURRENCY_INITIAL, maximum: int = GRAPH_CONCURRENCY_MAX):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.limit = float(initial)
+        self.max_limit = maximum
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.decreased_at = float("-inf")
+        self.cond = threading.Condition()
+    
+    @property
+    def concurrency_limit(self) -> int:
+        return max(1, int(self.limit))
+    
+    def _wait_time(self, cost: int) -> Optional[float]:
+        """With the lock held: 0 once a slot and ``cost`` tokens are free (and taken),
+        otherwise seconds to wait, or None until a request in flight finishes"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= self.concurrency_limit:
+            return None
+        if self.tokens < cost:
+            return (cost - self.tokens) / self.rate
+        self.tokens -= cost
+        self.in_flight += 1
+        return 0.0
+    
+    def _release(self) -> None:
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+    
+    @contextmanager
+    def slot(self, cost: int = 1) -> Iterator[None]:
+        """Wait for the pause to lift, a free concurrency slot and ``cost`` rate tokens"""
+        cost = min(cost, self.burst)
+        started = None
+        with self.cond:
+            while (delay := self._wait_time(cost)) != 0:
+                started = started or time.monotonic()
+                self.cond.wait(delay)
+        if started:
+            metrics.record_throttle_wait(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release()
+    
+    @asynccontextmanager
+    async def aslot(self, cost: int = 1) -> AsyncIterator[None]:
+        """``slot`` for coroutines: sleeps instead of blocking the event loop"""
+        cost = min(cost, self.burst)
+        started = None
+        while True:
+            with self.cond:
+                delay = self._wait_time(cost)
+            if delay == 0:
+                break
+            started = started or time.monotonic()
+            # Slots freed by threads cannot wake a coroutine, so poll for them
+            await asyncio.sleep(ASYNC_SLOT_POLL if delay is None else delay)
+        if started:
+            metrics.record_throttle_wait(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release()
+    
+    def has_headroom(self, share: float) -> bool:
+        """True when not paused and at least ``share`` of the concurrency limit and of the token bucket is free"""
+        with self.cond:
+            now = time.monotonic()
+            tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+            return (now >= self.paused_until and self.in_flight <= self.limit * (1 - share)
+                    and tokens >= self.burst * share)
+    
+    def on_success(self) -> None:
+        with self.cond:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+    
+    def on_throttle(self, delay: float, sent_at: float) -> None:
+        """Pause for ``delay`` seconds; halve the limit unless the request (sent at
+        ``sent_at``, a time.monotonic() value) predates the last decrease"""
+        with self.cond:
+            now = time.monotonic()
+            if sent_at >= self.decreased_at:
+                self.limit = max(1.0, self.limit / 2)
+                self.decreased_at = now
+            self.paused_until = max(self.paused_until, now + delay)
+    
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    
+    def retry_delay(self, headers, attempt: int) -> float:
+        """Seconds to wait before retrying: Retry-After (seconds or HTTP date) or backoff"""
+        retry_after = {k.lower(): v for k, v in headers.items()}.get("retry-after")
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                # A little jitter keeps paused callers from waking in lockstep
+                return max(0.0, delay) + random.uniform(0, BACKOFF_BASE)
+        return self.backoff(attempt)
+
+rate_controller = RateController()
+metrics.add_gauge("graph_concurrency_limit", "Requests the rate controller currently lets run at once",
+                  lambda: rate_controller.concurrency_limit)
+metrics.add_gauge("graph_requests_in_flight", "Requests holding a rate controller slot",
+                  lambda: rate_controller.in_flight)
+
+def graph_send(method: str, url: str, cost: int = 1, **kwargs) -> requests.Response:
+    """Send one Graph request under the rate controller, retrying 429/503 responses"""
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        with rate_controller.slot(cost):
+            sent_at = time.monotonic()
+            response = graph_session.request(method, url, **kwargs)
+        if response.status_code not in (429, 503):
+            rate_controller.on_success()
+            return response
+        if attempt == GRAPH_MAX_RETRIES:
+            return response
+        metrics.record_retry("throttled")
+        rate_controller.on_throttle(rate_controller.retry_delay(response.headers, attempt), sent_at)
+    return response
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+def get_async_client() -> httpx.AsyncClient:
+    """Pooled async client for the running event loop (httpx clients cannot cross loops)"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        limits = httpx.Limits(max_connections=ASYNC_POOL_SIZE, max_keepalive_connections=ASYNC_POOL_SIZE)
+        client = httpx.AsyncClient(
+            # With a transport passed in, the pool limits must be set on it
+            transport=InstrumentedTransport(httpx.AsyncHTTPTransport(limits=limits)),
+            timeout=httpx.Timeout(HTTP_TIMEOUT[1], connect=HTTP_TIMEOUT[0]),
+            headers={"Accept-Encoding": "gzip, deflate"}
+        )
+        _async_clients[loop] = client
+    return client
+
+async def async_graph_send(method: str, url: str, cost: int = 1, **kwargs) -> httpx.Response:
+    """Coroutine version of ``graph_send`` on the shared async client (httpx keyword arguments)"""
+    client = get_async_client()
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        async with rate_controller.aslot(cost):
+            sent_at = time.monotonic()
+            response = await client.request(method, url, **kwargs)
+        if response.status_code not in (429, 503):
+            rate_controller.on_success()
+            return response
+        if attempt == GRAPH_MAX_RETRIES:
+            return response
+        metrics.record_retry("throttled")
+        rate_controller.on_throttle(rate_controller.retry_delay(response.headers, attempt), sent_at)
+    return response
+
+# -------------------- Token Management --------------------
+token_cache = msal.SerializableTokenCache()
+if TOKEN_CACHE_PATH and os.path.exists(TOKEN_CACHE_PATH):
+    with open(TOKEN_CACHE_PATH) as f:
+        token_cache.deserialize(f.read())
+
+_msal_app: Optional[msal.ConfidentialClientApplication] = None
+_msal_lock = threading.Lock()
+
+def get_msal_app() -> msal.ConfidentialClientApplication:
+    """Return the process-wide MSAL application, creating it on first use"""
+    global _msal_app
+    with _msal_lock:
+        if _msal_app is None:
+            _msal_app = msal.ConfidentialClientApplication(
+                CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET,
+                token_cache=token_cache, http_client=graph_session
+            )
+        return _msal_app
+
+def save_token_cache() -> None:
+    """Persist the token cache if MSAL changed it; the file is readable by the owner only"""
+    with _msal_lock:
+        if not TOKEN_CACHE_PATH or not token_cache.has_state_changed:
+            return
+        fd = os.open(TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(token_cache.serialize())
+
+# Managers whose tokens the background thread keeps fresh
+_token_holders: "weakref.WeakSet[OneDriveManager]" = weakref.WeakSet()
+_refresher_started = threading.Event()
+
+def _refresh_tokens_forever() -> None:
+    while True:
+        time.sleep(TOKEN_REFRESH_INTERVAL)
+        for manager in list(_token_holders):
+            if manager.token_expires_within(TOKEN_REFRESH_MARGIN):
+                try:
+                    manager.refresh_access_token()
+                except Exception:
+                    pass  # retried on the next pass or inline by make_request
+
+def register_token_holder(manager: "OneDriveManager") -> None:
+    """Have the background refresher renew this manager's token before it expires"""
+    _token_holders.add(manager)
+    with _msal_lock:
+        if not _refresher_started.is_set():
+            _refresher_started.set()
+            threading.Thread(target=_refresh_tokens_forever, daemon=True).start()
+
+# -------------------- Drive Items --------------------
+class DriveItem:
+    """Compact, read-only record of a listed driveItem.
+    
+    Only the properties in LISTING_SELECT are kept, in slots instead of the
+    nested JSON dicts, which makes cached listings several times smaller.
+    Lookups use the driveItem JSON names (``item["name"]``, ``"folder" in
+    item``, ``item.get("file", {})``), so records and full driveItem dicts
+    can be used interchangeably.
+    """
+    __slots__ = ("id", "name", "size", "modified", "file_modified", "child_count",
+                 "parent_id", "parent_path", "qxh", "etag")
+    
+    def __init__(self, id: str, name: str, size: int = 0, modified: Optional[str] = None,
+                 file_modified: Optional[str] = None, child_count: Optional[int] = None,
+                 parent_id: Optional[str] = None, parent_path: Optional[str] = None,
+                 qxh: Optional[str] = None, etag: Optional[str] = None):
+        self.id = id
+        self.name = name
+        self.size = size
+        self.modified = modified
+        self.file_modified = file_modified
+        # None for files; folders from the metadata index report 0
+        self.child_count = child_count
+        self.parent_id = parent_id
+        self.parent_path = parent_path
+        self.qxh = qxh
+        self.etag = etag
+    
+    @classmethod
+    def from_json(cls, data: Dict) -> "DriveItem":
+        parent = data.get("parentReference", {})
+        folder = data.get("folder")
+        return cls(
+            data["id"], data.get("name", ""), data.get("size", 0) or 0, data.get("lastModifiedDateTime"),
+            data.get("fileSystemInfo", {}).get("lastModifiedDateTime"),
+            folder.get("childCount", 0) if folder is not None else None,
+            parent.get("id"), parent.get("path"), item_hash(data), data.get("eTag")
+        )
+    
+    @property
+    def is_folder(self) -> bool:
+        return self.child_count is not None
+    
+    def get(self, key: str, default=None):
+        if key == "id":
+            return self.id
+        if key == "name":
+            return self.name
+        if key == "size":
+            return self.size
+        if key == "eTag":
+            return self.etag if self.etag is not None else default
+        if key == "lastModifiedDateTime":
+            return self.modified if self.modified is not None else default
+        if key == "folder":
+            return {"childCount": self.child_count} if self.is_folder else default
+        if key == "file":
+            if self.is_folder:
+                return default
+            return {"hashes": {"quickXorHash": self.qxh}} if self.qxh else {}
+        if key == "fileSystemInfo":
+            return {"lastModifiedDateTime": self.file_modified} if self.file_modified else default
+        if key == "parentReference":
+            if self.parent_id is None and self.parent_path is None:
+                return default
+            parent = {"id": self.parent_id}
+            if self.parent_path is not None:
+                parent["path"] = self.parent_path
+            return parent
+        return default
+    
+    def __getitem__(self, key: str):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, self) is not self
+    
+    def __repr__(self) -> str:
+        return f"DriveItem({self.id!r}, {self.name!r}{', folder' if self.is_folder else ''})"
+
+def item_hash(item: Dict) -> Optional[str]:
+    return item.get("file", {}).get("hashes", {}).get("quickXorHash")
+
+def batch_transport_error(ids: List[str], error: Exception) -> List[Dict]:
+    """Responses for a /$batch call that never got a reply: 503, so ``batch`` retries them"""
+    body = {"error": {"code": "serviceNotAvailable", "message": str(error)}}
+    return [{"id": i, "status": 503, "headers": {}, "body": body} for i in ids]
+
+# -------------------- Local Metadata Index --------------------
+class DriveIndex:
+    """SQLite mirror of driveItem metadata, filled and updated through /delta.
+    
+    Rows are keyed by (drive id, item id) with an index on the parent id, so
+    folder listings and id lookups never leave the process. One database can
+    hold several drives; each keeps its own delta link.
+    """
+    COLUMNS = "id, parent_id, name, is_folder, size, modified, etag, ctag, qxh"
+    
+    def __init__(self, path: str = METADATA_DB_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "drive_id TEXT, id TEXT, parent_id TEXT, name TEXT, is_folder INTEGER,"
+                " size INTEGER, modified TEXT, etag TEXT, ctag TEXT, qxh TEXT,"
+                " PRIMARY KEY (drive_id, id))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS items_parent ON items (drive_id, parent_id)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS drives (drive_id TEXT PRIMARY KEY, root_id TEXT, delta_link TEXT)"
+            )
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(items)")]
+            if "qxh" not in columns:
+                # Databases from before file hashes were kept: add the column and
+                # drop the delta links so the next sync fills it for every file
+                self.conn.execute("ALTER TABLE items ADD COLUMN qxh TEXT")
+                self.conn.execute("UPDATE drives SET delta_link = NULL")
+    
+    @staticmethod
+    def _to_item(row: tuple) -> Dict:
+        """Rebuild the subset of a driveItem the UI uses from a table row"""
+        item_id, parent_id, name, is_folder, size, modified, etag, ctag, qxh = row
+        item = {"id": item_id, "name": name, "size": size, "lastModifiedDateTime": modified,
+                "eTag": etag, "cTag": ctag, "parentReference": {"id": parent_id}}
+        if is_folder:
+            item["folder"] = {}
+        else:
+            item["file"] = {"hashes": {"quickXorHash": qxh}} if qxh else {}
+        return item
+    
+    def delta_link(self, drive_id: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT delta_link FROM drives WHERE drive_id = ?", (drive_id,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def _resolve(self, drive_id: str, item_id: str) -> str:
+        """Map the "root" alias to the drive's real root id"""
+        if item_id != "root":
+            return item_id
+        row = self.conn.execute("SELECT root_id FROM drives WHERE drive_id = ?", (drive_id,)).fetchone()
+        return row[0] if row and row[0] else item_id
+    
+    def children(self, drive_id: str, parent_id: str) -> List[DriveItem]:
+        """Children of a folder, folders first, then by name"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM items WHERE drive_id = ? AND parent_id = ?"
+                " ORDER BY is_folder DESC, name COLLATE NOCASE",
+                (drive_id, self._resolve(drive_id, parent_id))
+            ).fetchall()
+        return [DriveItem(item_id, name, size, modified, None, 0 if is_folder else None, parent_id, None, qxh, etag)
+                for item_id, parent_id, name, is_folder, size, modified, etag, _, qxh in rows]
+    
+    def get(self, drive_id: str, item_id: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM items WHERE drive_id = ? AND id = ?",
+                (drive_id, self._resolve(drive_id, item_id))
+            ).fetchone()
+        return self._to_item(row) if row else None
+    
+    def apply_delta(self, drive_id: str, items: List[Dict], delta_link: Optional[str] = None) -> None:
+        """Upsert changed items, drop deleted ones and optionally record the new delta link"""
+        upserts, deletes, root_id = [], [], None
+        for item in items:
+            if "deleted" in item:
+                deletes.append((drive_id, item["id"]))
+                continue
+            if "root" in item:
+                root_id = item["id"]
+            upserts.append((
+                drive_id, item["id"], item.get("parentReference", {}).get("id"),
+                item.get("name", ""), "folder" in item, item.get("size", 0),
+                item.get("lastModifiedDateTime"), item.get("eTag"), item.get("cTag"),
+                item.get("file", {}).get("hashes", {}).get("quickXorHash")
+            ))
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM items WHERE drive_id = ? AND id = ?", deletes)
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO items (drive_id, {self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                upserts
+            )
+            self.conn.execute("INSERT OR IGNORE INTO drives (drive_id) VALUES (?)", (drive_id,))
+            if root_id:
+                self.conn.execute("UPDATE drives SET root_id = ? WHERE drive_id = ?", (root_id, drive_id))
+            if delta_link:
+                self.conn.execute("UPDATE drives SET delta_link = ? WHERE drive_id = ?", (delta_link, drive_id))
+    
+    def all_items(self, drive_id: str) -> Iterator[Dict]:
+        """Every item of a drive, the root marked with a ``root`` facet"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM items WHERE drive_id = ?", (drive_id,)
+            ).fetchall()
+            root_id = self._resolve(drive_id, "root")
+        for row in rows:
+            item = self._to_item(row)
+            if item["id"] == root_id:
+                item["root"] = {}
+            yield item
+    
+    def reset(self, drive_id: str) -> None:
+        """Forget a drive so the next sync starts from scratch"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM items WHERE drive_id = ?", (drive_id,))
+            self.conn.execute("DELETE FROM drives WHERE drive_id = ?", (drive_id,))
+
+_drive_index: Optional[DriveIndex] = None
+_drive_index_lock = threading.Lock()
+
+def get_drive_index() -> DriveIndex:
+    """Return the process-wide metadata index, opening it on first use"""
+    global _drive_index
+    with _drive_index_lock:
+        if _drive_index is None:
+            _drive_index = DriveIndex()
+        return _drive_index
+
+# -------------------- Folder Sync --------------------
+class HashCache:
+    """quickXorHash of local files by path, valid while the size and mtime are unchanged"""
+    def __init__(self, path: str = HASH_CACHE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, qxh TEXT)"
+            )
+    
+    def put(self, path: str, stat: os.stat_result, qxh: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, qxh) VALUES (?, ?, ?, ?)",
+                (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, qxh)
+            )
+    
+    def file_hash(self, path: str, stat: Optional[os.stat_result] = None) -> str:
+        """Hash of a local file, read in chunks only if it changed since it was last hashed"""
+        stat = stat or os.stat(path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT qxh FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row:
+            return row[0]
+        qxh = hash_file(path)
+        self.put(path, stat, qxh)
+        return qxh
+
+_hash_cache: Optional[HashCache] = None
+_hash_cache_lock = threading.Lock()
+
+def get_hash_cache() -> HashCache:
+    """Return the process-wide local hash cache, opening it on first use"""
+    global _hash_cache
+    with _hash_cache_lock:
+        if _hash_cache is None:
+            _hash_cache = HashCache()
+        return _hash_cache
+
+def local_tree(root: str) -> Tuple[Dict[str, os.stat_result], List[str]]:
+    """Files (with their stat) and directories under ``root``, by "/"-separated relative path"""
+    files, dirs = {}, []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        prefix = "" if rel == "." else rel.replace(os.sep, "/") + "/"
+        dirs.extend(prefix + name for name in dirnames)
+        for name in filenames:
+            # Unfinished downloads from an interrupted sync
+            if not name.endswith(".part"):
+                files[prefix + name] = os.stat(os.path.join(dirpath, name))
+    return files, dirs
+
+def item_mtime(item: Dict) -> float:
+    """Modification time of a driveItem as a POSIX timestamp (client-reported time first)"""
+    modified = item.get("fileSystemInfo", {}).get("lastModifiedDateTime") or item.get("lastModifiedDateTime")
+    if not modified:
+        return 0.0
+    return datetime.fromisoformat(modified.replace("Z", "+00:00")).timestamp()
+
+# -------------------- Folder Archives --------------------
+class ChunkSink(io.RawIOBase):
+    """Unseekable file ZipFile writes into; the archive generator drains it as it goes"""
+    def __init__(self):
+        super().__init__()
+        self.chunks: List[bytes] = []
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self) -> List[bytes]:
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+def zip_date_time(item: Optional[Dict]) -> Tuple[int, ...]:
+    """ZIP entry timestamp for an item (now for folders); ZIP cannot go before 1980"""
+    timestamp = item_mtime(item) if item else time.time()
+    return max(time.localtime(timestamp)[:6], (1980, 1, 1, 0, 0, 0))
+
+# -------------------- Listing Cache --------------------
+class ListingCache:
+    """Bounded LRU of folder listings keyed by folder id.
+    
+    Each entry remembers the folder's cTag (or eTag) at fetch time. Within the
+    TTL an entry is served as-is; after that it only needs a cheap check that
+    the tag is unchanged. Entries are evicted least recently used first once
+    either the entry count or the total number of cached children is exceeded.
+    """
+    def __init__(self, max_entries: int = LISTING_CACHE_ENTRIES,
+                 max_items: int = LISTING_CACHE_MAX_ITEMS, ttl: float = LISTING_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.item_count = 0
+        # child id -> folder ids whose cached listing contains it
+        self.parents: Dict[str, set] = {}
+        self.lock = threading.Lock()
+    
+    def get(self, folder_id: str) -> Optional[Dict]:
+        """Cached entry ``{"tag", "items", "fetched_at"}``, marked most recently used"""
+        with self.lock:
+            entry = self.entries.get(folder_id)
+            if entry is not None:
+                self.entries.move_to_end(folder_id)
+            return entry
+    
+    def is_fresh(self, entry: Dict) -> bool:
+        return time.monotonic() - entry["fetched_at"] < self.ttl
+    
+    def has_fresh(self, folder_id: str) -> bool:
+        """Whether a listing within its TTL is cached, without marking it used"""
+        with self.lock:
+            entry = self.entries.get(folder_id)
+            return entry is not None and self.is_fresh(entry)
+    
+    def revalidated(self, folder_id: str) -> None:
+        """Restart the TTL of an entry whose tag was confirmed unchanged"""
+        with self.lock:
+            if folder_id in self.entries:
+                self.entries[folder_id]["fetched_at"] = time.monotonic()
+    
+    def put(self, folder_id: str, tag: Optional[str], items: List[DriveItem]) -> None:
+        if len(items) > self.max_items:
+            return
+        with self.lock:
+            self._drop(folder_id)
+            self.entries[folder_id] = {"tag": tag, "items": items, "fetched_at": time.monotonic()}
+            self.item_count += len(items)
+            for item in items:
+                self.parents.setdefault(item["id"], set()).add(folder_id)
+            while len(self.entries) > self.max_entries or self.item_count > self.max_items:
+                self._drop(next(iter(self.entries)))
+    
+    def invalidate(self, folder_id: str) -> None:
+        with self.lock:
+            self._drop(folder_id)
+    
+    def invalidate_item(self, item_id: str) -> None:
+        """Drop every cached listing that contains the item"""
+        with self.lock:
+            for folder_id in list(self.parents.get(item_id, ())):
+                self._drop(folder_id)
+    
+    def _drop(self, folder_id: str) -> None:
+        entry = self.entries.pop(folder_id, None)
+        if entry is None:
+            return
+        self.item_count -= len(entry["items"])
+        for item in entry["items"]:
+            folders = self.parents.get(item["id"])
+            if folders:
+                folders.discard(folder_id)
+                if not folders:
+                    del self.parents[item["id"]]
+
+# -------------------- Listing Prefetch --------------------
+class ListingPrefetcher:
+    """Background fetches of the subfolder listings a user is likely to open next.
+    
+    After a folder is shown its subfolders are fetched into the listing
+    cache in display order, PREFETCH_CONCURRENCY at a time, each starting
+    only while the rate controller has PREFETCH_HEADROOM to spare so
+    requests the user waits on go first. A round stops adding folders once
+    their childCounts would pass PREFETCH_MAX_ITEMS. Starting a round, or
+    opening any folder, cancels the pending fetches; the fetch of the
+    folder being opened is kept and awaited if it has already started.
+    
+    Prefetching only runs while listings come from Graph: until the first
+    delta sync of the drive has filled the metadata index (which takes a
+    while on large drives), or for good if that sync keeps failing. Once
+    the index is ready every listing is a local read and nothing is fetched.
+    """
+    def __init__(self, concurrency: int = PREFETCH_CONCURRENCY, max_items: int = PREFETCH_MAX_ITEMS,
+                 headroom: float = PREFETCH_HEADROOM):
+        self.concurrency = concurrency
+        self.max_items = max_items
+        self.headroom = headroom
+        # folder id -> fetch task of the current round
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.started: set = set()
+    
+    def __len__(self) -> int:
+        return len(self.tasks)
+    
+    def cancel(self, keep: Optional[str] = None) -> Optional[asyncio.Task]:
+        """Cancel the pending fetches; returns ``keep``'s fetch if it is already running"""
+        kept = self.tasks.pop(keep, None) if keep in self.started else None
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks = {}
+        self.started = set()
+        return kept
+    
+    def start(self, folders: List[DriveItem], fetch: Callable[[str], Awaitable[None]]) -> None:
+        """Begin a round over ``folders`` with ``fetch(folder_id)``, replacing any previous round"""
+        self.cancel()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        budget = self.max_items
+        for folder in folders:
+            count = folder.child_count or 0
+            if count > budget:
+                continue
+            budget -= count
+            task = asyncio.ensure_future(self._fetch(semaphore, fetch, folder.id))
+            task.add_done_callback(lambda task, folder_id=folder.id: self._finished(folder_id, task))
+            self.tasks[folder.id] = task
+    
+    async def _fetch(self, semaphore: asyncio.Semaphore, fetch: Callable[[str], Awaitable[None]],
+                     folder_id: str) -> None:
+        async with semaphore:
+            while not rate_controller.has_headroom(self.headroom):
+                await asyncio.sleep(ASYNC_SLOT_POLL)
+            self.started.add(folder_id)
+            try:
+                await fetch(folder_id)
+            except (httpx.HTTPError, ValueError):
+                # The folder is simply fetched when it is opened
+                pass
+    
+    def _finished(self, folder_id: str, task: asyncio.Task) -> None:
+        if self.tasks.get(folder_id) is task:
+            del self.tasks[folder_id]
+            self.started.discard(folder_id)
+
+# -------------------- Search Index --------------------
+class SearchIndex:
+    """In-memory index over the metadata of every item the app has seen.
+    
+    Name tokens map to item ids, with a sorted token list for prefix lookups.
+    Substring queries scan one lowercase string holding every name, so memory
+    stays close to the size of the names themselves. Both the token list and
+    the name string are rebuilt lazily on the first query after a change.
+    Items are added incrementally from listings, the delta sync and the
+    manager's own changes.
+    """
+    TOKEN_RE = re.compile(r"[^\W_]+")
+    SEPARATOR = "\0"
+    
+    def __init__(self):
+        # id -> (name, parent id, parent path or None, is folder, size, modified)
+        self.items: Dict[str, tuple] = {}
+        self.roots: set = set()
+        self.tokens: Dict[str, set] = {}
+        self.sorted_tokens: List[str] = []
+        self.lock = threading.Lock()
+        self._haystack = ""
+        self._offsets: List[int] = []
+        self._haystack_ids: List[str] = []
+        # The sorted token list and the name haystack are rebuilt lazily on the next query
+        self._tokens_dirty = False
+        self._dirty = False
+    
+    def __len__(self) -> int:
+        return len(self.items)
+    
+    def add(self, items) -> None:
+        """Index driveItems; items carrying a ``deleted`` facet are removed"""
+        with self.lock:
+            for item in items:
+                if "id" not in item:
+                    continue
+                self._remove(item["id"])
+                if "deleted" in item:
+                    continue
+                if "root" in item:
+                    self.roots.add(item["id"])
+                parent = item.get("parentReference", {})
+                parent_path = parent.get("path")
+                if parent_path is not None:
+                    # "/drive/root:/A/B" -> "/A/B"
+                    parent_path = parent_path.partition(":")[2]
+                name = item.get("name", "")
+                self.items[item["id"]] = (
+                    name, parent.get("id"), parent_path, "folder" in item,
+                    item.get("size", 0) or 0, item.get("lastModifiedDateTime") or ""
+                )
+                for token in set(self.TOKEN_RE.findall(name.lower())):
+                    ids = self.tokens.get(token)
+                    if ids is None:
+                        ids = self.tokens[token] = set()
+                        self._tokens_dirty = True
+                    ids.add(item["id"])
+            self._dirty = True
+    
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+            self.roots.clear()
+            self.tokens.clear()
+            self.sorted_tokens.clear()
+            self._tokens_dirty = False
+            self._dirty = True
+    
+    def _remove(self, item_id: str) -> None:
+        record = self.items.pop(item_id, None)
+        if record is None:
+            return
+        self.roots.discard(item_id)
+        for token in set(self.TOKEN_RE.findall(record[0].lower())):
+            ids = self.tokens.get(token)
+            if ids is None:
+                continue
+            ids.discard(item_id)
+            if not ids:
+                del self.tokens[token]
+                self._tokens_dirty = True
+    
+    def path(self, item_id: str) -> str:
+        """Path from the drive root, built from known parents"""
+        parts = []
+        current = item_id
+        while current in self.items and current not in self.roots and len(parts) < 256:
+            name, parent_id, parent_path = self.items[current][:3]
+            parts.append(name)
+            if parent_path is not None:
+                return parent_path + "/" + "/".join(reversed(parts))
+            current = parent_id
+        return "/" + "/".join(reversed(parts))
+    
+    def _prefix_ids(self, prefix: str) -> set:
+        if self._tokens_dirty:
+            self.sorted_tokens = sorted(self.tokens)
+            self._tokens_dirty = False
+        ids = set()
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        for token in self.sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            ids |= self.tokens[token]
+        return ids
+    
+    def _substring_ids(self, needle: str) -> Iterator[str]:
+        if self._dirty:
+            self._haystack_ids = list(self.items)
+            names = [record[0].lower() for record in self.items.values()]
+            self._offsets = [0, *accumulate(len(name) + 1 for name in names)][:-1]
+            self._haystack = self.SEPARATOR.join(names)
+            self._dirty = False
+        position = self._haystack.find(needle)
+        while position != -1:
+            index = bisect.bisect_right(self._offsets, position) - 1
+            yield self._haystack_ids[index]
+            # Continue after this name so each item is reported once
+            next_start = self._offsets[index + 1] if index + 1 < len(self._offsets) else len(self._haystack)
+            position = self._haystack.find(needle, next_start)
+    
+    def search(self, query: str, mode: str = "substring", extension: Optional[str] = None,
+               min_size: Optional[int] = None, max_size: Optional[int] = None,
+               modified_after: Optional[str] = None, modified_before: Optional[str] = None,
+               kind: Optional[str] = None, limit: int = SEARCH_RESULT_LIMIT) -> List[Dict]:
+        """Find items by name and filter them.
+        
+        ``mode`` is ``substring`` (the query anywhere in the name), ``prefix``
+        (every query word starts some word of the name) or ``token`` (every
+        query word is a word of the name). ``kind`` is ``file``, ``folder`` or
+        None; modification bounds are ISO 8601 strings.
+        """
+        query = query.strip().lower()
+        extension = extension.lower().lstrip(".") if extension else None
+        
+        def matches(record: tuple) -> bool:
+            name, _, _, is_folder, size, modified = record
+            if kind and (kind == "folder") != is_folder:
+                return False
+            if extension and (is_folder or not name.lower().endswith("." + extension)):
+                return False
+            if min_size is not None and size < min_size:
+                return False
+            if max_size is not None and size > max_size:
+                return False
+            if modified_after and modified < modified_after:
+                return False
+            if modified_before and modified > modified_before:
+                return False
+            return True
+        
+        results = []
+        with self.lock:
+            if not query:
+                candidates = iter(self.items)
+            elif mode == "substring":
+                candidates = self._substring_ids(query)
+            else:
+                words = self.TOKEN_RE.findall(query)
+                sets = [
+                    self._prefix_ids(word) if mode == "prefix" else self.tokens.get(word, set())
+                    for word in words
+                ]
+                candidates = iter(set.intersection(*sets) if sets else set())
+            for item_id in candidates:
+                record = self.items[item_id]
+                if item_id in self.roots or not matches(record):
+                    continue
+                results.append({
+                    "id": item_id, "name": record[0], "path": self.path(item_id),
+                    "folder": record[3], "size": record[4], "modified": record[5]
+                })
+                if len(results) >= limit:
+                    break
+        return sorted(results, key=lambda r: (not r["folder"], r["name"].lower()))
+
+# -------------------- Storage Analytics --------------------
+def file_extension(name: str) -> str:
+    return os.path.splitext(name)[1].lower() or "(none)"
+
+class StorageCache:
+    """Per-folder results of storage scans, reused while a folder is unchanged.
+    
+    An entry holds what one listing of a folder found: the folder's tag
+    (cTag, else eTag) and size at the time, its file count and bytes per
+    extension, its largest files, the subfolders that were scanned and
+    those only totalled from their size facet. A folder whose tag and size
+    still match keeps its entry and the entries below it, so a repeat scan
+    lists only changed subtrees. ``report`` aggregates a scanned subtree
+    without touching the network.
+    """
+    def __init__(self):
+        # folder id -> {"tag", "size", "files", "by_ext", "largest",
+        #               "folders": [(id, name, size)], "pruned": [(name, size)]}
+        self.entries: Dict[str, Dict] = {}
+        # (top_n, prune_bytes) the entries were built with
+        self.settings: Optional[Tuple[int, int]] = None
+        self.lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def configure(self, top_n: int, prune_bytes: int) -> None:
+        """Drop every entry if they were built with other settings"""
+        with self.lock:
+            if self.settings != (top_n, prune_bytes):
+                self.entries.clear()
+                self.settings = (top_n, prune_bytes)
+    
+    def is_current(self, folder: Dict) -> bool:
+        tag = folder.get("cTag") or folder.get("eTag")
+        with self.lock:
+            entry = self.entries.get(folder["id"])
+            return entry is not None and tag is not None and \
+                (entry["tag"], entry["size"]) == (tag, folder.get("size", 0))
+    
+    def put(self, folder_id: str, entry: Dict) -> None:
+        """Store a folder's new entry; subfolders it no longer has are forgotten with their subtrees"""
+        with self.lock:
+            old = self.entries.get(folder_id)
+            self.entries[folder_id] = entry
+            if old is not None:
+                kept = {child_id for child_id, _, _ in entry["folders"]}
+                self._drop([child_id for child_id, _, _ in old["folders"] if child_id not in kept])
+    
+    def _drop(self, folder_ids: List[str]) -> None:
+        while folder_ids:
+            entry = self.entries.pop(folder_ids.pop(), None)
+            if entry is not None:
+                folder_ids.extend(child_id for child_id, _, _ in entry["folders"])
+    
+    def report(self, folder_id: str, top_n: int) -> Dict:
+        """Totals for the subtree under ``folder_id``.
+        
+        ``folders`` are (path, size, file count) rows, the count None for
+        subtrees totalled without a listing; ``largest`` are (path, size, id)
+        of files no smaller than the prune size and ``types`` (extension,
+        file count, size), all largest first.
+        Bytes in unlisted subtrees are reported under "(unscanned)".
+        """
+        folders: List[Tuple[str, int, Optional[int]]] = []
+        largest: List[Tuple[int, str, str]] = []
+        by_ext: Dict[str, List[int]] = {}
+        unscanned = 0
+        
+        def walk(entry_id: str, path: str) -> int:
+            nonlocal unscanned
+            entry = self.entries[entry_id]
+            count = entry["files"]
+            for ext, (files, size) in entry["by_ext"].items():
+                totals = by_ext.setdefault(ext, [0, 0])
+                totals[0] += files
+                totals[1] += size
+            for size, name, item_id in entry["largest"]:
+                row = (size, path + name, item_id)
+                if len(largest) < top_n:
+                    heapq.heappush(largest, row)
+                elif row > largest[0]:
+                    heapq.heapreplace(largest, row)
+            for child_id, name, size in entry["folders"]:
+                if child_id in self.entries:
+                    count += walk(child_id, f"{path}{name}/")
+                else:
+                    # Its listing failed: count it like a pruned subtree
+                    folders.append((f"{path}{name}/", size, None))
+                    unscanned += size
+            for name, size in entry["pruned"]:
+                folders.append((f"{path}{name}/", size, None))
+                unscanned += size
+            folders.append((path or "/", entry["size"], count))
+            return count
+        
+        with self.lock:
+            files = walk(folder_id, "")
+            size = self.entries[folder_id]["size"]
+        if unscanned:
+            by_ext["(unscanned)"] = [0, unscanned]
+        return {
+            "size": size,
+            "files": files,
+            "folders": sorted(folders, key=lambda row: row[1], reverse=True),
+            "largest": [(path, size, item_id) for size, path, item_id in sorted(largest, reverse=True)],
+            "types": sorted(((ext, files, size) for ext, (files, size) in by_ext.items()),
+                            key=lambda row: row[2], reverse=True)
+        }
+
+# -------------------- Upload Pipeline --------------------
+class ByteBudget:
+    """Counting semaphore over bytes; blocks reservations that would exceed the limit"""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+    
+    def acquire(self, size: int) -> None:
+        # A single reservation larger than the limit waits until it runs alone
+        size = min(size, self.limit)
+        with self.cond:
+            self.cond.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+    
+    async def aacquire(self, size: int) -> None:
+        """``acquire`` for coroutines: polls instead of blocking the event loop"""
+        size = min(size, self.limit)
+        while True:
+            with self.cond:
+                if self.used + size <= self.limit:
+                    self.used += size
+                    return
+            await asyncio.sleep(ASYNC_SLOT_POLL)
+    
+    def release(self, size: int) -> None:
+        size = min(size, self.limit)
+        with self.cond:
+            self.used -= size
+            self.cond.notify_all()
+
+def upload_matches(item: Dict, file_path: str, stat: os.stat_result) -> bool:
+    """Whether a driveItem holds the uploaded file: same size and, when Graph reports one, quickXorHash"""
+    if "error" in item or item.get("size") != stat.st_size:
+        return False
+    remote_hash = item_hash(item)
+    return remote_hash is None or get_hash_cache().file_hash(file_path, stat) == remote_hash
+
+def upload_session_state(status: int, body: Dict, size: int) -> Tuple[str, Optional[List[Tuple[int, int]]]]:
+    """Read an upload session status response (see ``OneDriveManager._pending_ranges_plan``)"""
+    if status == 404:
+        return "gone", None
+    if status != 200:
+        return "unknown", None
+    ranges = []
+    for spec in body.get("nextExpectedRanges", []):
+        start, _, end = spec.partition("-")
+        ranges.append((int(start), int(end) if end else size - 1))
+    return "active", ranges
+
+def upload_mismatch(file_name: str) -> Dict:
+    return {"error": {"code": "uploadMismatch",
+                      "message": f"{file_name} on OneDrive does not match the uploaded file; upload it again"}}
+
+def read_range(file_path: str, start: int, length: int) -> bytes:
+    """Read ``length`` bytes at ``start``; run through asyncio.to_thread by async uploads"""
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+class UploadTracker:
+    """Thread-safe per-file and aggregate progress for a multi-file upload"""
+    def __init__(self, file_paths: List[str]):
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.files = {
+            path: {"size": os.path.getsize(path), "sent": 0, "start": None, "end": None, "error": None}
+            for path in file_paths
+        }
+    
+    def start(self, path: str) -> None:
+        with self.lock:
+            self.files[path]["start"] = time.monotonic()
+    
+    def advance(self, path: str, size: int) -> None:
+        with self.lock:
+            self.files[path]["sent"] += size
+    
+    def finish(self, path: str, error: Optional[str] = None) -> None:
+        with self.lock:
+            self.files[path]["end"] = time.monotonic()
+            self.files[path]["error"] = error
+    
+    def render(self) -> str:
+        """Status log text: one aggregate line, then one line per file"""
+        now = time.monotonic()
+        with self.lock:
+            files = [(path, dict(state)) for path, state in self.files.items()]
+        sent = sum(state["sent"] for _, state in files)
+        total = sum(state["size"] for _, state in files)
+        finished = sum(state["end"] is not None for _, state in files)
+        failed = sum(state["error"] is not None for _, state in files)
+        elapsed = max(now - self.started_at, 1e-6)
+        lines = [
+            f"{finished}/{len(files)} files ({failed} failed), "
+            f"{human_size(sent)}/{human_size(total)} at {human_size(sent / elapsed)}/s"
+        ]
+        for path, state in files:
+            name = os.path.basename(path)
+            if state["error"]:
+                lines.append(f"FAIL {name}: {state['error']}")
+            elif state["start"] is None:
+                lines.append(f"     {name}: queued")
+            else:
+                duration = max((state["end"] or now) - state["start"], 1e-6)
+                percent = 100 * state["sent"] / state["size"] if state["size"] else 100
+                status = "OK  " if state["end"] else "    "
+                lines.append(f"{status} {name}: {percent:.0f}% at {human_size(state['sent'] / duration)}/s")
+        return "\n".join(lines)
+
+def human_size(size: float) -> str:
+    """Format a byte count as B/KB/MB/GB/TB"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+# -------------------- Copy Jobs --------------------
+class CopyMonitor:
+    """Server-side copy jobs, followed through their Graph monitor URLs.
+    
+    Graph accepts a copy with 202 and a monitor URL and does the work in
+    the service, so no content passes through this host. A background
+    thread, running only while some job is unfinished, polls every
+    unfinished job each COPY_POLL_INTERVAL seconds, COPY_POLL_WORKERS at a
+    time. A job whose status and percentage stay the same for
+    COPY_STALL_SECONDS is marked failed, so a monitor that keeps answering
+    inProgress cannot keep the thread polling forever. ``on_done(job)`` is
+    called once per job when it completes or fails.
+    """
+    FINISHED = ("completed", "failed")
+    
+    def __init__(self, on_done: Optional[Callable[[Dict], None]] = None):
+        self.on_done = on_done
+        # job id -> {"source", "destination", "monitor", "status", "percent", "item_id", "error",
+        #            "poll_errors", "progress_at"}
+        self.jobs: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._polling = False
+    
+    def add(self, source_id: str, destination_id: str, monitor_url: str) -> str:
+        """Start following a copy; returns its job id"""
+        with self.lock:
+            job_id = str(next(self._ids))
+            self.jobs[job_id] = {"source": source_id, "destination": destination_id, "monitor": monitor_url,
+                                 "status": "notStarted", "percent": 0.0, "item_id": None, "error": None,
+                                 "poll_errors": 0, "progress_at": time.monotonic()}
+            finished = [key for key, job in self.jobs.items() if job["status"] in self.FINISHED]
+            for key in finished[:max(0, len(finished) - COPY_JOBS_KEPT)]:
+                del self.jobs[key]
+            if not self._polling:
+                self._polling = True
+                threading.Thread(target=self._poll_forever, daemon=True).start()
+        return job_id
+    
+    def status(self, job_ids: List[str]) -> List[Dict]:
+        with self.lock:
+            return [dict(self.jobs[job_id], id=job_id) for job_id in job_ids if job_id in self.jobs]
+    
+    def _poll_forever(self) -> None:
+        with ThreadPoolExecutor(max_workers=COPY_POLL_WORKERS) as pool:
+            while True:
+                with self.lock:
+                    active = [(job_id, dict(job)) for job_id, job in self.jobs.items()
+                              if job["status"] not in self.FINISHED]
+                    if not active:
+                        self._polling = False
+                        return
+                list(pool.map(lambda entry: self._poll(*entry), active))
+                time.sleep(COPY_POLL_INTERVAL)
+    
+    def _poll(self, job_id: str, job: Dict) -> None:
+        update: Dict = {}
+        try:
+            # Monitor URLs are pre-authenticated; a 303 points at the finished copy
+            response = graph_send("GET", job["monitor"], allow_redirects=False)
+            if response.status_code == 303:
+                location = response.headers.get("Location", "")
+                update = {"status": "completed", "percent": 100.0, "item_id": location.rstrip("/").rsplit("/", 1)[-1]}
+            elif response.status_code in (200, 202):
+                body = response.json() if response.content else {}
+                update = {"status": body.get("status", "inProgress"),
+                          "percent": body.get("percentageComplete", job["percent"]),
+                          "item_id": body.get("resourceId"), "poll_errors": 0}
+                if update["status"] == "failed":
+                    update["error"] = (body.get("error") or {}).get("message") or "Copy failed"
+            else:
+                update = {"poll_errors": job["poll_errors"] + 1, "error": f"HTTP {response.status_code}"}
+        except (requests.RequestException, ValueError) as e:
+            update = {"poll_errors": job["poll_errors"] + 1, "error": str(e)}
+        progress = (update.get("status", job["status"]), update.get("percent", job["percent"]))
+        if update.get("poll_errors", 0) >= COPY_MAX_POLL_ERRORS:
+            update["status"] = "failed"
+        elif progress != (job["status"], job["percent"]):
+            update["progress_at"] = time.monotonic()
+        elif time.monotonic() - job["progress_at"] >= COPY_STALL_SECONDS:
+            update.update(status="failed", error=f"Timed out: no progress for {COPY_STALL_SECONDS} s")
+        
+        with self.lock:
+            if job_id not in self.jobs:
+                return
+            self.jobs[job_id].update(update)
+            finished = dict(self.jobs[job_id], id=job_id) if update.get("status") in self.FINISHED else None
+        if finished and self.on_done:
+            self.on_done(finished)
+    
+    def render(self, job_ids: List[str]) -> str:
+        """Status log text: one aggregate line, then one line per job"""
+        jobs = self.status(job_ids)
+        done = sum(job["status"] == "completed" for job in jobs)
+        failed = sum(job["status"] == "failed" for job in jobs)
+        lines = [f"{done}/{len(jobs)} copies complete ({failed} failed)"]
+        for job in jobs:
+            if job["status"] == "failed":
+                lines.append(f"FAIL {job['source']}: {job['error']}")
+            elif job["status"] == "completed":
+                lines.append(f"OK   {job['source']} -> {job['item_id']}")
+            else:
+                lines.append(f"     {job['source']}: {job['status']} {job['percent'] or 0:.0f}%")
+        return "\n".join(lines)
+
+# -------------------- Thumbnails --------------------
+# Content types of Graph thumbnails -> file extension the gallery serves them with
+THUMBNAIL_TYPES = {"image/jpeg": ".jpg", "image/png": ".png", "image/gif": ".gif", "image/webp": ".webp"}
+# Empty marker file recording that Graph has no thumbnail for an item version,
+# and what it is counted as against the cache's size limit
+NO_THUMBNAIL = ".none"
+NO_THUMBNAIL_BYTES = 512
+
+def has_thumbnail(item: Dict) -> bool:
+    return "folder" not in item and file_extension(item["name"]) in THUMBNAIL_EXTENSIONS
+
+class ThumbnailCache:
+    """Directory of thumbnail images keyed by item id and eTag, bounded in size.
+    
+    An edited item gets a new eTag and so a new file; the stale one simply
+    ages out. Versions Graph has no thumbnail for are kept as empty marker
+    files under the same key, so they are not looked up again. Files are evicted least recently used first (by mtime, which a
+    hit refreshes) once they total more than ``max_bytes``. The directory is
+    scanned once when the cache opens and shared by every session.
+    """
+    def __init__(self, path: str = THUMBNAIL_CACHE_PATH, max_bytes: int = THUMBNAIL_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key -> (file name, bytes), least recently used first
+        self.files: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self.total = 0
+        os.makedirs(path, exist_ok=True)
+        found = []
+        for entry in os.scandir(path):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".part"):
+                # Left behind by a write that was interrupted
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            size = NO_THUMBNAIL_BYTES if entry.name.endswith(NO_THUMBNAIL) else stat.st_size
+            found.append((stat.st_mtime, entry.name, size))
+        for _, name, size in sorted(found):
+            self.files[os.path.splitext(name)[0]] = (name, size)
+            self.total += size
+        with self.lock:
+            self._evict()
+    
+    def __len__(self) -> int:
+        return len(self.files)
+    
+    @staticmethod
+    def key(item_id: str, etag: str) -> str:
+        return hashlib.sha1(f"{item_id}\0{etag}".encode()).hexdigest()
+    
+    def get(self, item_id: str, etag: Optional[str]) -> Optional[str]:
+        """Path of the cached thumbnail for this version of the item, "" if it has none, or None"""
+        if not etag:
+            return None
+        key = self.key(item_id, etag)
+        with self.lock:
+            entry = self.files.get(key)
+            if entry is None:
+                return None
+            self.files.move_to_end(key)
+        path = os.path.join(self.path, entry[0])
+        try:
+            os.utime(path)
+        except OSError:
+            # Removed behind the cache's back
+            with self.lock:
+                self._remove(key)
+            return None
+        return "" if entry[0].endswith(NO_THUMBNAIL) else path
+    
+    def put(self, item_id: str, etag: str, data: bytes, extension: str = ".jpg") -> str:
+        """Store a thumbnail and return its path, evicting old ones past the size limit"""
+        key = self.key(item_id, etag)
+        return self._store(key, key + extension, data, len(data))
+    
+    def put_missing(self, item_id: str, etag: str) -> None:
+        """Record that this version of the item has no thumbnail"""
+        key = self.key(item_id, etag)
+        self._store(key, key + NO_THUMBNAIL, b"", NO_THUMBNAIL_BYTES)
+    
+    def _store(self, key: str, name: str, data: bytes, size: int) -> str:
+        path = os.path.join(self.path, name)
+        partial = f"{path}.{threading.get_ident()}.part"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+        with self.lock:
+            self._remove(key, keep=name)
+            self.files[key] = (name, size)
+            self.total += size
+            self._evict()
+        return path
+    
+    def _evict(self) -> None:
+        # The newest file stays even if it alone is over the limit
+        while self.total > self.max_bytes and len(self.files) > 1:
+            self._remove(next(iter(self.files)))
+    
+    def _remove(self, key: str, keep: Optional[str] = None) -> None:
+        entry = self.files.pop(key, None)
+        if entry is None:
+            return
+        self.total -= entry[1]
+        if entry[0] != keep:
+            try:
+                os.remove(os.path.join(self.path, entry[0]))
+            except OSError:
+                pass
+
+_thumbnail_cache: Optional[ThumbnailCache] = None
+_thumbnail_cache_lock = threading.Lock()
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    """Return the process-wide thumbnail cache, opening it on first use"""
+    global _thumbnail_cache
+    with _thumbnail_cache_lock:
+        if _thumbnail_cache is None:
+            _thumbnail_cache = ThumbnailCache()
+        return _thumbnail_cache
+
+# -------------------- Request Plans --------------------
+# Operations offered by both OneDriveManager and AsyncOneDriveManager are
+# written once, as generators ("plans") that yield the steps below and are sent
+# each step's result. OneDriveManager runs them with blocking calls and
+# AsyncOneDriveManager with coroutines, so only the transport differs.
+Plan = Generator[Any, Any, Any]
+
+# What either transport raises when a request got no usable response
+TRANSPORT_ERRORS = (requests.RequestException, httpx.HTTPError, ValueError)
+
+class Call(NamedTuple):
+    """A Graph API request through ``make_request``; ``body`` is a raw request body"""
+    method: str
+    endpoint: str
+    params: Optional[Dict] = None
+    json: Optional[Dict] = None
+    body: Optional[bytes] = None
+    cost: int = 1
+
+class Send(NamedTuple):
+    """A request to a pre-authenticated URL; the result is ``(status, json body)``.
+    
+    ``file_range`` is ``(path, start, length)`` of file data to send, read
+    just before sending; with ``check`` an error status is raised.
+    """
+    method: str
+    url: str
+    headers: Optional[Dict] = None
+    file_range: Optional[Tuple[str, int, int]] = None
+    check: bool = False
+
+class Parallel(NamedTuple):
+    """Steps or sub-plans run ``limit`` at a time; the result is their results in order.
+    
+    ``done(job, result)`` is called as each job finishes. The first error
+    cancels the jobs not yet started and is raised into the plan.
+    """
+    jobs: List[Any]
+    limit: int
+    done: Optional[Callable[[Any, Any], None]] = None
+
+class Blocking(NamedTuple):
+    """Local work that may block (disk, hashing); kept off the event loop by the async driver"""
+    func: Callable
+    args: Tuple = ()
+
+class Reserve(NamedTuple):
+    """Wait until ``size`` bytes of a ByteBudget are free and take them"""
+    budget: "ByteBudget"
+    size: int
+
+class Pause(NamedTuple):
+    seconds: float
+
+class Emit(NamedTuple):
+    """Hand a value to whoever iterates the plan (listing pages); the result is None"""
+    value: Any
 
 # -------------------- Enhanced OneDrive Manager --------------------
 class OneDriveManager:
-    def __init__(self, access_token: str, refresh_token: str):
+    def __init__(self, access_token: str, refresh_token: str,
+                 expires_in: int = 3600, account_id: Optional[str] = None):
         self.access_token = access_token
         self.refresh_token = refresh_token
+        self.expires_at = time.time() + expires_in
+        self.account_id = account_id
+        self._refresh_lock = threading.Lock()
         self.current_folder_id = "root"
         self.folder_stack = ["root"]
+        # (folder id, local path) -> (uploadUrl of an unfinished upload session,
+        # (size, mtime_ns) of the file it was started for)
+        self.upload_sessions: Dict[Tuple[str, str], Tuple[str, Tuple[int, int]]] = {}
+        self.listing_cache = ListingCache()
+        self.search_index = SearchIndex()
+        # Set when drop_caches emptied the search index; the next search reloads it
+        self._search_dropped = False
+        self.storage_cache = StorageCache()
+        self.copy_monitor = CopyMonitor(on_done=self._copy_done)
+        self.prefetcher = ListingPrefetcher()
+        # Set once the first delta sync has completed
+        self.drive_id: Optional[str] = None
+        self.index_ready = threading.Event()
+        self._index_wakeup = threading.Event()
+        register_token_holder(self)
     
-    def refresh_access_token(self) -> bool:
-        """Refresh access token using refresh token"""
-        app = msal.ConfidentialClientApplication(
-            CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
-        )
-        result = app.acquire_token_by_refresh_token(self.refresh_token, SCOPE)
-        if "access_token" in result:
+    def token_expires_within(self, seconds: float) -> bool:
+        return time.time() >= self.expires_at - seconds
+    
+    def refresh_access_token(self, rejected_token: Optional[str] = None) -> bool:
+        """Refresh access token using the shared token cache or the refresh token.
+        
+        Concurrent callers are serialized on one lock; whoever gets it second
+        finds a fresh token and returns without another round trip. Pass the
+        token a request was rejected with to force a refresh after a 401.
+        """
+        with self._refresh_lock:
+            if rejected_token is not None:
+                if self.access_token != rejected_token:
+                    return True
+            elif not self.token_expires_within(TOKEN_REFRESH_MARGIN):
+                return True
+            
+            app = get_msal_app()
+            result = None
+            if self.account_id:
+                account = next((a for a in app.get_accounts()
+                                if a["home_account_id"] == self.account_id), None)
+                if account:
+                    result = app.acquire_token_silent(SCOPE, account, force_refresh=True)
+            if not result or "access_token" not in result:
+                result = app.acquire_token_by_refresh_token(self.refresh_token, SCOPE)
+            save_token_cache()
+            if "access_token" not in result:
+                metrics.record_token_refresh("failed")
+                return False
+            metrics.record_token_refresh("ok")
             self.access_token = result["access_token"]
+            self.refresh_token = result.get("refresh_token", self.refresh_token)
+            self.expires_at = time.time() + int(result.get("expires_in", 3600))
             return True
-        return False
     
-    def make_request(self, method: str, endpoint: str, **kwargs) -> Dict:
-        """Helper method for API requests with automatic token refresh"""
+    def make_request(self, method: str, endpoint: str, cost: int = 1, **kwargs) -> Dict:
+        """Helper method for API requests with automatic token refresh and throttling.
+        
+        ``cost`` is the number of rate tokens the call uses (one per $batch sub-request).
+        """
+        # Normally the background refresher got here first; this covers a stalled one
+        if self.token_expires_within(TOKEN_REFRESH_INTERVAL):
+            self.refresh_access_token()
+        
         headers = kwargs.pop("headers", {})
-        headers["Authorization"] = f"Bearer {self.access_token}"
+        token = self.access_token
+        headers["Authorization"] = f"Bearer {token}"
         
-        response = requests.request(
+        # Absolute URLs (e.g. @odata.nextLink) are used as-is
+        url = endpoint if "://" in endpoint else f"{GRAPH_URL}/{endpoint}"
+        response = graph_send(
             method, 
-            f"https://graph.microsoft.com/v1.0/{endpoint}",
+            url,
+            cost=cost,
             headers=headers,
             **kwargs
         )
         
-        if response.status_code == 401:  # Token expired
-            if self.refresh_access_token():
+        if response.status_code == 401:  # Token revoked or expired early
+            if self.refresh_access_token(rejected_token=token):
+                metrics.record_retry("unauthorized")
                 headers["Authorization"] = f"Bearer {self.access_token}"
-                response = requests.request(
+                response = graph_send(
                     method, 
-                    f"https://graph.microsoft.com/v1.0/{endpoint}",
+                    url,
+                    cost=cost,
                     headers=headers,
                     **kwargs
                 )
-        return response.json()
+        # DELETE and some errors come back without a body
+        return response.json() if response.content else {}
     
-    def list_items(self) -> List[Dict]:
-        """List items in current folder"""
-        endpoint = f"me/drive/items/{self.current_folder_id}/children"
-        data = self.make_request("GET", endpoint)
-        return sorted(
-            data.get("value", []),
-            key=lambda x: (x.get("folder") is None, x["name"].lower())
-        )
+    def drive(self, plan: Plan) -> Iterator:
+        """Run a plan with blocking calls, yielding the values it emits; returns its result"""
+        try:
+            step = next(plan)
+            while True:
+                if isinstance(step, Emit):
+                    yield step.value
+                    step = plan.send(None)
+                    continue
+                try:
+                    result = self.perform(step)
+                except Exception as e:
+                    # The plan decides whether a failed step is fatal
+                    step = plan.throw(e)
+                else:
+                    step = plan.send(result)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            plan.close()
+    
+    def run(self, plan: Plan):
+        """Run a plan to completion and return its result"""
+        driver = self.drive(plan)
+        try:
+            while True:
+                next(driver)
+        except StopIteration as stop:
+            return stop.value
+    
+    def perform(self, step):
+        """Carry out one plan step on the calling thread"""
+        if isinstance(step, Call):
+            return self.make_request(step.method, step.endpoint, cost=step.cost,
+                                     params=step.params, json=step.json, data=step.body)
+        if isinstance(step, Send):
+            data = read_range(*step.file_range) if step.file_range else None
+            response = graph_send(step.method, step.url, data=data, headers=dict(step.headers or {}))
+            if step.check:
+                response.raise_for_status()
+            return response.status_code, response.json() if response.content else {}
+        if isinstance(step, Parallel):
+            jobs = list(step.jobs)
+            if not jobs:
+                return []
+            results = [None] * len(jobs)
+            with ThreadPoolExecutor(max_workers=max(1, min(step.limit, len(jobs)))) as pool:
+                futures = {
+                    pool.submit(self.run if inspect.isgenerator(job) else self.perform, job): i
+                    for i, job in enumerate(jobs)
+                }
+                try:
+                    for future in as_completed(futures):
+                        i = futures[future]
+                        results[i] = future.result()
+                        if step.done:
+                            step.done(jobs[i], results[i])
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            return results
+        if isinstance(step, Blocking):
+            return step.func(*step.args)
+        if isinstance(step, Reserve):
+            return step.budget.acquire(step.size)
+        if isinstance(step, Pause):
+            return time.sleep(step.seconds)
+        raise TypeError(f"Unknown plan step: {step!r}")
+    
+    def sync_index(self) -> None:
+        """Pull changes since the last delta link into the local metadata index"""
+        index = get_drive_index()
+        if self.drive_id is None:
+            self.drive_id = self.make_request("GET", "me/drive", params={"$select": "id"})["id"]
+        endpoint = index.delta_link(self.drive_id) or "me/drive/root/delta"
+        if not self.index_ready.is_set() and endpoint != "me/drive/root/delta":
+            # Resuming from a stored delta link: seed search from the local mirror
+            self.search_index.add(index.all_items(self.drive_id))
+        while endpoint:
+            data = self.make_request("GET", endpoint)
+            if "error" in data:
+                if data["error"].get("code", "").startswith("resync"):
+                    # The delta link expired; rebuild the mirror from scratch
+                    index.reset(self.drive_id)
+                    self.search_index.clear()
+                    endpoint = "me/drive/root/delta"
+                    continue
+                return
+            delta_link = data.get("@odata.deltaLink")
+            index.apply_delta(self.drive_id, data.get("value", []), delta_link)
+            self.search_index.add(data.get("value", []))
+            endpoint = data.get("@odata.nextLink")
+        self.index_ready.set()
+    
+    def start_index_sync(self) -> None:
+        """Keep the metadata index current from a background thread"""
+        manager_ref = weakref.ref(self)
+        
+        def run() -> None:
+            while True:
+                manager = manager_ref()
+                if manager is None:
+                    return
+                try:
+                    manager.sync_index()
+                except Exception:
+                    pass  # try again on the next pass
+                wakeup = manager._index_wakeup
+                del manager
+                wakeup.wait(INDEX_SYNC_INTERVAL)
+                wakeup.clear()
+        
+        threading.Thread(target=run, daemon=True).start()
+    
+    def drop_caches(self) -> None:
+        """Free the in-memory caches under memory pressure; all of them can be rebuilt.
+        
+        The search index is reloaded from the local metadata index on the
+        next search; listings and storage scans are fetched again when used.
+        """
+        self.listing_cache = ListingCache()
+        self.storage_cache = StorageCache()
+        self.search_index.clear()
+        self._search_dropped = True
+    
+    def ensure_search_index(self) -> None:
+        """Reload the search index emptied by ``drop_caches``, once the metadata index is synced"""
+        if self._search_dropped and self.index_ready.is_set():
+            self._search_dropped = False
+            self.search_index.add(get_drive_index().all_items(self.drive_id))
+    
+    def index_changed(self, items: List[Dict] = (), folder_id: Optional[str] = None) -> None:
+        """Record a change this manager just made and ask the sync thread to confirm it.
+        
+        ``items`` are driveItems returned by Graph (or ``{"id": ..., "deleted": {}}``
+        markers); applying them right away keeps the next listing accurate
+        without waiting for the delta round trip. Cached listings of
+        ``folder_id`` and of every affected parent are dropped.
+        """
+        changed = [item for item in items if "id" in item]
+        self.search_index.add(changed)
+        if folder_id:
+            self.listing_cache.invalidate(folder_id)
+        for item in changed:
+            if "deleted" in item:
+                self.listing_cache.invalidate_item(item["id"])
+            elif item.get("parentReference", {}).get("id"):
+                self.listing_cache.invalidate(item["parentReference"]["id"])
+        if changed and self.index_ready.is_set():
+            get_drive_index().apply_delta(self.drive_id, changed)
+        self._index_wakeup.set()
+    
+    def get_item(self, item_id: str) -> Dict:
+        """Look up an item, from the local index when it has been synced"""
+        return self.run(self._get_item_plan(item_id))
+    
+    def _get_item_plan(self, item_id: str) -> Plan:
+        if self.index_ready.is_set():
+            item = get_drive_index().get(self.drive_id, item_id)
+            if item is not None:
+                return item
+        return (yield Call("GET", f"me/drive/items/{item_id}"))
+    
+    def breadcrumb(self) -> List[str]:
+        """Names of the folders in folder_stack below the root"""
+        return self.run(self._breadcrumb_plan())
+    
+    def _breadcrumb_plan(self) -> Plan:
+        folder_ids = self.folder_stack[1:]
+        items = yield Parallel([self._get_item_plan(folder_id) for folder_id in folder_ids],
+                               max(1, len(folder_ids)))
+        return [item.get("name", folder_id) for item, folder_id in zip(items, folder_ids)]
+    
+    def iter_items(self, folder_id: Optional[str] = None,
+                   page_size: int = LISTING_PAGE_SIZE) -> Iterator[List[DriveItem]]:
+        """Yield the children of a folder page by page, following @odata.nextLink.
+        
+        Only LISTING_SELECT is requested and each child becomes a DriveItem.
+        Once the metadata index is synced the whole folder comes from it as a
+        single page.
+        """
+        return self.drive(self._listing_plan(folder_id, page_size))
+    
+    def _listing_plan(self, folder_id: Optional[str], page_size: int) -> Plan:
+        """Emits the pages of ``iter_items``"""
+        folder_id = folder_id or self.current_folder_id
+        if self.index_ready.is_set():
+            yield Emit(get_drive_index().children(self.drive_id, folder_id))
+            return
+        
+        # Recently seen folders come from memory; past the TTL only the tag is checked
+        entry = self.listing_cache.get(folder_id)
+        if entry is not None and self.listing_cache.is_fresh(entry):
+            yield Emit(entry["items"])
+            return
+        # Read before the first page, so a change during the listing leaves an older tag behind
+        data = yield Call("GET", f"me/drive/items/{folder_id}", params={"$select": "cTag,eTag"})
+        tag = data.get("cTag") or data.get("eTag")
+        if entry is not None and tag is not None and entry["tag"] == tag:
+            self.listing_cache.revalidated(folder_id)
+            yield Emit(entry["items"])
+            return
+        
+        items = []
+        endpoint = f"me/drive/items/{folder_id}/children"
+        params = {"$top": page_size, "$select": LISTING_SELECT}
+        while endpoint:
+            data = yield Call("GET", endpoint, params=params)
+            if "error" in data:
+                return
+            page = [DriveItem.from_json(item) for item in data.get("value", [])]
+            self.search_index.add(page)
+            items.extend(page)
+            yield Emit(page)
+            # The next link already carries the query string
+            endpoint, params = data.get("@odata.nextLink"), None
+        # Only complete listings are cached
+        self.listing_cache.put(folder_id, tag, items)
+    
+    def list_items(self) -> List[DriveItem]:
+        """List all items in current folder"""
+        items = [item for page in self.iter_items() for item in page]
+        return sorted(items, key=lambda x: (x.get("folder") is None, x["name"].lower()))
     
     def navigate(self, item_id: str, is_folder: bool) -> None:
         """Navigate into folder or reset to root"""
@@ -74,27 +1930,1095 @@ class OneDriveManager:
             self.current_folder_id = "root"
             self.folder_stack = ["root"]
     
+    def go_back(self) -> None:
+        """Return to the parent of the current folder"""
+        if len(self.folder_stack) > 1:
+            self.folder_stack.pop()
+        self.current_folder_id = self.folder_stack[-1]
+    
     def create_folder(self, name: str) -> Dict:
         """Create folder in current directory"""
-        endpoint = f"me/drive/items/{self.current_folder_id}/children"
-        return self.make_request("POST", endpoint, json={
+        return self.run(self._create_folder_plan(name))
+    
+    def _create_folder_plan(self, name: str) -> Plan:
+        folder_id = self.current_folder_id
+        folder = yield Call("POST", f"me/drive/items/{folder_id}/children", json={
             "name": name,
             "folder": {},
             "@microsoft.graph.conflictBehavior": "rename"
         })
+        self.index_changed([folder], folder_id)
+        return folder
     
     def delete_item(self, item_id: str) -> bool:
         """Delete specified item"""
-        endpoint = f"me/drive/items/{item_id}"
-        response = self.make_request("DELETE", endpoint)
-        return "error" not in response
+        return self.run(self._delete_item_plan(item_id))
+    
+    def _delete_item_plan(self, item_id: str) -> Plan:
+        response = yield Call("DELETE", f"me/drive/items/{item_id}")
+        if "error" in response:
+            return False
+        self.index_changed([{"id": item_id, "deleted": {}}])
+        return True
+    
+    def batch(self, sub_requests: List[Dict]) -> List[Dict]:
+        """Send sub-requests through /$batch, BATCH_LIMIT per call and several calls at once.
+        
+        Sub-requests throttled with 429/503, or whose /$batch call failed in
+        transit, are retried once the shared rate controller's pause has passed.
+        Returns one ``{"status", "headers", "body"}`` response per sub-request,
+        in input order.
+        """
+        return self.run(self._batch_plan(sub_requests))
+    
+    def _batch_plan(self, sub_requests: List[Dict]) -> Plan:
+        pending = {str(i): request for i, request in enumerate(sub_requests)}
+        results: Dict[str, Dict] = {}
+        for attempt in range(BATCH_MAX_RETRIES + 1):
+            ids = list(pending)
+            groups = [ids[i:i + BATCH_LIMIT] for i in range(0, len(ids), BATCH_LIMIT)]
+            sent_at = time.monotonic()
+            replies = yield Parallel([self._send_batch_plan(group, pending) for group in groups],
+                                     min(BATCH_CONCURRENCY, rate_controller.concurrency_limit))
+            
+            throttled, delay = {}, 0.0
+            for response in (response for group in replies for response in group):
+                if response["status"] in (429, 503) and attempt < BATCH_MAX_RETRIES:
+                    throttled[response["id"]] = pending[response["id"]]
+                    delay = max(delay, rate_controller.retry_delay(response.get("headers", {}), attempt))
+                else:
+                    results[response["id"]] = response
+            if not throttled:
+                break
+            metrics.record_retry("batch_throttled", len(throttled))
+            # Throttling inside a batch slows every caller, not just this job
+            rate_controller.on_throttle(delay, sent_at)
+            pending = throttled
+        return [results[str(i)] for i in range(len(sub_requests))]
+    
+    def _send_batch_plan(self, ids: List[str], requests_by_id: Dict[str, Dict]) -> Plan:
+        """POST one /$batch call; a failure of the whole call is reported for every sub-request"""
+        try:
+            data = yield Call("POST", "$batch", cost=len(ids), json={
+                "requests": [{"id": i, **requests_by_id[i]} for i in ids]
+            })
+        except TRANSPORT_ERRORS as e:
+            # Dropped connection or unreadable reply: 503 so every sub-request is retried
+            return batch_transport_error(ids, e)
+        if "responses" in data:
+            return data["responses"]
+        code = data.get("error", {}).get("code", "")
+        status = 429 if code in ("TooManyRequests", "activityLimitReached") else 500
+        return [{"id": i, "status": status, "body": data} for i in ids]
+    
+    def delete_items(self, item_ids: List[str]) -> List[Dict]:
+        """Delete many items through JSON batching; returns one result row per item"""
+        return self.run(self._delete_items_plan(item_ids))
+    
+    def _delete_items_plan(self, item_ids: List[str]) -> Plan:
+        responses = yield from self._batch_plan([
+            {"method": "DELETE", "url": f"/me/drive/items/{item_id}"} for item_id in item_ids
+        ])
+        self.index_changed([
+            {"id": item_id, "deleted": {}}
+            for item_id, response in zip(item_ids, responses) if response["status"] == 204
+        ])
+        return [batch_result(item_id, response) for item_id, response in zip(item_ids, responses)]
+    
+    def create_folders(self, names: List[str]) -> List[Dict]:
+        """Create many folders in the current directory through JSON batching"""
+        return self.run(self._create_folders_plan(names))
+    
+    def _create_folders_plan(self, names: List[str]) -> Plan:
+        folder_id = self.current_folder_id
+        responses = yield from self._batch_plan([
+            {
+                "method": "POST",
+                "url": f"/me/drive/items/{folder_id}/children",
+                "headers": {"Content-Type": "application/json"},
+                "body": {"name": name, "folder": {}, "@microsoft.graph.conflictBehavior": "rename"}
+            }
+            for name in names
+        ])
+        self.index_changed([response.get("body", {}) for response in responses
+                            if response["status"] in (200, 201)], folder_id)
+        return [batch_result(name, response) for name, response in zip(names, responses)]
+    
+    def copy_items(self, item_ids: List[str], destination_id: Optional[str] = None) -> List[Dict]:
+        """Copy many items into a folder (the current one by default) on the server.
+        
+        The copies are requested through JSON batching and name clashes get a
+        numbered name. Returns one result row per item; each accepted copy
+        has a ``job`` id to follow in ``copy_monitor``.
+        """
+        return self.run(self._copy_items_plan(item_ids, destination_id))
+    
+    def _copy_items_plan(self, item_ids: List[str], destination_id: Optional[str]) -> Plan:
+        destination_id = destination_id or self.current_folder_id
+        if destination_id == "root":
+            destination_id = (yield from self._get_item_plan("root")).get("id", destination_id)
+        responses = yield from self._batch_plan([self._copy_request(item_id, destination_id)
+                                                 for item_id in item_ids])
+        return self._track_copies(item_ids, destination_id, responses)
+    
+    def move_items(self, item_ids: List[str], destination_id: Optional[str] = None) -> List[Dict]:
+        """Move many items into a folder (the current one by default) by PATCHing their parentReference"""
+        return self.run(self._move_items_plan(item_ids, destination_id))
+    
+    def _move_items_plan(self, item_ids: List[str], destination_id: Optional[str]) -> Plan:
+        destination_id = destination_id or self.current_folder_id
+        if destination_id == "root":
+            destination_id = (yield from self._get_item_plan("root")).get("id", destination_id)
+        responses = yield from self._batch_plan([self._move_request(item_id, destination_id)
+                                                 for item_id in item_ids])
+        self._moved(item_ids, responses, destination_id)
+        return [batch_result(item_id, response) for item_id, response in zip(item_ids, responses)]
+    
+    def _copy_request(self, item_id: str, destination_id: str) -> Dict:
+        parent = {"id": destination_id}
+        if self.drive_id:
+            parent["driveId"] = self.drive_id
+        return {
+            "method": "POST",
+            "url": f"/me/drive/items/{item_id}/copy?@microsoft.graph.conflictBehavior=rename",
+            "headers": {"Content-Type": "application/json"},
+            "body": {"parentReference": parent}
+        }
+    
+    def _move_request(self, item_id: str, destination_id: str) -> Dict:
+        return {
+            "method": "PATCH",
+            "url": f"/me/drive/items/{item_id}",
+            "headers": {"Content-Type": "application/json"},
+            "body": {"parentReference": {"id": destination_id}}
+        }
+    
+    def _track_copies(self, item_ids: List[str], destination_id: str, responses: List[Dict]) -> List[Dict]:
+        """Result rows for copy requests; accepted ones are handed to the copy monitor"""
+        rows = []
+        for item_id, response in zip(item_ids, responses):
+            row = batch_result(item_id, response)
+            monitor_url = {k.lower(): v for k, v in (response.get("headers") or {}).items()}.get("location")
+            if response["status"] == 202 and monitor_url:
+                row["job"] = self.copy_monitor.add(item_id, destination_id, monitor_url)
+            rows.append(row)
+        return rows
+    
+    def _copy_done(self, job: Dict) -> None:
+        if job["status"] == "completed":
+            self.index_changed(folder_id=job["destination"])
+    
+    def _moved(self, item_ids: List[str], responses: List[Dict], destination_id: str) -> None:
+        """Apply moves to the caches: old folders no longer list the items, the destination does"""
+        moved = [(item_id, response.get("body") or {})
+                 for item_id, response in zip(item_ids, responses) if response["status"] == 200]
+        for item_id, _ in moved:
+            self.listing_cache.invalidate_item(item_id)
+        self.index_changed([item for _, item in moved], destination_id)
+    
+    def thumbnails(self, items: List[Dict]) -> Dict[str, str]:
+        """Local thumbnail files of the images, videos and documents among ``items``, by item id.
+        
+        Thumbnails cached for an item's current eTag need no request. The
+        rest are looked up through JSON batching, one sub-request returning
+        both the eTag and the thumbnail URL, and the pre-authenticated URLs
+        are downloaded THUMBNAIL_WORKERS at a time into the thumbnail cache.
+        Items Graph has no thumbnail for are left out, and remembered in the
+        cache for their eTag like the thumbnails themselves.
+        """
+        cache = get_thumbnail_cache()
+        paths: Dict[str, str] = {}
+        missing = []
+        for item in items:
+            if not has_thumbnail(item):
+                continue
+            path = cache.get(item["id"], item.get("eTag"))
+            if path:
+                paths[item["id"]] = path
+            elif path is None:
+                missing.append(item["id"])
+        if not missing:
+            return paths
+        
+        responses = self.batch([
+            {"method": "GET",
+             "url": f"/me/drive/items/{item_id}?$select=id,eTag&$expand=thumbnails($select={THUMBNAIL_SIZE})"}
+            for item_id in missing
+        ])
+        downloads = []
+        for item_id, response in zip(missing, responses):
+            body = response.get("body") or {}
+            if response["status"] != 200 or not body.get("eTag"):
+                continue
+            path = cache.get(item_id, body["eTag"])
+            if path is not None:
+                if path:
+                    paths[item_id] = path
+                continue
+            sets = body.get("thumbnails") or [{}]
+            url = (sets[0].get(THUMBNAIL_SIZE) or {}).get("url")
+            if url:
+                downloads.append((item_id, body["eTag"], url))
+            else:
+                cache.put_missing(item_id, body["eTag"])
+        
+        def download(item_id: str, etag: str, url: str) -> Optional[str]:
+            try:
+                response = graph_send("GET", url)
+            except requests.RequestException:
+                return None
+            if response.status_code != 200 or not response.content:
+                return None
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+            return cache.put(item_id, etag, response.content, THUMBNAIL_TYPES.get(content_type, ".jpg"))
+        
+        if downloads:
+            workers = min(THUMBNAIL_WORKERS, len(downloads), rate_controller.concurrency_limit)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for (item_id, _, _), path in zip(downloads, pool.map(lambda d: download(*d), downloads)):
+                    if path:
+                        paths[item_id] = path
+        return paths
+    
+    def upload_file(self, file_path: str, max_workers: int = UPLOAD_CONCURRENCY,
+                    folder_id: Optional[str] = None,
+                    progress: Optional[Callable[[int], None]] = None) -> Dict:
+        """Upload file to current directory (or ``folder_id``).
+        
+        ``progress`` is called with the number of bytes each time a part of the
+        file has been accepted by Graph.
+        """
+        return self.run(self._upload_file_plan(file_path, max_workers, folder_id, progress))
+    
+    def _upload_file_plan(self, file_path: str, max_workers: int = UPLOAD_CONCURRENCY,
+                          folder_id: Optional[str] = None,
+                          progress: Optional[Callable[[int], None]] = None) -> Plan:
+        folder_id = folder_id or self.current_folder_id
+        size = os.path.getsize(file_path)
+        if size > SIMPLE_UPLOAD_LIMIT:
+            item = yield from self._upload_large_file_plan(file_path, max_workers, folder_id, progress)
+        else:
+            file_name = os.path.basename(file_path)
+            data = yield Blocking(read_range, (file_path, 0, size))
+            item = yield Call("PUT", f"me/drive/items/{folder_id}:/{file_name}:/content", body=data)
+            if progress and "id" in item:
+                progress(len(data))
+        self.index_changed([item], folder_id)
+        return item
+    
+    def upload_files(self, file_paths: List[str], tracker: Optional[UploadTracker] = None) -> List[Dict]:
+        """Upload many files into the current directory, UPLOAD_WORKERS at a time.
+        
+        Small files go up as a single PUT and large ones through upload
+        sessions. A shared byte budget caps how much file data all workers
+        together hold in memory.
+        """
+        return self.run(self._upload_files_plan(file_paths, tracker))
+    
+    def _upload_files_plan(self, file_paths: List[str], tracker: Optional[UploadTracker]) -> Plan:
+        folder_id = self.current_folder_id
+        budget = ByteBudget(UPLOAD_MAX_INFLIGHT_BYTES)
+        
+        def upload(file_path: str) -> Plan:
+            size = os.path.getsize(file_path)
+            # A simple PUT buffers the whole file, a session one chunk per worker
+            reserve = size if size <= SIMPLE_UPLOAD_LIMIT else UPLOAD_CHUNK_SIZE * max(1, UPLOAD_CONCURRENCY)
+            yield Reserve(budget, reserve)
+            try:
+                if tracker:
+                    tracker.start(file_path)
+                try:
+                    item = yield from self._upload_file_plan(
+                        file_path, folder_id=folder_id,
+                        progress=(lambda n: tracker.advance(file_path, n)) if tracker else None
+                    )
+                except Exception as e:
+                    item = {"error": {"code": "uploadFailed", "message": str(e)}}
+                if tracker:
+                    tracker.finish(file_path, item.get("error", {}).get("message"))
+                return item
+            finally:
+                budget.release(reserve)
+        
+        return (yield Parallel([upload(file_path) for file_path in file_paths], UPLOAD_WORKERS))
+    
+    def create_upload_session(self, file_name: str, folder_id: Optional[str] = None) -> Dict:
+        """Create an upload session for a file in the current directory"""
+        return self.run(self._create_upload_session_plan(file_name, folder_id))
     
-    def upload_file(self, file_path: str) -> Dict:
-        """Upload file to current directory"""
+    def _create_upload_session_plan(self, file_name: str, folder_id: Optional[str] = None) -> Plan:
+        endpoint = f"me/drive/items/{folder_id or self.current_folder_id}:/{file_name}:/createUploadSession"
+        return (yield Call("POST", endpoint, json={
+            "item": {"@microsoft.graph.conflictBehavior": "replace"}
+        }))
+    
+    def upload_large_file(self, file_path: str, max_workers: int = UPLOAD_CONCURRENCY,
+                          folder_id: Optional[str] = None,
+                          progress: Optional[Callable[[int], None]] = None) -> Dict:
+        """Upload file through a resumable upload session, streaming fixed-size chunks.
+        
+        At most ``max_workers`` chunks are held in memory at any time. After a
+        failed chunk the remaining ranges are taken from the session's
+        ``nextExpectedRanges``; an unfinished session is reused by the next
+        call for the same file and folder as long as the file's size and
+        mtime are unchanged, and cancelled otherwise. A session that has
+        expired is replaced by a new one. The item is returned only once its
+        size and quickXorHash match the local file.
+        """
+        return self.run(self._upload_large_file_plan(file_path, max_workers, folder_id, progress))
+    
+    def _upload_large_file_plan(self, file_path: str, max_workers: int = UPLOAD_CONCURRENCY,
+                                folder_id: Optional[str] = None,
+                                progress: Optional[Callable[[int], None]] = None) -> Plan:
+        folder_id = folder_id or self.current_folder_id
         file_name = os.path.basename(file_path)
-        endpoint = f"me/drive/items/{self.current_folder_id}:/{file_name}:/content"
-        with open(file_path, "rb") as f:
-            return self.make_request("PUT", endpoint, data=f.read())
+        stat = os.stat(file_path)
+        size, version = stat.st_size, (stat.st_size, stat.st_mtime_ns)
+        key = (folder_id, os.path.abspath(file_path))
+        item_endpoint = f"me/drive/items/{folder_id}:/{file_name}"
+        
+        # upload_url None: create a session; pending None: ask the session what it still expects
+        upload_url, pending = None, None
+        saved = self.upload_sessions.get(key)
+        if saved is not None:
+            if saved[1] == version:
+                upload_url = saved[0]
+            else:
+                # Started for another version of the file: its ranges must not be mixed in
+                self.upload_sessions.pop(key, None)
+                yield from self._cancel_upload_session_plan(saved[0])
+        
+        for attempt in range(UPLOAD_MAX_RETRIES + 1):
+            if attempt:
+                metrics.record_retry("upload_resume")
+                yield Pause(rate_controller.backoff(attempt - 1))
+            if upload_url is None:
+                session = yield from self._create_upload_session_plan(file_name, folder_id)
+                if "uploadUrl" not in session:
+                    return session
+                upload_url = session["uploadUrl"]
+                self.upload_sessions[key] = (upload_url, version)
+                pending = [(0, size - 1)]
+            elif pending is None:
+                state, pending = yield from self._pending_ranges_plan(upload_url, size)
+                if state == "unknown":
+                    continue
+                if state == "gone" or not pending:
+                    # Expired, or every byte arrived and only the final
+                    # response was lost: the item at the path tells which
+                    item = yield Call("GET", item_endpoint)
+                    if (yield Blocking(upload_matches, (item, file_path, stat))):
+                        self.upload_sessions.pop(key, None)
+                        return item
+                    if state == "gone":
+                        self.upload_sessions.pop(key, None)
+                        upload_url = None
+                    pending = None
+                    continue
+            try:
+                item = yield from self._upload_ranges_plan(upload_url, file_path, pending, size,
+                                                           max_workers, progress)
+            except TRANSPORT_ERRORS:
+                item = None
+            pending = None
+            if item is not None:
+                self.upload_sessions.pop(key, None)
+                if (yield Blocking(upload_matches, (item, file_path, stat))):
+                    return item
+                return upload_mismatch(file_name)
+        
+        return {"error": {"code": "uploadIncomplete",
+                          "message": f"Upload of {file_name} did not complete; retry to resume"}}
+    
+    def _upload_ranges_plan(self, upload_url: str, file_path: str, ranges: List[Tuple[int, int]],
+                            size: int, max_workers: int,
+                            progress: Optional[Callable[[int], None]] = None) -> Plan:
+        """PUT the given byte ranges in chunks, at most ``max_workers`` read and in flight at once.
+        
+        Returns the driveItem once the upload completes, else None.
+        """
+        chunks = [
+            (offset, min(offset + UPLOAD_CHUNK_SIZE, end + 1) - 1)
+            for start, end in ranges
+            for offset in range(start, end + 1, UPLOAD_CHUNK_SIZE)
+        ]
+        # The upload URL is pre-authenticated, so no Authorization header
+        sends = [
+            Send("PUT", upload_url, headers={"Content-Range": f"bytes {start}-{end}/{size}"},
+                 file_range=(file_path, start, end - start + 1), check=True)
+            for start, end in chunks
+        ]
+        done = (lambda send, _: progress(send.file_range[2])) if progress else None
+        item = None
+        for status, body in (yield Parallel(sends, max(1, max_workers), done)):
+            if status in (200, 201):
+                item = body
+        return item
+    
+    def _pending_ranges_plan(self, upload_url: str, size: int) -> Plan:
+        """State of an upload session and the ranges it still expects.
+        
+        The state is "active" with the ranges, "gone" once the session has
+        expired or completed (404), or "unknown" with None when there was no
+        usable answer.
+        """
+        try:
+            status, body = yield Send("GET", upload_url)
+        except TRANSPORT_ERRORS:
+            return "unknown", None
+        return upload_session_state(status, body, size)
+    
+    def _cancel_upload_session_plan(self, upload_url: str) -> Plan:
+        """DELETE an upload session that will not be finished; an expired one is already gone"""
+        try:
+            yield Send("DELETE", upload_url)
+        except TRANSPORT_ERRORS:
+            pass
+
+    def remote_tree(self, folder_id: str) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+        """Files under a folder by relative path, and folder ids by relative path ("" is the folder itself).
+        
+        The tree is listed one level at a time, the folders of each level in parallel.
+        """
+        files, folders = {}, {"": folder_id}
+        level = [("", folder_id)]
+        with ThreadPoolExecutor(max_workers=TREE_WALK_WORKERS) as pool:
+            while level:
+                listings = pool.map(lambda entry: [item for page in self.iter_items(entry[1]) for item in page],
+                                    level)
+                next_level = []
+                for (prefix, _), children in zip(level, listings):
+                    for item in children:
+                        path = prefix + item["name"]
+                        if "folder" in item:
+                            folders[path] = item["id"]
+                            next_level.append((path + "/", item["id"]))
+                        else:
+                            files[path] = item
+                level = next_level
+        return files, folders
+    
+    def analyze_storage(self, folder_id: Optional[str] = None, top_n: int = STORAGE_TOP_N,
+                        prune_bytes: int = STORAGE_PRUNE_BYTES) -> Dict:
+        """Where the space under a folder goes: folder totals, largest files and bytes per extension.
+        
+        Folders are listed one level at a time, the folders of each level in
+        parallel. Subtrees whose tag and size are unchanged since the last
+        scan are not listed again. Neither are empty folders, nor subtrees
+        smaller than ``prune_bytes``, which cannot hold a file that large;
+        their size comes from the folder size facet. Only files of at least
+        ``prune_bytes`` are ranked among the largest, so that list is
+        complete however much was pruned. See
+        ``StorageCache.report`` for the result, which also has ``name``
+        (empty for the drive root) and ``listed``, the number of folders listed.
+        """
+        folder_id = folder_id or self.current_folder_id
+        root = self.make_request("GET", f"me/drive/items/{folder_id}", params={"$select": STORAGE_SELECT})
+        if "error" in root:
+            return root
+        cache = self.storage_cache
+        cache.configure(top_n, prune_bytes)
+        stale = [] if cache.is_current(root) else [root]
+        listed = 0
+        workers = min(STORAGE_WORKERS, rate_controller.concurrency_limit)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while stale:
+                next_level = []
+                for folder, scan in zip(stale, pool.map(lambda folder: self._scan_folder(folder, top_n, prune_bytes),
+                                                        stale)):
+                    if scan is None:
+                        continue
+                    entry, subfolders = scan
+                    listed += 1
+                    cache.put(folder["id"], entry)
+                    next_level += [child for child in subfolders if not cache.is_current(child)]
+                stale = next_level
+        if not cache.is_current(root):
+            return {"error": {"code": "scanFailed", "message": f"Could not list {root.get('name', folder_id)}"}}
+        name = "" if "root" in root else root.get("name", "")
+        return {"name": name, **cache.report(root["id"], top_n), "listed": listed}
+    
+    def _scan_folder(self, folder: Dict, top_n: int, prune_bytes: int) -> Optional[Tuple[Dict, List[Dict]]]:
+        """List one folder into a StorageCache entry; also returns the subfolders to descend into"""
+        entry = {"tag": folder.get("cTag") or folder.get("eTag"), "size": folder.get("size", 0),
+                 "files": 0, "by_ext": {}, "largest": [], "folders": [], "pruned": []}
+        subfolders, files = [], []
+        endpoint = f"me/drive/items/{folder['id']}/children"
+        params = {"$top": LISTING_PAGE_SIZE, "$select": STORAGE_SELECT}
+        while endpoint:
+            data = self.make_request("GET", endpoint, params=params)
+            if "error" in data:
+                return None
+            for item in data.get("value", []):
+                size = item.get("size", 0) or 0
+                if "folder" not in item:
+                    files.append((size, item["name"], item["id"]))
+                    totals = entry["by_ext"].setdefault(file_extension(item["name"]), [0, 0])
+                    totals[0] += 1
+                    totals[1] += size
+                elif item["folder"].get("childCount") == 0:
+                    continue
+                elif size < prune_bytes:
+                    entry["pruned"].append((item["name"], size))
+                else:
+                    entry["folders"].append((item["id"], item["name"], size))
+                    subfolders.append(item)
+            endpoint, params = data.get("@odata.nextLink"), None
+        entry["files"] = len(files)
+        # Pruned subtrees may hold files up to prune_bytes, so only larger ones are ranked
+        entry["largest"] = heapq.nlargest(top_n, (file for file in files if file[0] >= prune_bytes))
+        return entry, subfolders
+    
+    def download_to(self, item: Dict, path: str) -> Optional[str]:
+        """Stream a file to ``path``, checking its quickXorHash on the way.
+        
+        The file appears only once complete and keeps the remote
+        modification time. Returns None on success, otherwise an error message.
+        """
+        url = f"{GRAPH_URL}/me/drive/items/{item['id']}/content"
+        for attempt in range(2):
+            token = self.access_token
+            response = graph_send("GET", url, headers={"Authorization": f"Bearer {token}"}, stream=True)
+            if response.status_code != 401 or attempt or not self.refresh_access_token(rejected_token=token):
+                break
+            metrics.record_retry("unauthorized")
+            response.close()
+        
+        hasher = QuickXorHash()
+        part_path = path + ".part"
+        with response:
+            if response.status_code != 200:
+                return f"HTTP {response.status_code}"
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(UPLOAD_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    f.write(chunk)
+        expected = item_hash(item)
+        if expected and hasher.b64digest() != expected:
+            os.remove(part_path)
+            return "quickXorHash mismatch"
+        mtime = item_mtime(item) or time.time()
+        os.utime(part_path, (mtime, mtime))
+        os.replace(part_path, path)
+        get_hash_cache().put(path, os.stat(path), hasher.b64digest())
+        return None
+    
+    def sync_folder(self, local_dir: str, folder_id: Optional[str] = None, direction: str = "both",
+                    progress: Optional[Callable[[str, str], None]] = None) -> Dict[str, List[str]]:
+        """Mirror a local directory and a OneDrive folder, transferring only files that differ.
+        
+        ``direction`` is "upload" (local to OneDrive), "download" or "both".
+        Files found on one side only are copied across when the direction
+        allows; nothing is deleted or replaced, so a local directory whose
+        name is taken by a remote file is reported as failed. Files on both
+        sides are unchanged when
+        sizes and quickXorHash match (size and mtime if Graph reports no
+        hash). Local hashes come from the hash cache, so unchanged files are
+        not read again. Otherwise the newer copy wins in "both" mode.
+        ``progress`` is called with (outcome, relative path) per file.
+        Returns relative paths by outcome: uploaded, downloaded, unchanged, failed.
+        """
+        folder_id = folder_id or self.current_folder_id
+        local_files, local_dirs = local_tree(local_dir)
+        remote_files, remote_folders = self.remote_tree(folder_id)
+        hashes = get_hash_cache()
+        result: Dict[str, List[str]] = {"uploaded": [], "downloaded": [], "unchanged": [], "failed": []}
+        
+        def record(outcome: str, path: str) -> None:
+            result[outcome].append(path)
+            if progress:
+                progress(outcome, path)
+        
+        def compare(path: str) -> Optional[str]:
+            """None when both copies match, otherwise the transfer that would reconcile them"""
+            stat, item = local_files[path], remote_files[path]
+            if stat.st_size == item.get("size"):
+                remote_hash = item_hash(item)
+                if remote_hash:
+                    if hashes.file_hash(os.path.join(local_dir, path), stat) == remote_hash:
+                        return None
+                elif abs(stat.st_mtime - item_mtime(item)) <= SYNC_MTIME_TOLERANCE:
+                    return None
+            if direction != "both":
+                return direction
+            return "upload" if stat.st_mtime > item_mtime(item) else "download"
+        
+        transfers = []
+        if direction in ("upload", "both"):
+            transfers += [("upload", path) for path in local_files if path not in remote_files]
+        if direction in ("download", "both"):
+            transfers += [("download", path) for path in remote_files if path not in local_files]
+        common = [path for path in local_files if path in remote_files]
+        with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as pool:
+            for path, action in zip(common, pool.map(compare, common)):
+                if action is None:
+                    record("unchanged", path)
+                else:
+                    transfers.append((action, path))
+        
+        # Parents before children, so every upload has a destination folder
+        if direction in ("upload", "both"):
+            for path in sorted(set(local_dirs) - set(remote_folders), key=lambda p: p.count("/")):
+                parent, _, name = path.rpartition("/")
+                if parent not in remote_folders:
+                    record("failed", path + "/")
+                    continue
+                folder = self.make_request("POST", f"me/drive/items/{remote_folders[parent]}/children", json={
+                    "name": name, "folder": {}, "@microsoft.graph.conflictBehavior": "fail"
+                })
+                if folder.get("error", {}).get("code") == "nameAlreadyExists":
+                    # Created since the listing, or a file of that name: use a folder, never replace
+                    folder = self.make_request("GET", f"me/drive/items/{remote_folders[parent]}:/{quote(name)}")
+                if "folder" in folder:
+                    remote_folders[path] = folder["id"]
+                    self.index_changed([folder], remote_folders[parent])
+                else:
+                    record("failed", path + "/")
+        
+        def transfer(action: str, path: str) -> None:
+            parent = path.rpartition("/")[0]
+            try:
+                if action == "upload":
+                    if parent not in remote_folders:
+                        raise OSError(f"could not create folder {parent}")
+                    item = self.upload_file(os.path.join(local_dir, path), folder_id=remote_folders[parent])
+                    error = item.get("error", {}).get("message") if "id" not in item else None
+                else:
+                    local_path = os.path.join(local_dir, *path.split("/"))
+                    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                    error = self.download_to(remote_files[path], local_path)
+            except (requests.RequestException, OSError) as e:
+                error = str(e)
+            record("failed" if error else {"upload": "uploaded", "download": "downloaded"}[action], path)
+        
+        with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as pool:
+            list(pool.map(lambda job: transfer(*job), transfers))
+        return result
+
+    def iter_folder_zip(self, folder_id: Optional[str] = None) -> Iterator[bytes]:
+        """Stream a folder and everything below it as a ZIP archive.
+        
+        Worker threads fetch up to ZIP_PREFETCH_FILES files ahead of the
+        archive writer, each into a queue of at most ZIP_QUEUE_CHUNKS chunks.
+        Memory use is therefore fixed, nothing is staged on disk, and the
+        archive can be larger than RAM. Entries are stored uncompressed (ZIP64
+        where needed). Sizes are taken from the content as it is written, not
+        from the metadata; a file that turns out to need ZIP64 although its
+        reported size did not aborts the archive. A download that breaks
+        partway resumes with a Range request. A file that cannot be fetched
+        at all is left out and listed in DOWNLOAD_ERRORS.txt.
+        """
+        files, folders = self.remote_tree(folder_id or self.current_folder_id)
+        sink = ChunkSink()
+        stop = threading.Event()
+        window: "deque[Tuple[str, Dict, queue.Queue]]" = deque()
+        pending = iter(files.items())
+        failed = []
+        
+        with ThreadPoolExecutor(max_workers=ZIP_PREFETCH_FILES) as pool, \
+                zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+            def refill() -> None:
+                while len(window) < ZIP_PREFETCH_FILES:
+                    entry = next(pending, None)
+                    if entry is None:
+                        return
+                    chunks = queue.Queue(ZIP_QUEUE_CHUNKS)
+                    pool.submit(self._fetch_content, entry[1], chunks, stop)
+                    window.append((entry[0], entry[1], chunks))
+            
+            try:
+                for path in folders:
+                    if path:
+                        archive.writestr(zipfile.ZipInfo(path + "/", zip_date_time(None)), b"")
+                refill()
+                while window:
+                    path, item, chunks = window.popleft()
+                    refill()
+                    chunk = chunks.get()
+                    if isinstance(chunk, Exception):
+                        failed.append(f"{path}: {chunk}")
+                        continue
+                    info = zipfile.ZipInfo(path, zip_date_time(item))
+                    # The reported size only picks the header format, with room for it to be off
+                    zip64 = item.get("size", 0) * 2 > zipfile.ZIP64_LIMIT
+                    written = 0
+                    with archive.open(info, "w", force_zip64=zip64) as entry:
+                        while chunk is not None:
+                            if isinstance(chunk, Exception):
+                                raise chunk
+                            written += len(chunk)
+                            if not zip64 and written > zipfile.ZIP64_LIMIT:
+                                # Stop now rather than fail at the end of a broken entry
+                                raise RuntimeError(f"{path} is larger than its reported size")
+                            entry.write(chunk)
+                            yield from sink.drain()
+                            chunk = chunks.get()
+                    yield from sink.drain()
+                if failed:
+                    archive.writestr(zipfile.ZipInfo("DOWNLOAD_ERRORS.txt", zip_date_time(None)), "\n".join(failed))
+            finally:
+                # Unblock fetchers still waiting on a full queue
+                stop.set()
+        # Closing the archive wrote the central directory
+        yield from sink.drain()
+    
+    def _fetch_content(self, item: Dict, chunks: queue.Queue, stop: threading.Event) -> None:
+        """Put a file's content into ``chunks`` in order, then None, or the error that ended it"""
+        def put(value) -> bool:
+            while not stop.is_set():
+                try:
+                    chunks.put(value, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        url = f"{GRAPH_URL}/me/drive/items/{item['id']}/content"
+        offset = 0
+        error: Exception = RuntimeError("download failed")
+        for attempt in range(UPLOAD_MAX_RETRIES + 1):
+            token = self.access_token
+            # Byte offsets must refer to the file itself, not a compressed transfer
+            headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "identity"}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+            try:
+                with graph_send("GET", url, headers=headers, stream=True) as response:
+                    if response.status_code == 401 and self.refresh_access_token(rejected_token=token):
+                        metrics.record_retry("unauthorized")
+                        continue
+                    if response.status_code != (206 if offset else 200):
+                        put(RuntimeError(f"HTTP {response.status_code}"))
+                        return
+                    for chunk in response.iter_content(ZIP_CHUNK_SIZE):
+                        if not put(chunk):
+                            return
+                        offset += len(chunk)
+                put(None)
+                return
+            except requests.RequestException as e:
+                error = e
+                metrics.record_retry("download_resume")
+                time.sleep(rate_controller.backoff(attempt))
+        put(error)
+    
+
+# -------------------- Async OneDrive Manager --------------------
+class AsyncOneDriveManager:
+    """Coroutine API over a OneDriveManager for async Gradio handlers.
+    
+    Requests go through the per-loop httpx client and the shared rate
+    controller, so a session waiting on Graph holds no worker thread. Tokens,
+    folder state, caches and indexes belong to the wrapped manager, which keeps
+    the background token refresh and delta sync working; its synchronous
+    helpers (``navigate``, ``search_index``, ...) are reachable through this
+    object as well. The requests themselves come from the manager's plans
+    (see Request Plans); this class only supplies the async transport.
+    """
+    def __init__(self, manager: OneDriveManager):
+        self.manager = manager
+    
+    def __getattr__(self, name: str):
+        return getattr(self.manager, name)
+    
+    async def make_request(self, method: str, endpoint: str, cost: int = 1, **kwargs) -> Dict:
+        """Async ``make_request``; takes httpx keyword arguments (``content`` for raw bodies)"""
+        manager = self.manager
+        if manager.token_expires_within(TOKEN_REFRESH_INTERVAL):
+            # MSAL is blocking, so refresh on a worker thread
+            await asyncio.to_thread(manager.refresh_access_token)
+        
+        headers = kwargs.pop("headers", {})
+        token = manager.access_token
+        headers["Authorization"] = f"Bearer {token}"
+        url = endpoint if "://" in endpoint else f"{GRAPH_URL}/{endpoint}"
+        response = await async_graph_send(method, url, cost=cost, headers=headers, **kwargs)
+        
+        if response.status_code == 401:  # Token revoked or expired early
+            if await asyncio.to_thread(manager.refresh_access_token, token):
+                metrics.record_retry("unauthorized")
+                headers["Authorization"] = f"Bearer {manager.access_token}"
+                response = await async_graph_send(method, url, cost=cost, headers=headers, **kwargs)
+        return response.json() if response.content else {}
+    
+    async def drive(self, plan: Plan, outcome: Optional[List] = None) -> AsyncIterator:
+        """Run a plan with coroutines, yielding the values it emits; its result is appended to ``outcome``"""
+        try:
+            step = next(plan)
+            while True:
+                if isinstance(step, Emit):
+                    yield step.value
+                    step = plan.send(None)
+                    continue
+                try:
+                    result = await self.perform(step)
+                except Exception as e:
+                    step = plan.throw(e)
+                else:
+                    step = plan.send(result)
+        except StopIteration as stop:
+            if outcome is not None:
+                outcome.append(stop.value)
+        finally:
+            plan.close()
+    
+    async def run(self, plan: Plan):
+        """Run a plan to completion and return its result"""
+        outcome = []
+        async for _ in self.drive(plan, outcome):
+            pass
+        return outcome[0]
+    
+    async def perform(self, step):
+        """Carry out one plan step without blocking the event loop"""
+        if isinstance(step, Call):
+            return await self.make_request(step.method, step.endpoint, cost=step.cost,
+                                           params=step.params, json=step.json, content=step.body)
+        if isinstance(step, Send):
+            data = await asyncio.to_thread(read_range, *step.file_range) if step.file_range else None
+            response = await async_graph_send(step.method, step.url, content=data,
+                                              headers=dict(step.headers or {}))
+            if step.check:
+                response.raise_for_status()
+            return response.status_code, response.json() if response.content else {}
+        if isinstance(step, Parallel):
+            workers = asyncio.Semaphore(max(1, step.limit))
+            
+            async def run_job(job):
+                async with workers:
+                    result = await (self.run(job) if inspect.isgenerator(job) else self.perform(job))
+                if step.done:
+                    step.done(job, result)
+                return result
+            
+            tasks = [asyncio.ensure_future(run_job(job)) for job in step.jobs]
+            try:
+                return list(await asyncio.gather(*tasks))
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+        if isinstance(step, Blocking):
+            return await asyncio.to_thread(step.func, *step.args)
+        if isinstance(step, Reserve):
+            return await step.budget.aacquire(step.size)
+        if isinstance(step, Pause):
+            return await asyncio.sleep(step.seconds)
+        raise TypeError(f"Unknown plan step: {step!r}")
+    
+    async def get_item(self, item_id: str) -> Dict:
+        """Look up an item, from the local index when it has been synced"""
+        return await self.run(self.manager._get_item_plan(item_id))
+    
+    async def breadcrumb(self) -> List[str]:
+        """Names of the folders in folder_stack below the root"""
+        return await self.run(self.manager._breadcrumb_plan())
+    
+    def iter_items(self, folder_id: Optional[str] = None,
+                   page_size: int = LISTING_PAGE_SIZE) -> AsyncIterator[List[DriveItem]]:
+        """Yield the children of a folder page by page (see ``OneDriveManager.iter_items``)"""
+        return self.drive(self.manager._listing_plan(folder_id, page_size))
+    
+    def prefetch_children(self, items: List[DriveItem]) -> None:
+        """Fetch the listings of the subfolders among ``items`` in the background (see ``ListingPrefetcher``)"""
+        manager = self.manager
+        if manager.index_ready.is_set():
+            # Listings already come from the local metadata index, with no network wait to hide
+            return
+        folders = [item for item in items if item.is_folder and not manager.listing_cache.has_fresh(item.id)]
+        manager.prefetcher.start(folders, self._prefetch_listing)
+    
+    async def _prefetch_listing(self, folder_id: str) -> None:
+        async for _ in self.iter_items(folder_id):
+            pass
+    
+    async def await_prefetch(self, folder_id: str) -> None:
+        """Cancel the background fetches, finishing the one of ``folder_id`` if it is running"""
+        task = self.manager.prefetcher.cancel(keep=folder_id)
+        if task is not None:
+            await asyncio.wait({task})
+    
+    async def list_items(self) -> List[DriveItem]:
+        """List all items in current folder"""
+        items = [item async for page in self.iter_items() for item in page]
+        return sorted(items, key=lambda x: (x.get("folder") is None, x["name"].lower()))
+    
+    async def create_folder(self, name: str) -> Dict:
+        """Create folder in current directory"""
+        return await self.run(self.manager._create_folder_plan(name))
+    
+    async def delete_item(self, item_id: str) -> bool:
+        """Delete specified item"""
+        return await self.run(self.manager._delete_item_plan(item_id))
+    
+    async def batch(self, sub_requests: List[Dict]) -> List[Dict]:
+        """Async ``OneDriveManager.batch``: several /$batch calls in flight, throttled ones retried"""
+        return await self.run(self.manager._batch_plan(sub_requests))
+    
+    async def delete_items(self, item_ids: List[str]) -> List[Dict]:
+        """Delete many items through JSON batching; returns one result row per item"""
+        return await self.run(self.manager._delete_items_plan(item_ids))
+    
+    async def create_folders(self, names: List[str]) -> List[Dict]:
+        """Create many folders in the current directory through JSON batching"""
+        return await self.run(self.manager._create_folders_plan(names))
+    
+    async def copy_items(self, item_ids: List[str], destination_id: Optional[str] = None) -> List[Dict]:
+        """Async ``OneDriveManager.copy_items``; the jobs are followed by the manager's copy monitor"""
+        return await self.run(self.manager._copy_items_plan(item_ids, destination_id))
+    
+    async def move_items(self, item_ids: List[str], destination_id: Optional[str] = None) -> List[Dict]:
+        """Async ``OneDriveManager.move_items``"""
+        return await self.run(self.manager._move_items_plan(item_ids, destination_id))
+    
+    async def upload_file(self, file_path: str, max_workers: int = UPLOAD_CONCURRENCY,
+                          folder_id: Optional[str] = None,
+                          progress: Optional[Callable[[int], None]] = None) -> Dict:
+        """Upload file to current directory (or ``folder_id``); file reads run on worker threads"""
+        return await self.run(self.manager._upload_file_plan(file_path, max_workers, folder_id, progress))
+    
+    async def upload_files(self, file_paths: List[str], tracker: Optional[UploadTracker] = None) -> List[Dict]:
+        """Upload many files into the current directory, UPLOAD_WORKERS at a time under a byte budget"""
+        return await self.run(self.manager._upload_files_plan(file_paths, tracker))
+    
+    async def create_upload_session(self, file_name: str, folder_id: Optional[str] = None) -> Dict:
+        return await self.run(self.manager._create_upload_session_plan(file_name, folder_id))
+    
+    async def upload_large_file(self, file_path: str, max_workers: int = UPLOAD_CONCURRENCY,
+                                folder_id: Optional[str] = None,
+                                progress: Optional[Callable[[int], None]] = None) -> Dict:
+        """Resumable chunked upload (see ``OneDriveManager.upload_large_file``)"""
+        return await self.run(self.manager._upload_large_file_plan(file_path, max_workers, folder_id, progress))
+    
+    async def download_file(self, item_id: str, dest_dir: str = DOWNLOAD_DIR) -> Dict:
+        """Stream a file to ``dest_dir/<item id>/``, resuming a partial download with a Range request.
+        
+        A partial file is resumed only when its sidecar records the item's
+        current eTag and size; otherwise the download starts over. Pass a
+        per-session ``dest_dir`` so sessions never share partial files.
+        Returns ``{"path": ...}`` or an error dict.
+        """
+        item = await self.get_item(item_id)
+        if "error" in item or "name" not in item:
+            return item if "error" in item else {"error": {"code": "itemNotFound", "message": item_id}}
+        item_dir = os.path.join(dest_dir, re.sub(r"[^\w!-]", "_", item["id"]))
+        os.makedirs(item_dir, exist_ok=True)
+        path = os.path.join(item_dir, os.path.basename(item["name"]))
+        part_path = path + ".part"
+        state_path = part_path + ".json"
+        state = {"eTag": item.get("eTag"), "size": item.get("size")}
+        try:
+            with open(state_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = None
+        if saved != state or not state["eTag"]:
+            # Left by another version of the file (or of unknown version): start over
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            with open(state_path, "w") as f:
+                json.dump(state, f)
+        url = f"{GRAPH_URL}/me/drive/items/{item_id}/content"
+        client = get_async_client()
+        
+        for attempt in range(GRAPH_MAX_RETRIES + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            # Undecoded bytes, so the partial file's length is a valid Range offset
+            headers = {"Authorization": f"Bearer {self.manager.access_token}", "Accept-Encoding": "identity"}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+            try:
+                # The slot covers sending the request and reading the headers, not the body
+                async with rate_controller.aslot():
+                    sent_at = time.monotonic()
+                    response = await client.send(client.build_request("GET", url, headers=headers),
+                                                 stream=True, follow_redirects=True)
+                try:
+                    status = response.status_code
+                    if status in (200, 206):
+                        # 200 means the server ignored the Range header: start over
+                        with open(part_path, "ab" if status == 206 else "wb") as f:
+                            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                                f.write(chunk)
+                finally:
+                    await response.aclose()
+            except httpx.HTTPError:
+                # Keep what arrived; the next attempt resumes from there
+                metrics.record_retry("download_resume")
+                await asyncio.sleep(rate_controller.backoff(attempt))
+                continue
+            
+            if status in (200, 206):
+                rate_controller.on_success()
+                os.replace(part_path, path)
+                os.remove(state_path)
+                return {"path": path}
+            if status in (429, 503):
+                # The controller's pause delays the next attempt
+                metrics.record_retry("throttled")
+                rate_controller.on_throttle(rate_controller.retry_delay(response.headers, attempt), sent_at)
+            elif status == 401 and attempt < GRAPH_MAX_RETRIES:
+                metrics.record_retry("unauthorized")
+                await asyncio.to_thread(self.manager.refresh_access_token,
+                                        headers["Authorization"][len("Bearer "):])
+            else:
+                return {"error": {"code": "downloadFailed", "message": f"HTTP {status} for {item['name']}"}}
+        return {"error": {"code": "downloadIncomplete",
+                          "message": f"Download of {item['name']} did not complete; retry to resume"}}
+
+# -------------------- Sessions --------------------
+def manager_record(manager: OneDriveManager) -> Dict:
+    """What another worker process needs to rebuild a session"""
+    return {
+        "access_token": manager.access_token,
+        "refresh_token": manager.refresh_token,
+        "expires_at": manager.expires_at,
+        "account_id": manager.account_id,
+        "folder_stack": manager.folder_stack
+    }
+
+def manager_from_record(record: Dict) -> OneDriveManager:
+    manager = OneDriveManager(
+        record["access_token"], record["refresh_token"],
+        expires_in=int(record["expires_at"] - time.time()), account_id=record["account_id"]
+    )
+    manager.folder_stack = list(record["folder_stack"])
+    manager.current_folder_id = manager.folder_stack[-1]
+    manager.start_index_sync()
+    return manager
+
+def manager_update(manager: OneDriveManager, record: Dict) -> None:
+    """Apply a newer record written by another worker to a live manager"""
+    manager.access_token = record["access_token"]
+    manager.refresh_token = record["refresh_token"]
+    manager.expires_at = record["expires_at"]
+    if record["folder_stack"] != manager.folder_stack:
+        manager.folder_stack = list(record["folder_stack"])
+        manager.current_folder_id = manager.folder_stack[-1]
+
+def manager_footprint(manager: OneDriveManager) -> int:
+    items = manager.listing_cache.item_count + len(manager.search_index) + len(manager.storage_cache)
+    return items * SESSION_ITEM_BYTES
+
+sessions = SessionStore(manager_from_record, manager_record, manager_footprint,
+                        path=SESSION_DB_PATH, memory_budget=SESSION_MEMORY_BUDGET,
+                        shrink=OneDriveManager.drop_caches, update=manager_update)
+metrics.add_gauge("app_sessions_live", "Sessions loaded in this process", lambda: len(sessions))
+
+def session_manager(session_id: Optional[str]) -> Optional[AsyncOneDriveManager]:
+    """The signed-in manager behind a browser's session id, or None"""
+    manager = sessions.get(session_id)
+    return AsyncOneDriveManager(manager) if manager else None
+
+def session_key(session_id: str) -> str:
+    """Directory name for a session's files on the server; the session id itself is a credential"""
+    return hashlib.sha256(session_id.encode()).hexdigest()[:32]
+
+def account_key(account_id: str) -> str:
+    """Directory name for an account's files on the server, kept across sign-ins"""
+    return hashlib.sha256(f"account:{account_id}".encode()).hexdigest()[:32]
+
+SESSION_EXPIRED = "Session expired; please sign in again"
 
 # -------------------- Enhanced Gradio Interface --------------------
 def create_interface():
@@ -121,6 +3045,8 @@ def create_interface():
                 )
                 nav_btn = gr.Button("Navigate", variant="primary")
                 back_btn = gr.Button("Back", variant="secondary")
+                previews = gr.Gallery(label="Previews", columns=4, height="auto", allow_preview=True)
+                more_previews_btn = gr.Button("More Previews", variant="secondary")
             
             # Operations Panel
             with gr.Column():
@@ -129,17 +3055,72 @@ def create_interface():
                         file_upload = gr.File(label="Select Files", file_count="multiple")
                         upload_btn = gr.Button("Upload", variant="primary")
                     
+                    with gr.TabItem("Download"):
+                        download_target = gr.Textbox(label="Item ID to Download (folders and blank for the current folder download as ZIP)")
+                        download_btn = gr.Button("Download", variant="primary")
+                        download_output = gr.File(label="Downloaded File")
+                        download_link = gr.Markdown()
+                    
                     with gr.TabItem("Manage"):
                         with gr.Row():
-                            new_folder = gr.Textbox(label="New Folder Name")
-                            create_btn = gr.Button("Create Folder", variant="primary")
-                        delete_target = gr.Textbox(label="Item ID to Delete")
-                        delete_btn = gr.Button("Delete Item", variant="stop")
+                            new_folder = gr.Textbox(label="New Folder Names (one per line)", lines=2)
+                            create_btn = gr.Button("Create Folders", variant="primary")
+                        delete_target = gr.Textbox(label="Item IDs to Delete (one per line or comma-separated)", lines=2)
+                        delete_btn = gr.Button("Delete Items", variant="stop")
+                        transfer_target = gr.Textbox(label="Item IDs to Copy or Move (one per line or comma-separated)", lines=2)
+                        transfer_destination = gr.Textbox(label="Destination Folder ID (blank for the current folder)")
+                        with gr.Row():
+                            copy_btn = gr.Button("Copy Items", variant="primary")
+                            move_btn = gr.Button("Move Items", variant="secondary")
+                    
+                    with gr.TabItem("Sync", visible=bool(SYNC_ROOT)):
+                        sync_dir = gr.Textbox(label="Directory in Your Server Sync Folder (blank for the folder itself)")
+                        sync_direction = gr.Radio(["both", "upload", "download"], value="both", label="Direction")
+                        sync_btn = gr.Button("Sync with Current Folder", variant="primary")
+                    
+                    with gr.TabItem("Search"):
+                        with gr.Row():
+                            search_query = gr.Textbox(label="Search Names")
+                            search_mode = gr.Radio(["substring", "prefix", "token"], value="substring", label="Match")
+                        with gr.Row():
+                            search_ext = gr.Textbox(label="Extension")
+                            search_min_mb = gr.Number(label="Min Size (MB)", value=0)
+                            search_kind = gr.Dropdown(["all", "file", "folder"], value="all", label="Type")
+                        search_btn = gr.Button("Search", variant="primary")
+                        search_results = gr.Dataframe(
+                            headers=["Type", "Name", "Path", "Size", "Modified", "ID"],
+                            datatype=["str", "str", "str", "str", "str", "str"],
+                            interactive=False
+                        )
+                    
+                    with gr.TabItem("Storage"):
+                        storage_btn = gr.Button("Analyze Current Folder", variant="primary")
+                        storage_summary = gr.Markdown()
+                        storage_folders = gr.Dataframe(
+                            headers=["Folder", "Size", "Files"],
+                            datatype=["str", "str", "str"],
+                            interactive=False
+                        )
+                        storage_files = gr.Dataframe(
+                            headers=[f"Largest Files (≥ {human_size(STORAGE_PRUNE_BYTES)})", "Size", "ID"],
+                            datatype=["str", "str", "str"],
+                            interactive=False
+                        )
+                        storage_types = gr.Dataframe(
+                            headers=["Type", "Files", "Size", "Share"],
+                            datatype=["str", "number", "str", "str"],
+                            interactive=False
+                        )
                 
                 status_log = gr.Textbox(label="Operation Log", interactive=False)
         
         # -------------------- State Management --------------------
-        od_manager = gr.State()
+        # Only an opaque session id lives in the browser; managers stay in the session store
+        od_session = gr.BrowserState(None, storage_key="onedrive_session")
+        # Rows of the current folder already offered for previews, and the gallery built from them
+        preview_state = gr.State({"offset": 0, "shown": []})
+        # [item id, is folder] of the row last selected in the folder tree
+        selected_row = gr.State(None)
         
         # -------------------- Event Handlers --------------------
         auth_btn.click(
@@ -154,10 +3135,45 @@ def create_interface():
             outputs=[auth_code, auth_url, auth_status]
         )
         
+        demo.load(
+            resume_session,
+            inputs=od_session,
+            outputs=[auth_section, main_interface]
+        ).then(
+            update_interface,
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
+        folder_tree.select(
+            select_row,
+            outputs=[selected_row, status_log]
+        )
+        
+        nav_btn.click(
+            open_selected,
+            inputs=[od_session, selected_row],
+            outputs=[selected_row, status_log]
+        ).then(
+            update_interface,
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
+        back_btn.click(
+            go_back,
+            inputs=od_session,
+            outputs=[selected_row, status_log]
+        ).then(
+            update_interface,
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
         auth_code.submit(
             exchange_code,
             inputs=auth_code,
-            outputs=[od_manager, auth_result]
+            outputs=[od_session, auth_result]
         ).success(
             lambda: (
                 gr.update(visible=False),
@@ -166,8 +3182,93 @@ def create_interface():
             outputs=[auth_section, main_interface]
         ).success(
             update_interface,
-            inputs=od_manager,
-            outputs=[current_path, folder_tree]
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
+        create_btn.click(
+            bulk_create_folders,
+            inputs=[od_session, new_folder],
+            outputs=status_log
+        ).then(
+            update_interface,
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
+        delete_btn.click(
+            bulk_delete_items,
+            inputs=[od_session, delete_target],
+            outputs=status_log
+        ).then(
+            update_interface,
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
+        copy_btn.click(
+            bulk_copy_items,
+            inputs=[od_session, transfer_target, transfer_destination],
+            outputs=status_log
+        ).then(
+            update_interface,
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
+        move_btn.click(
+            bulk_move_items,
+            inputs=[od_session, transfer_target, transfer_destination],
+            outputs=status_log
+        ).then(
+            update_interface,
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
+        upload_btn.click(
+            upload_many,
+            inputs=[od_session, file_upload],
+            outputs=status_log
+        ).then(
+            update_interface,
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
+        more_previews_btn.click(
+            more_previews,
+            inputs=[od_session, preview_state],
+            outputs=[previews, preview_state]
+        )
+        
+        download_btn.click(
+            download_item,
+            inputs=[od_session, download_target],
+            outputs=[download_output, download_link, status_log]
+        )
+        
+        sync_btn.click(
+            sync_directory,
+            inputs=[od_session, sync_dir, sync_direction],
+            outputs=status_log
+        ).then(
+            update_interface,
+            inputs=od_session,
+            outputs=[current_path, folder_tree, previews, preview_state]
+        )
+        
+        for trigger in (search_btn.click, search_query.submit):
+            trigger(
+                search_items,
+                inputs=[od_session, search_query, search_mode, search_ext, search_min_mb, search_kind],
+                outputs=[search_results, status_log]
+            )
+        
+        storage_btn.click(
+            analyze_storage,
+            inputs=od_session,
+            outputs=[storage_summary, storage_folders, storage_files, storage_types, status_log]
         )
         
         # Connect other operations...
@@ -176,36 +3277,350 @@ def create_interface():
 
 # -------------------- Improved Helper Functions --------------------
 def get_auth_url() -> str:
-    app = msal.ConfidentialClientApplication(
-        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
-    )
-    return app.get_authorization_request_url(SCOPE, redirect_uri=REDIRECT_URI)
+    return get_msal_app().get_authorization_request_url(SCOPE, redirect_uri=REDIRECT_URI)
 
-def exchange_code(code: str) -> Optional[OneDriveManager]:
-    app = msal.ConfidentialClientApplication(
-        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
-    )
+async def exchange_code(code: str) -> tuple:
+    # MSAL and the index sync start-up are blocking
+    manager = await asyncio.to_thread(login, code)
+    if manager is None:
+        raise gr.Error("Authentication failed")
+    return sessions.create(manager), gr.update(value="Signed in", visible=True)
+
+def resume_session(session_id: Optional[str]) -> tuple:
+    """Skip sign-in when the browser holds a session this or another worker still knows"""
+    if sessions.get(session_id) is None:
+        return gr.update(), gr.update()
+    return gr.update(visible=False), gr.update(visible=True)
+
+def login(code: str) -> Optional[OneDriveManager]:
+    app = get_msal_app()
     result = app.acquire_token_by_authorization_code(code, SCOPE, redirect_uri=REDIRECT_URI)
+    save_token_cache()
     if "access_token" in result:
-        return OneDriveManager(
+        username = result.get("id_token_claims", {}).get("preferred_username")
+        accounts = app.get_accounts(username=username) if username else []
+        manager = OneDriveManager(
             result["access_token"],
-            result.get("refresh_token", "")
+            result.get("refresh_token", ""),
+            expires_in=int(result.get("expires_in", 3600)),
+            account_id=accounts[0]["home_account_id"] if accounts else None
         )
+        manager.start_index_sync()
+        return manager
     return None
 
-def update_interface(manager: OneDriveManager) -> tuple:
-    items = manager.list_items()
-    formatted = [
-        ["📁" if "folder" in item else "📄", 
-         item["name"], 
-         item["id"],
-         "folder" in item]
-        for item in items
+def batch_result(target: str, response: Dict) -> Dict:
+    """Reduce a batch sub-response to a result row for the status log"""
+    body = response.get("body") or {}
+    error = body.get("error", {}).get("message", "") if isinstance(body, dict) else ""
+    return {"target": target, "status": response["status"], "ok": response["status"] < 300, "error": error}
+
+def format_results(rows: List[Dict]) -> str:
+    """Render per-item result rows as a plain-text table"""
+    failed = sum(not row["ok"] for row in rows)
+    lines = [f"{len(rows) - failed} succeeded, {failed} failed"]
+    lines += [
+        f"{'OK  ' if row['ok'] else 'FAIL'} {row['status']:>3}  {row['target']}"
+        + (f"  ({row['error']})" if row["error"] else "")
+        for row in rows
     ]
-    path = " ➔ ".join([item["name"] for item in manager.folder_stack[1:]]) or "Root"
-    return f"**Current Location:** {path}", formatted
+    return "\n".join(lines)
+
+async def bulk_create_folders(session_id: Optional[str], names_text: str) -> str:
+    manager = session_manager(session_id)
+    if manager is None:
+        return SESSION_EXPIRED
+    names = [name.strip() for name in (names_text or "").splitlines() if name.strip()]
+    if not names:
+        return "Enter at least one folder name"
+    return format_results(await manager.create_folders(names))
+
+async def bulk_delete_items(session_id: Optional[str], ids_text: str) -> str:
+    manager = session_manager(session_id)
+    if manager is None:
+        return SESSION_EXPIRED
+    item_ids = [item_id for item_id in re.split(r"[\s,]+", ids_text or "") if item_id]
+    if not item_ids:
+        return "Enter at least one item ID"
+    return format_results(await manager.delete_items(item_ids))
+
+async def bulk_move_items(session_id: Optional[str], ids_text: str, destination: str) -> str:
+    manager = session_manager(session_id)
+    if manager is None:
+        return SESSION_EXPIRED
+    item_ids = [item_id for item_id in re.split(r"[\s,]+", ids_text or "") if item_id]
+    if not item_ids:
+        return "Enter at least one item ID"
+    return format_results(await manager.move_items(item_ids, (destination or "").strip() or None))
+
+async def bulk_copy_items(session_id: Optional[str], ids_text: str, destination: str) -> AsyncIterator[str]:
+    """Start server-side copies, streaming job progress to the status log until all finish"""
+    manager = session_manager(session_id)
+    if manager is None:
+        yield SESSION_EXPIRED
+        return
+    item_ids = [item_id for item_id in re.split(r"[\s,]+", ids_text or "") if item_id]
+    if not item_ids:
+        yield "Enter at least one item ID"
+        return
+    rows = await manager.copy_items(item_ids, (destination or "").strip() or None)
+    rejected = [row for row in rows if "job" not in row]
+    header = format_results(rejected) + "\n\n" if rejected else ""
+    job_ids = [row["job"] for row in rows if "job" in row]
+    monitor = manager.copy_monitor
+    while True:
+        yield header + monitor.render(job_ids)
+        if all(job["status"] in monitor.FINISHED for job in monitor.status(job_ids)):
+            return
+        await asyncio.sleep(UPLOAD_UI_INTERVAL)
+
+async def upload_many(session_id: Optional[str], files: Optional[List]) -> AsyncIterator[str]:
+    """Upload the selected files, streaming progress to the status log"""
+    manager = session_manager(session_id)
+    if manager is None:
+        yield SESSION_EXPIRED
+        return
+    # Depending on the Gradio version files arrive as paths or tempfile wrappers
+    paths = [f if isinstance(f, str) else f.name for f in files or []]
+    if not paths:
+        yield "Select at least one file"
+        return
+    tracker = UploadTracker(paths)
+    upload = asyncio.ensure_future(manager.upload_files(paths, tracker))
+    while not upload.done():
+        yield tracker.render()
+        await asyncio.wait({upload}, timeout=UPLOAD_UI_INTERVAL)
+    yield tracker.render()
+
+async def download_item(session_id: Optional[str], item_id: str) -> tuple:
+    manager = session_manager(session_id)
+    if manager is None:
+        return None, "", SESSION_EXPIRED
+    item = await manager.get_item((item_id or "").strip() or manager.current_folder_id)
+    if "error" in item:
+        return None, "", f"Download failed: {item['error'].get('message', '')}"
+    if "folder" in item:
+        # The archive is streamed to the browser by the /download/zip route, never staged on disk
+        name = f"{'OneDrive' if 'root' in item else item['name']}.zip"
+        token = archive_links.create(session_id, item["id"], name)
+        return None, f"[Download {name}](/download/zip/{token}) (link valid for {ZIP_LINK_TTL // 60} minutes)", \
+            f"Archive of {name[:-4]} ready to download"
+    result = await manager.download_file(item["id"], os.path.join(DOWNLOAD_DIR, session_key(session_id)))
+    if "error" in result:
+        return None, "", f"Download failed: {result['error'].get('message', '')}"
+    return result["path"], "", f"Downloaded {os.path.basename(result['path'])}"
+
+def session_sync_dir(manager: AsyncOneDriveManager, session_id: str, relative: str) -> Optional[str]:
+    """Resolve a Sync tab path inside the account's own directory under SYNC_ROOT.
+    
+    The directory belongs to the signed-in account, so trees synced in an
+    earlier session are found again (with their cached hashes); a session
+    whose account is unknown gets a directory of its own. Returns None for
+    paths that leave it, through ".." or a symlink; every other server path
+    stays out of reach of signed-in visitors.
+    """
+    owner = account_key(manager.account_id) if manager.account_id else session_key(session_id)
+    base = os.path.realpath(os.path.join(SYNC_ROOT, owner))
+    path = os.path.realpath(os.path.join(base, relative))
+    if os.path.commonpath([base, path]) != base:
+        return None
+    return path
+
+async def sync_directory(session_id: Optional[str], local_dir: str, direction: str) -> AsyncIterator[str]:
+    """Sync a server-side directory with the current folder, streaming counts to the status log"""
+    manager = session_manager(session_id)
+    if manager is None:
+        yield SESSION_EXPIRED
+        return
+    if not SYNC_ROOT:
+        yield "Folder sync is disabled on this server"
+        return
+    relative = (local_dir or "").strip()
+    local_dir = session_sync_dir(manager, session_id, relative)
+    if local_dir is None:
+        yield f"Not inside your sync folder: {relative}"
+        return
+    os.makedirs(local_dir, exist_ok=True)
+    counts = {"uploaded": 0, "downloaded": 0, "unchanged": 0, "failed": 0}
+    
+    def tally(outcome: str, path: str) -> None:
+        counts[outcome] += 1
+    
+    # Hashing and transfers run on the manager's thread pools
+    sync = asyncio.ensure_future(asyncio.to_thread(
+        manager.sync_folder, local_dir, direction=direction, progress=tally
+    ))
+    while not sync.done():
+        yield "Syncing... " + ", ".join(f"{count} {outcome}" for outcome, count in counts.items())
+        await asyncio.wait({sync}, timeout=UPLOAD_UI_INTERVAL)
+    result = sync.result()
+    lines = ["Sync complete: " + ", ".join(f"{len(paths)} {outcome}" for outcome, paths in result.items())]
+    lines += [f"FAIL {path}" for path in result["failed"]]
+    yield "\n".join(lines)
+
+async def analyze_storage(session_id: Optional[str]) -> tuple:
+    """Storage report for the current folder: summary, then folder, file and type tables"""
+    manager = session_manager(session_id)
+    if manager is None:
+        return gr.update(), [], [], [], SESSION_EXPIRED
+    started = time.perf_counter()
+    # The scan lists folders on the manager's thread pool
+    report = await asyncio.to_thread(manager.analyze_storage)
+    if "error" in report:
+        return gr.update(), [], [], [], f"Analysis failed: {report['error'].get('message', '')}"
+    total = report["size"] or 1
+    summary = f"**{report['name'] or 'Root'}:** {human_size(report['size'])} in {report['files']} files"
+    folders = [[path, human_size(size), "" if files is None else str(files)]
+               for path, size, files in report["folders"][:STORAGE_TOP_N]]
+    files = [[path, human_size(size), item_id] for path, size, item_id in report["largest"]]
+    types = [[ext, count, human_size(size), f"{size / total:.1%}"] for ext, count, size in report["types"]]
+    status = f"Storage analyzed in {time.perf_counter() - started:.1f} s ({report['listed']} folders listed)"
+    return summary, folders, files, types, status
+
+# Searching is CPU-bound and in memory, so it stays a plain function on a worker thread
+def search_items(session_id: Optional[str], query: str, mode: str, extension: str,
+                 min_mb: Optional[float], kind: str) -> tuple:
+    manager = session_manager(session_id)
+    if manager is None:
+        return [], SESSION_EXPIRED
+    manager.ensure_search_index()
+    started = time.perf_counter()
+    results = manager.search_index.search(
+        query or "", mode, extension=extension or None,
+        min_size=int(min_mb * 1024 * 1024) if min_mb else None,
+        kind=None if kind == "all" else kind
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    rows = [
+        ["📁" if r["folder"] else "📄", r["name"], r["path"],
+         "" if r["folder"] else human_size(r["size"]), r["modified"][:16].replace("T", " "), r["id"]]
+        for r in results
+    ]
+    status = f"{len(rows)} results from {len(manager.search_index)} indexed items in {elapsed_ms:.1f} ms"
+    return rows, status
+
+def select_row(evt: gr.SelectData) -> tuple:
+    """Remember the folder tree row the user clicked"""
+    _, name, item_id, is_folder = evt.row_value
+    is_folder = str(is_folder).lower() == "true"
+    return [item_id, is_folder], f"Selected {'folder' if is_folder else 'file'} {name} ({item_id})"
+
+def open_selected(session_id: Optional[str], selected: Optional[List]) -> tuple:
+    manager = session_manager(session_id)
+    if manager is None:
+        return None, SESSION_EXPIRED
+    if not selected or not selected[1]:
+        return selected, "Select a folder to open"
+    manager.navigate(selected[0], True)
+    sessions.save(session_id)
+    return None, ""
+
+def go_back(session_id: Optional[str]) -> tuple:
+    manager = session_manager(session_id)
+    if manager is None:
+        return None, SESSION_EXPIRED
+    manager.go_back()
+    sessions.save(session_id)
+    return None, ""
+
+async def update_interface(session_id: Optional[str]) -> AsyncIterator[tuple]:
+    """Stream the current folder into the UI as listing pages arrive"""
+    manager = session_manager(session_id)
+    if manager is None:
+        yield gr.update(), gr.update(), gr.update(), gr.update()
+        return
+    # A listing prefetched for this folder is finished rather than fetched again
+    await manager.await_prefetch(manager.current_folder_id)
+    path = " ➔ ".join(await manager.breadcrumb()) or "Root"
+    location = f"**Current Location:** {path}"
+    formatted = []
+    items = []
+    last_update = 0.0
+    async for page in manager.iter_items():
+        items.extend(page)
+        formatted.extend(
+            ["📁" if "folder" in item else "📄", 
+             item["name"], 
+             item["id"],
+             "folder" in item]
+            for item in page
+        )
+        if time.monotonic() - last_update >= LISTING_UI_INTERVAL:
+            last_update = time.monotonic()
+            yield location, list(formatted), [], {"offset": 0, "shown": []}
+    formatted.sort(key=lambda row: (not row[3], row[1].lower()))
+    items.sort(key=lambda item: (not item.is_folder, item.name.lower()))
+    # The next click most likely opens one of these subfolders
+    manager.prefetch_children([item for item in items if item.is_folder])
+    yield location, formatted, [], {"offset": 0, "shown": []}
+    # Previews follow the listing instead of holding it up
+    shown, state = await preview_page(manager, items, {"offset": 0, "shown": []})
+    yield location, formatted, shown, state
+
+async def preview_page(manager: AsyncOneDriveManager, items: List[DriveItem], state: Dict) -> Tuple[List, Dict]:
+    """Gallery entries with the next THUMBNAIL_PAGE_SIZE previewable rows added, and the new state"""
+    candidates = [item for item in items if has_thumbnail(item)]
+    page = candidates[state["offset"]:state["offset"] + THUMBNAIL_PAGE_SIZE]
+    paths = await asyncio.to_thread(manager.thumbnails, page) if page else {}
+    shown = state["shown"] + [(paths[item["id"]], item["name"]) for item in page if item["id"] in paths]
+    return shown, {"offset": state["offset"] + len(page), "shown": shown}
+
+async def more_previews(session_id: Optional[str], state: Dict) -> tuple:
+    """Load the next page of previews of the current folder"""
+    manager = session_manager(session_id)
+    if manager is None:
+        return gr.update(), state
+    shown, state = await preview_page(manager, await manager.list_items(), state)
+    return shown, state
+
+# -------------------- Web App --------------------
+class ArchiveLinks:
+    """One-time links to folder ZIP archives, each bound to the session that asked for it"""
+    def __init__(self, ttl: float = ZIP_LINK_TTL):
+        self.ttl = ttl
+        # token -> (session id, folder id, file name, expiry)
+        self.links: Dict[str, Tuple[str, str, str, float]] = {}
+        self.lock = threading.Lock()
+    
+    def create(self, session_id: str, folder_id: str, name: str) -> str:
+        token = secrets.token_urlsafe(24)
+        now = time.monotonic()
+        with self.lock:
+            self.links = {key: link for key, link in self.links.items() if link[3] > now}
+            self.links[token] = (session_id, folder_id, name, now + self.ttl)
+        return token
+    
+    def take(self, token: str) -> Optional[Tuple[str, str, str]]:
+        """The (session id, folder id, name) of an unexpired link, which is used up"""
+        with self.lock:
+            link = self.links.pop(token, None)
+        if link is None or link[3] <= time.monotonic():
+            return None
+        return link[:3]
+
+archive_links = ArchiveLinks()
+
+def create_app() -> FastAPI:
+    """The Gradio interface mounted at / next to the archive download route"""
+    app = FastAPI()
+    
+    @app.get("/download/zip/{token}")
+    def download_zip(token: str) -> StreamingResponse:
+        link = archive_links.take(token)
+        manager = sessions.get(link[0]) if link else None
+        if manager is None:
+            raise HTTPException(status_code=404, detail="Download link expired")
+        _, folder_id, name = link
+        # Starlette pulls the generator on a worker thread, chunk by chunk, as the client reads
+        return StreamingResponse(manager.iter_folder_zip(folder_id), media_type="application/zip", headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(name)}"
+        })
+    
+    return gr.mount_gradio_app(app, create_interface(), path="/")
 
 if __name__ == "__main__":
-    interface = create_interface()
-    interface.launch(server_port=8000)
+    app = create_app()
+    # Prometheus scrapes http://METRICS_HOST:METRICS_PORT/metrics
+    start_metrics_server(default_port=METRICS_DEFAULT_PORT)
+    uvicorn.run(app, host="127.0.0.1", port=8000)
   
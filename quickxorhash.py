@@ -0,0 +1,64 @@
+import base64
+from typing import BinaryIO
+
+# -------------------- Configuration --------------------
+WIDTH_IN_BITS = 160
+SHIFT = 11
+# Bytes this far apart are XORed in at the same bit offset (160 * 11 is a multiple of 160)
+PERIOD = WIDTH_IN_BITS
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+_STATE_MASK = (1 << WIDTH_IN_BITS) - 1
+
+# -------------------- quickXorHash --------------------
+class QuickXorHash:
+    """Streaming quickXorHash, the content hash OneDrive reports for every file.
+
+    Byte ``i`` is XORed into a 160-bit state at bit offset ``i * 11 mod 160``
+    (wrapping around), and the final state has the total length XORed into
+    its last 64 bits. Since bytes 160 apart share an offset, each chunk is
+    first XOR-folded down to 160 bytes with big-integer arithmetic, so the
+    per-byte work runs in C rather than in a Python loop.
+    """
+    def __init__(self):
+        self.state = 0
+        self.length = 0
+
+    def update(self, data: bytes) -> None:
+        if not data:
+            return
+        folded = int.from_bytes(data, "little")
+        # Halve the number of 160-byte blocks until one is left; missing
+        # blocks past the end are zeros and do not change the XOR
+        blocks = 1 << (-(-len(data) // PERIOD) - 1).bit_length()
+        while blocks > 1:
+            blocks //= 2
+            bits = blocks * PERIOD * 8
+            folded = (folded >> bits) ^ (folded & ((1 << bits) - 1))
+
+        state = self.state
+        for position, byte in enumerate(folded.to_bytes(PERIOD, "little")):
+            if byte:
+                value = byte << ((self.length + position) * SHIFT % WIDTH_IN_BITS)
+                state ^= (value & _STATE_MASK) ^ (value >> WIDTH_IN_BITS)
+        self.state = state
+        self.length += len(data)
+
+    def digest(self) -> bytes:
+        value = self.state ^ ((self.length & ((1 << 64) - 1)) << (WIDTH_IN_BITS - 64))
+        return value.to_bytes(WIDTH_IN_BITS // 8, "little")
+
+    def b64digest(self) -> str:
+        """The digest in the base64 form Graph uses for ``file.hashes.quickXorHash``"""
+        return base64.b64encode(self.digest()).decode()
+
+def hash_stream(f: BinaryIO, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """quickXorHash of a binary stream, read ``chunk_size`` bytes at a time"""
+    hasher = QuickXorHash()
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+        hasher.update(chunk)
+    return hasher.b64digest()
+
+def hash_file(path: str, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    with open(path, "rb") as f:
+        return hash_stream(f, chunk_size)
@@ -0,0 +1,263 @@
+import copy
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# -------------------- Configuration --------------------
+# Sessions unused for this long are dropped from memory and from the shared store
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", str(8 * 3600)))
+SESSION_MAX_ACTIVE = int(os.getenv("SESSION_MAX_ACTIVE", "500"))
+SESSION_SWEEP_INTERVAL = 60
+# last_used in the shared store is rewritten at most this often per session
+SESSION_TOUCH_INTERVAL = 60
+
+# -------------------- Session Store --------------------
+class SessionStore:
+    """Live sessions keyed by an opaque id, with idle and memory-based eviction.
+
+    Each live session (a manager, or just a token record) is kept in an LRU
+    in this process. With ``path`` set, a JSON record of it (tokens, folder
+    position) is also kept in a shared SQLite file, so any worker process
+    can rebuild the session with ``build(record)`` after a restart or when a
+    load balancer sends the user elsewhere. ``snapshot(session)`` produces
+    the record; ``footprint(session)`` estimates its memory in bytes and
+    ``shrink(session)`` frees what it can rebuild, such as caches.
+
+    Every record carries a version. On each ``get`` (and on ``save``) a live
+    session is reconciled with the shared store: a newer record written by
+    another worker is applied with ``update(session, record)``, and only
+    the fields this worker changed are written back, with a compare-and-swap
+    on the version, so workers never roll back each other's changes.
+
+    Sessions idle past ``idle_timeout`` are removed everywhere. Past
+    ``memory_budget`` bytes the least recently used sessions are shrunk
+    first. Only if that is not enough, or past ``max_active`` live
+    sessions, are the least recently used ones unloaded, and only when
+    their record is in the shared store for the next request to rebuild
+    them from; the most recently used session, the one being served, is
+    never unloaded.
+    """
+    def __init__(self, build: Callable[[Dict], Any], snapshot: Callable[[Any], Dict],
+                 footprint: Optional[Callable[[Any], int]] = None, path: str = "",
+                 idle_timeout: float = SESSION_IDLE_TIMEOUT, max_active: int = SESSION_MAX_ACTIVE,
+                 memory_budget: Optional[int] = None, shrink: Optional[Callable[[Any], None]] = None,
+                 update: Optional[Callable[[Any, Dict], None]] = None):
+        self.build = build
+        self.snapshot = snapshot
+        self.update = update
+        self.footprint = footprint
+        self.shrink = shrink
+        self.idle_timeout = idle_timeout
+        self.max_active = max_active
+        self.memory_budget = memory_budget
+        # session id -> {"session", "last_used", "saved_at", "record", "version"}, least recently
+        # used first; record and version are the shared record as this worker last read or wrote it
+        self.live: "OrderedDict[str, Dict]" = OrderedDict()
+        self.lock = threading.RLock()
+        self.conn = None
+        if path:
+            # The records hold tokens: create the file readable by the owner only
+            os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+            self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+            with self.lock, self.conn:
+                self.conn.execute("PRAGMA journal_mode=WAL")
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS sessions "
+                    "(id TEXT PRIMARY KEY, record TEXT, last_used REAL, version INTEGER NOT NULL DEFAULT 0)"
+                )
+                columns = [row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")]
+                if "version" not in columns:
+                    self.conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._sweeper_started = False
+
+    def __len__(self) -> int:
+        return len(self.live)
+
+    def create(self, session: Any) -> str:
+        """Register a new live session and return its id"""
+        session_id = secrets.token_urlsafe(24)
+        now = time.time()
+        record = self._record(session)
+        with self.lock:
+            self.live[session_id] = {"session": session, "last_used": now, "saved_at": now,
+                                     "record": record, "version": 0}
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT INTO sessions (id, record, last_used, version) VALUES (?, ?, ?, 0)",
+                        (session_id, json.dumps(record), now)
+                    )
+            self._start_sweeper()
+        self.evict()
+        return session_id
+
+    def get(self, session_id: Optional[str]) -> Optional[Any]:
+        """The live session for an id, rebuilt from the shared store if needed; None if unknown or expired"""
+        if not session_id:
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.live.get(session_id)
+            if entry is not None:
+                self.live.move_to_end(session_id)
+                entry["last_used"] = now
+                if not self._sync(session_id, entry):
+                    # Signed out or expired in another worker
+                    del self.live[session_id]
+                    return None
+                return entry["session"]
+            row = self._load(session_id, now)
+        if row is None:
+            return None
+        record, version = row
+        # Building may start threads or touch the network; do it outside the lock
+        session = self.build(copy.deepcopy(record))
+        with self.lock:
+            entry = self.live.setdefault(session_id, {"session": session, "last_used": now, "saved_at": 0.0,
+                                                      "record": record, "version": version})
+            self._sync(session_id, entry)
+            self._start_sweeper()
+        self.evict()
+        return entry["session"]
+
+    def save(self, session_id: Optional[str]) -> None:
+        """Write what a request changed in a live session to the shared store now"""
+        with self.lock:
+            entry = self.live.get(session_id) if session_id else None
+            if entry is not None:
+                self._sync(session_id, entry)
+
+    def sync_all(self) -> None:
+        """Reconcile every live session with the shared store, e.g. to publish refreshed tokens"""
+        with self.lock:
+            for session_id, entry in list(self.live.items()):
+                if not self._sync(session_id, entry):
+                    del self.live[session_id]
+
+    def remove(self, session_id: str) -> None:
+        """End a session in this process and in the shared store"""
+        with self.lock:
+            self.live.pop(session_id, None)
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def evict(self) -> None:
+        """Drop idle sessions, then shrink and unload least recently used ones until under the limits"""
+        now = time.time()
+        with self.lock:
+            for session_id in [sid for sid, entry in self.live.items()
+                               if now - entry["last_used"] > self.idle_timeout]:
+                del self.live[session_id]
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute("DELETE FROM sessions WHERE last_used < ?", (now - self.idle_timeout,))
+
+            sizes = {sid: self.footprint(entry["session"]) for sid, entry in self.live.items()} \
+                if self.footprint and self.memory_budget is not None else {}
+            used = sum(sizes.values())
+            if sizes and used > self.memory_budget and self.shrink:
+                for session_id, entry in list(self.live.items()):
+                    if used <= self.memory_budget:
+                        break
+                    self.shrink(entry["session"])
+                    size = self.footprint(entry["session"])
+                    used -= sizes[session_id] - size
+                    sizes[session_id] = size
+            # Without the shared store an unloaded session could not be rebuilt: its user would be signed out
+            while self.conn is not None and len(self.live) > 1 and (
+                len(self.live) > self.max_active or (sizes and used > self.memory_budget)
+            ):
+                session_id, entry = self.live.popitem(last=False)
+                # Keep the newest tokens so the session can be rebuilt later
+                entry["saved_at"] = 0.0
+                self._sync(session_id, entry)
+                used -= sizes.get(session_id, 0)
+
+    def _record(self, session: Any) -> Dict:
+        """A snapshot detached from the session, so later changes to it show up as differences"""
+        return json.loads(json.dumps(self.snapshot(session)))
+
+    def _sync(self, session_id: str, entry: Dict) -> bool:
+        """With the lock held: exchange changes between a live session and its shared record.
+
+        Returns False if the record is gone from the shared store.
+        """
+        if self.conn is None:
+            return True
+        while True:
+            row = self.conn.execute(
+                "SELECT record, version FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            changed = {key: value for key, value in self._record(entry["session"]).items()
+                       if entry["record"].get(key) != value}
+            if row[1] != entry["version"]:
+                # Another worker wrote since: take its record, keeping this worker's own changes
+                record = {**json.loads(row[0]), **changed}
+                self._apply(entry, copy.deepcopy(record))
+            else:
+                record = {**entry["record"], **changed}
+            touch = entry["last_used"] - entry["saved_at"] >= SESSION_TOUCH_INTERVAL
+            if not changed:
+                entry["record"], entry["version"] = record, row[1]
+                if touch:
+                    self._touch(session_id, entry)
+                return True
+            with self.conn:
+                written = self.conn.execute(
+                    "UPDATE sessions SET record = ?, version = version + 1, last_used = MAX(last_used, ?) "
+                    "WHERE id = ? AND version = ?",
+                    (json.dumps(record), entry["last_used"], session_id, row[1])
+                ).rowcount
+            if written:
+                entry["record"], entry["version"] = record, row[1] + 1
+                entry["saved_at"] = entry["last_used"]
+                return True
+            # Lost a race with another worker's write: merge against its record and try again
+
+    def _apply(self, entry: Dict, record: Dict) -> None:
+        if self.update is not None:
+            self.update(entry["session"], record)
+        else:
+            entry["session"] = self.build(record)
+
+    def _touch(self, session_id: str, entry: Dict) -> None:
+        entry["saved_at"] = entry["last_used"]
+        with self.conn:
+            self.conn.execute(
+                "UPDATE sessions SET last_used = MAX(last_used, ?) WHERE id = ?", (entry["last_used"], session_id)
+            )
+
+    def _load(self, session_id: str, now: float) -> Optional[Tuple[Dict, int]]:
+        if self.conn is None:
+            return None
+        row = self.conn.execute(
+            "SELECT record, last_used, version FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or now - row[1] > self.idle_timeout:
+            return None
+        return json.loads(row[0]), row[2]
+
+    def _start_sweeper(self) -> None:
+        """With the lock held: start the background eviction thread on first use"""
+        if self._sweeper_started:
+            return
+        self._sweeper_started = True
+
+        def sweep() -> None:
+            while True:
+                time.sleep(SESSION_SWEEP_INTERVAL)
+                try:
+                    self.sync_all()
+                    self.evict()
+                except Exception:
+                    pass  # retried on the next pass
+
+        threading.Thread(target=sweep, daemon=True).start()
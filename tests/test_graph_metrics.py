@@ -0,0 +1,45 @@
+import pytest
+
+from graph_metrics import GraphMetrics
+
+sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor  # noqa: E402
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter  # noqa: E402
+
+
+def make_tracer():
+    exporter = InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    return provider.get_tracer("test"), exporter
+
+
+def test_span_hook_records_request_attributes():
+    tracer, exporter = make_tracer()
+    metrics = GraphMetrics()
+    metrics.add_span_hook(tracer.start_as_current_span)
+    url = "https://graph.microsoft.com/v1.0/me/drive/items/ABC123!456/children"
+    with metrics.track("get", url) as call:
+        call["status"] = 200
+        call["bytes_out"] = 0
+        call["bytes_in"] = 512
+    (span,) = exporter.get_finished_spans()
+    assert span.name == "graph.request"
+    assert span.attributes["http.request.method"] == "GET"
+    assert span.attributes["graph.endpoint"] == "/me/drive/items/{id}/children"
+    assert span.attributes["url.full"] == url
+    assert span.attributes["http.response.status_code"] == 200
+    assert span.attributes["graph.bytes_received"] == 512
+
+
+def test_span_hook_records_failed_request():
+    tracer, exporter = make_tracer()
+    metrics = GraphMetrics()
+    metrics.add_span_hook(tracer.start_as_current_span)
+    with pytest.raises(ConnectionError):
+        with metrics.track("post", "https://graph.microsoft.com/v1.0/$batch"):
+            raise ConnectionError("reset")
+    (span,) = exporter.get_finished_spans()
+    assert "http.response.status_code" not in span.attributes
+    assert not span.status.is_ok
+    assert metrics.requests[("POST", "/$batch", "error")] == 1
@@ -0,0 +1,40 @@
+import base64
+import io
+import random
+
+from quickxorhash import QuickXorHash, hash_stream
+
+
+def reference_hash(data):
+    """Bit-by-bit quickXorHash, written straight from the definition"""
+    bits = [0] * 160
+    for i, byte in enumerate(data):
+        offset = i * 11 % 160
+        for k in range(8):
+            bits[(offset + k) % 160] ^= (byte >> k) & 1
+    state = sum(bit << position for position, bit in enumerate(bits))
+    state ^= len(data) << 96
+    return base64.b64encode(state.to_bytes(20, "little")).decode()
+
+
+def quick_xor_hash(data):
+    hasher = QuickXorHash()
+    hasher.update(data)
+    return hasher.b64digest()
+
+
+def test_known_vectors():
+    assert quick_xor_hash(b"") == "AAAAAAAAAAAAAAAAAAAAAAAAAAA="
+    assert quick_xor_hash(base64.b64decode("Sg==")) == "SgAAAAAAAAAAAAAAAQAAAAAAAAA="
+
+
+def test_multi_block_input_matches_reference():
+    data = random.Random(7).randbytes(3 * 160 + 37)
+    assert quick_xor_hash(data) == reference_hash(data)
+
+
+def test_chunked_updates_match_single_update():
+    data = random.Random(11).randbytes(5000)
+    # Chunk sizes that are not multiples of the 160-byte period shift every later offset
+    assert hash_stream(io.BytesIO(data), chunk_size=333) == quick_xor_hash(data)
+    assert hash_stream(io.BytesIO(data), chunk_size=1) == reference_hash(data)
@@ -0,0 +1,36 @@
+from session_store import SessionStore
+
+
+def make_store(path):
+    return SessionStore(dict, dict, path=str(path), update=dict.update)
+
+
+def test_workers_see_each_others_changes(tmp_path):
+    db = tmp_path / "sessions.db"
+    worker_a, worker_b = make_store(db), make_store(db)
+    session_id = worker_a.create({"folder_stack": ["root"], "refresh_token": "r1"})
+    # Both workers have the session in memory
+    assert worker_b.get(session_id)["folder_stack"] == ["root"]
+    assert worker_a.get(session_id)["folder_stack"] == ["root"]
+
+    worker_b.get(session_id)["folder_stack"].append("F1")
+    worker_b.save(session_id)
+    assert worker_a.get(session_id)["folder_stack"] == ["root", "F1"]
+
+    # Worker A rotates the refresh token while worker B navigates: both changes survive
+    worker_a.get(session_id)["refresh_token"] = "r2"
+    worker_b.get(session_id)["folder_stack"].append("F2")
+    worker_b.save(session_id)
+    worker_a.save(session_id)
+    assert worker_b.get(session_id) == {"folder_stack": ["root", "F1", "F2"], "refresh_token": "r2"}
+    assert worker_a.get(session_id) == {"folder_stack": ["root", "F1", "F2"], "refresh_token": "r2"}
+
+
+def test_removed_session_is_dropped_by_other_workers(tmp_path):
+    db = tmp_path / "sessions.db"
+    worker_a, worker_b = make_store(db), make_store(db)
+    session_id = worker_a.create({"refresh_token": "r1"})
+    assert worker_b.get(session_id) is not None
+    worker_a.remove(session_id)
+    assert worker_b.get(session_id) is None
+    assert len(worker_b) == 0